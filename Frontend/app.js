@@ -4,6 +4,16 @@
 const qs = new URLSearchParams(location.search);
 const $ = (s, r = document) => r.querySelector(s);
 const API_BASE = (localStorage.getItem("API_BASE") || "http://127.0.0.1:8010").replace(/\/$/, "");
+// Identifiant propre à chaque navigateur (sessions, lots) : jamais partagé entre utilisateurs
+const USER_ID = localStorage.getItem("USER_ID") || (() => {
+  // randomUUID n'existe qu'en contexte sécurisé (https, localhost)
+  const id = `web-${crypto.randomUUID ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2)}`;
+  localStorage.setItem("USER_ID", id);
+  return id;
+})();
+
+// "auto" : le serveur choisit le modèle le plus sobre adapté à la demande
+const AUTO_MODEL = { id: "auto", label: "Auto (le plus sobre)" };
 
 const MODELS = {
   openai: [
@@ -11,10 +21,12 @@ const MODELS = {
     { id: "openai:gpt-4o", label: "GPT-4o" },
     { id: "openai:gpt-4-turbo", label: "GPT-4-Turbo" },
     { id: "openai:gpt-3.5-turbo", label: "GPT-3.5-Turbo" },
+    AUTO_MODEL,
   ],
   mistral: [
     { id: "mistral:open-mixtral-8x7b", label: "Mixtral 8×7B" },
     { id: "mistral:open-mistral-7b", label: "Mistral 7B" },
+    AUTO_MODEL,
   ],
 };
 
@@ -23,6 +35,7 @@ const state = {
   model: null,
   files: [],
   messages: [],
+  sessionId: null, // conversation côté serveur : on n'envoie que le nouveau message
   sending: false,
 };
 
@@ -87,6 +100,10 @@ function handleFileSelect(e) {
 }
 
 function resetChat() {
+  if (state.sessionId) {
+    fetch(`${API_BASE}/sessions/${state.sessionId}?user_id=${USER_ID}`, { method: "DELETE" }).catch(() => {});
+  }
+  state.sessionId = null;
   state.messages = [];
   renderMessages();
   $("#usageStats").classList.add("hidden");
@@ -111,6 +128,7 @@ function addMessage(role, content, files = []) {
 
   log.appendChild(msg);
   log.scrollTop = log.scrollHeight;
+  return msg.querySelector(".bubble");
 }
 
 function renderMessages() {
@@ -153,37 +171,19 @@ async function sendMessage() {
   if (!text && !hasFile) return;
 
   addMessage("user", text || "(fichier envoyé)", state.files);
+  const history = state.messages.slice();
+  if (text) state.messages.push({ role: "user", content: text });
   input.value = "";
   state.sending = true;
   $("#sendBtn").disabled = true;
   showLoader();
 
   try {
-    let resp;
-    if (hasFile) {
-      const form = new FormData();
-      form.append("model", state.model);
-      form.append("messages", JSON.stringify(state.messages));
-      state.files.forEach((f) => form.append("files", f));
-      resp = await fetch(`${API_BASE}/chat/file-to-ai`, { method: "POST", body: form });
-    } else {
-      const body = {
-        user_id: "webclient",
-        model: state.model,
-        messages: state.messages,
-        stream: false,
-      };
-      resp = await fetch(`${API_BASE}/chat`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(body),
-      });
-    }
-
-    if (!resp.ok) throw new Error(await resp.text());
-    const data = await resp.json();
-    removeLoader();
-    addMessage("assistant", data?.content || "(Aucune réponse)");
+    // Conversation expirée côté serveur : on la recrée à partir de l'historique local
+    const data = await withSession(history, (sessionId) =>
+      hasFile ? sendFiles(sessionId, text) : streamChat(sessionId, text)
+    );
+    state.messages.push({ role: "assistant", content: data?.content || "" });
     renderUsage(data);
   } catch (e) {
     removeLoader();
@@ -196,6 +196,105 @@ async function sendMessage() {
   }
 }
 
+// ===========================================================
+// CONVERSATION CÔTÉ SERVEUR
+// ===========================================================
+async function httpError(resp) {
+  const err = new Error(await resp.text());
+  err.status = resp.status;
+  return err;
+}
+
+async function createSession(history) {
+  const resp = await fetch(`${API_BASE}/sessions`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ user_id: USER_ID, model: state.model, messages: history }),
+  });
+  if (!resp.ok) throw await httpError(resp);
+  state.sessionId = (await resp.json()).session_id;
+}
+
+async function withSession(history, send) {
+  if (!state.sessionId) await createSession(history);
+  try {
+    return await send(state.sessionId);
+  } catch (e) {
+    if (e.status !== 404) throw e;
+    await createSession(history);
+    return send(state.sessionId);
+  }
+}
+
+async function sendFiles(sessionId, text) {
+  const form = new FormData();
+  form.append("user_id", USER_ID);
+  form.append("model", state.model);
+  form.append("content", text);
+  state.files.forEach((f) => form.append("files", f));
+  const resp = await fetch(`${API_BASE}/sessions/${sessionId}/files`, { method: "POST", body: form });
+  if (!resp.ok) throw await httpError(resp);
+  const data = await resp.json();
+  removeLoader();
+  addMessage("assistant", data?.content || "(Aucune réponse)");
+  return data;
+}
+
+// ===========================================================
+// STREAMING (Server-Sent Events)
+// ===========================================================
+// Affiche les tokens au fil de l'eau ; l'événement `done` porte usage, kWh et CO₂.
+async function streamChat(sessionId, text) {
+  const resp = await fetch(`${API_BASE}/sessions/${sessionId}/chat`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify({ user_id: USER_ID, model: state.model, content: text, stream: true }),
+  });
+  if (!resp.ok) throw await httpError(resp);
+
+  removeLoader();
+  const bubble = addMessage("assistant", "");
+  const log = $("#chatLog");
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let content = "";
+  let final = {};
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const evt = parseSSE(buffer.slice(0, sep));
+      buffer = buffer.slice(sep + 2);
+      if (evt.event === "token") {
+        content += evt.data.content;
+      } else if (evt.event === "error") {
+        content = evt.data.content;
+      } else if (evt.event === "done") {
+        final = evt.data;
+      }
+      bubble.textContent = content;
+      log.scrollTop = log.scrollHeight;
+    }
+  }
+
+  return { ...final, content };
+}
+
+function parseSSE(raw) {
+  let event = "message";
+  const data = [];
+  for (const line of raw.split("\n")) {
+    if (line.startsWith("event:")) event = line.slice(6).trim();
+    else if (line.startsWith("data:")) data.push(line.slice(5).trim());
+  }
+  return { event, data: data.length ? JSON.parse(data.join("\n")) : {} };
+}
+
 // ===========================================================
 // STATISTIQUES
 // ===========================================================
@@ -206,7 +305,9 @@ function renderUsage(r) {
   const cost = r?.cost_eur || 0;
   const co2 = r?.est_co2e_g || 0;
 
-  $("#tokensPill").textContent = `🔹 ${inT + outT} tokens (${inT} in / ${outT} out)`;
+  const saved = u.history_tokens_saved || 0;
+  $("#tokensPill").textContent =
+    `🔹 ${inT + outT} tokens (${inT} in / ${outT} out)` + (saved ? ` · ${saved} économisés` : "");
   $("#costPill").textContent = `💰 ${cost.toFixed(5)} €`;
   $("#co2Pill").textContent = `🌍 ${co2.toFixed(2)} gCO₂e`;
   $("#usageStats").classList.remove("hidden");
@@ -13,14 +13,10 @@ let currentGranularity = 'day';
 // ========================================
 async function fetchInsights() {
   try {
-    const [overview, timeline, models, heatmap, equivalents, recommendations] = await Promise.all([
-      fetch(`${API_BASE}/insights/overview`).then(r => r.json()),
-      fetch(`${API_BASE}/insights/timeline?granularity=${currentGranularity}`).then(r => r.json()),
-      fetch(`${API_BASE}/insights/models`).then(r => r.json()),
-      fetch(`${API_BASE}/insights/heatmap`).then(r => r.json()),
-      fetch(`${API_BASE}/insights/equivalents`).then(r => r.json()),
-      fetch(`${API_BASE}/insights/recommendations`).then(r => r.json())
-    ]);
+    // Un seul appel : le backend calcule tout en une passe (et répond 304 si rien n'a changé)
+    const resp = await fetch(`${API_BASE}/insights/dashboard?granularity=${currentGranularity}`, { cache: 'no-cache' });
+    if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+    const { overview, timeline, models, heatmap, equivalents, recommendations } = await resp.json();
 
     renderHeroMetrics(overview);
     renderTimeline(timeline);
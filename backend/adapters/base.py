@@ -1,11 +1,48 @@
+import asyncio
+import json
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+from adapters.carbon_adapter import estimate_carbon
+
+
+def approx_tokens(text: str) -> int:
+    """Estimation grossière (~4 caractères / token) quand le fournisseur ne renvoie pas l'usage."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def stream_done_event(model: str, input_tokens: int, output_tokens: int) -> Dict[str, Any]:
+    """Dernier événement d'un stream : usage + empreinte carbone (trace écrite ici)."""
+    carbon_data = estimate_carbon(model, input_tokens, output_tokens)
+    return {
+        "event": "done",
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        "cost_eur": 0.0,
+        "est_kwh": round(carbon_data["energy_kwh"], 6),
+        "est_co2e_g": round(carbon_data["carbon_gco2eq"], 3),
+    }
+
+
+def error_info(e: Exception) -> Dict[str, Any]:
+    """
+    Nature d'une erreur fournisseur : type, statut HTTP éventuel, et s'il est
+    utile de réessayer (réseau, délai, 429, 5xx) ou non (requête invalide, clé refusée).
+    """
+    status = getattr(e, "status_code", None) or getattr(e, "http_status", None)
+    if status is not None:
+        retryable = status == 429 or status >= 500
+    else:
+        retryable = not isinstance(e, (TypeError, ValueError, KeyError, AttributeError))
+    return {"type": type(e).__name__, "status": status, "retryable": retryable}
+
 
 class BaseAdapter(ABC):
     """
     Classe de base pour tous les adaptateurs de modèles IA.
     Chaque adaptateur (OpenAI, Perplexity, Anthropic, etc.)
     doit hériter de cette classe et implémenter send_chat().
+    Les adaptateurs qui disposent d'un client asynchrone
+    surchargent aussi asend_chat() et aclose().
     """
 
     @abstractmethod
@@ -21,5 +58,92 @@ class BaseAdapter(ABC):
             "est_kwh": 0.00003,
             "est_co2e_g": 0.01
         }
+        En cas d'échec, la réponse porte aussi "error": error_info(e).
         """
         raise NotImplementedError("Chaque adaptateur doit implémenter send_chat()")
+
+    async def asend_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False) -> Dict[str, Any]:
+        """
+        Version asynchrone de send_chat() (même format de retour).
+        Par défaut, délègue send_chat() à un thread pour ne pas bloquer la boucle.
+        """
+        return await asyncio.to_thread(self.send_chat, model, messages, stream)
+
+    async def astream_chat(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream de la réponse, événement par événement :
+        - {"event": "token", "content": "..."} à chaque fragment reçu
+        - {"event": "error", "content": "❌ ...", "error": error_info(e)} en cas d'échec
+        - {"event": "done", "usage": {...}, "cost_eur", "est_kwh", "est_co2e_g"} en dernier
+
+        Par défaut (fournisseur sans streaming) : la réponse complète en un seul token.
+        """
+        result = await self.asend_chat(model, messages)
+        yield {"event": "token", "content": result["content"]}
+        yield {"event": "done", **{k: v for k, v in result.items() if k != "content"}}
+
+    async def aclose(self) -> None:
+        """Libère les clients / pools de connexions de l'adaptateur."""
+        return None
+
+    @classmethod
+    def preload(cls) -> None:
+        """
+        Charge les dépendances lourdes de l'adaptateur (SDK, instrumentation)
+        sans créer de client : appelable avant un fork, ou pour un warm-up.
+        """
+        return None
+
+    # --- Traitement différé (API batch du fournisseur), facultatif ---
+    supports_batch = False
+
+    async def submit_batch(self, model: str, requests: List[Tuple[str, List[Dict[str, Any]]]]) -> str:
+        """Soumet des requêtes (custom_id, messages) au traitement différé ; renvoie l'id du job."""
+        raise NotImplementedError("Ce fournisseur ne propose pas de traitement différé")
+
+    async def batch_status(self, job_id: str) -> Dict[str, Any]:
+        """
+        État d'un job :
+        {"status": "...", "done": bool, "output_file": id ou None, "error_file": id ou None}
+        """
+        raise NotImplementedError("Ce fournisseur ne propose pas de traitement différé")
+
+    async def batch_output(self, status: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Lignes de résultat brutes d'un job terminé, par custom_id."""
+        raise NotImplementedError("Ce fournisseur ne propose pas de traitement différé")
+
+    def format_batch_result(self, model: str, line: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Ligne de résultat → réponse au format de send_chat() (trace carbone écrite ici)."""
+        raise NotImplementedError("Ce fournisseur ne propose pas de traitement différé")
+
+
+def parse_batch_output(text: str) -> Dict[str, Dict[str, Any]]:
+    """Fichier JSONL de résultats (format commun OpenAI / Mistral) → lignes par custom_id."""
+    lines = (json.loads(raw) for raw in text.splitlines() if raw.strip())
+    return {line["custom_id"]: line for line in lines}
+
+
+def batch_line_error(line: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Erreur d'une ligne de résultat (None si la requête a abouti)."""
+    if line is None:
+        return {"message": "aucun résultat pour cette requête", "status": None}
+    response = line.get("response") or {}
+    status = response.get("status_code")
+    if status == 200 and response.get("body"):
+        return None
+    error = line.get("error") or (response.get("body") or {}).get("error") or {}
+    message = error.get("message") if isinstance(error, dict) else str(error)
+    return {"message": message or f"statut {status}", "status": status}
+
+
+def batch_error_response(provider: str, error: Dict[str, Any]) -> Dict[str, Any]:
+    status = error["status"]
+    return {
+        "content": f"❌ Erreur {provider} (traitement différé) : {error['message']}",
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+        "cost_eur": 0.0,
+        "est_kwh": 0.0,
+        "est_co2e_g": 0.0,
+        "error": {"type": "BatchItemError", "status": status,
+                  "retryable": status is None or status == 429 or status >= 500},
+    }
@@ -1,6 +1,16 @@
-import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
-from pathlib import Path
+from typing import Dict, Any, Optional, Tuple, List, Callable
+
+from deployment import TRACES_PATH, TRACE_FORMAT, trace_segment
+from trace_writer import TraceWriter, get_trace_writer
+from trace_segments import SegmentTraceWriter
+from metrics import TOKENS, provider_of
+from startup import REPORT
 
 # Facteurs moyens d'émission (gCO2eq / 1000 tokens)
 MODEL_COEFFICIENTS = {
@@ -12,17 +22,83 @@ MODEL_COEFFICIENTS = {
 
 }
 
-LOG_PATH = Path(__file__).resolve().parent.parent / "ecologits-traces.jsonl"
+DEFAULT_COEFFICIENT = 0.5
+
+# TRACES_PATH : fichier de traces partagé avec /insights (ex. traces synthétiques des benchmarks)
+LOG_PATH = TRACES_PATH
+
+# Champs ajoutés à toutes les traces écrites dans le contexte courant (ex. décision du routeur)
+_TRACE_FIELDS: ContextVar[Dict[str, Any]] = ContextVar("trace_fields", default={})
+
+
+@contextmanager
+def trace_fields(**fields):
+    """Ajoute `fields` aux traces écrites dans ce bloc (tâche asyncio ou thread courant)."""
+    token = _TRACE_FIELDS.set({**_TRACE_FIELDS.get(), **fields})
+    try:
+        yield
+    finally:
+        _TRACE_FIELDS.reset(token)
+
+
+_WRITER: Tuple[Optional[int], Optional[TraceWriter]] = (None, None)
+
+# Appelés avec chaque trace enregistrée par ce processus (ex. flux /insights/stream) ;
+# ils s'exécutent sur le chemin de la requête et doivent rester quasi instantanés
+_TRACE_LISTENERS: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_trace_listener(listener: Callable[[Dict[str, Any]], None]):
+    _TRACE_LISTENERS.append(listener)
+
 
+def trace_writer() -> TraceWriter:
+    """Writer du processus courant (ses propres segments avec TRACE_DIR), résolu une fois par PID."""
+    global _WRITER
+    pid, writer = _WRITER
+    if pid != os.getpid():
+        factory = SegmentTraceWriter if TRACE_FORMAT == "segments" else TraceWriter
+        writer = get_trace_writer(trace_segment(), factory)
+        _WRITER = (os.getpid(), writer)
+    return writer
 
-def estimate_carbon(model: str, input_tokens: int, output_tokens: int):
+
+# Fournisseurs instrumentés par EcoLogits (SDK patché au premier adaptateur créé)
+_ECOLOGITS_PROVIDERS = set()
+_ECOLOGITS_LOCK = threading.Lock()
+
+
+def init_ecologits(provider: str):
+    """
+    Instrumente le SDK `provider` avec EcoLogits, une seule fois par processus
+    (EcoLogits.init ré-instrumenterait à chaque appel). À appeler avant le
+    premier appel au SDK ; l'import d'EcoLogits charge aussi le SDK.
+    """
+    if provider in _ECOLOGITS_PROVIDERS:
+        return
+    with _ECOLOGITS_LOCK:
+        if provider in _ECOLOGITS_PROVIDERS:
+            return
+        with REPORT.lazy_load(f"ecologits:{provider}"):
+            from ecologits import EcoLogits
+            EcoLogits.init(providers=[provider])
+        _ECOLOGITS_PROVIDERS.add(provider)
+
+
+def carbon_per_1k(model: str) -> float:
+    return MODEL_COEFFICIENTS.get(model, DEFAULT_COEFFICIENT)
+
+
+def estimate_carbon(model: str, input_tokens: int, output_tokens: int, **extra):
     """
     Estime l'énergie (kWh) et les émissions (gCO₂eq) à partir du nombre de tokens.
     Inspiré des données Stanford, HuggingFace, OpenAI et EcoLogits.
+    Les champs `extra` (ex. cached=True) et ceux de trace_fields() sont ajoutés
+    tels quels à la trace. Avec `baseline_model`, la trace porte aussi ce
+    qu'aurait émis ce modèle de référence pour les mêmes tokens.
     """
     total_tokens = input_tokens + output_tokens
-    coef = MODEL_COEFFICIENTS.get(model, 0.5)
-    carbon_g = (total_tokens / 1000) * coef
+    carbon_g = (total_tokens / 1000) * carbon_per_1k(model)
     energy_kwh = carbon_g / 475  # 475 gCO₂eq = 1 kWh (AIE 2023)
 
     data = {
@@ -32,10 +108,24 @@ def estimate_carbon(model: str, input_tokens: int, output_tokens: int):
         "output_tokens": output_tokens,
         "energy_kwh": energy_kwh,
         "carbon_gco2eq": carbon_g,
+        **_TRACE_FIELDS.get(),
+        **extra,
     }
+    if data.get("baseline_model"):
+        data["baseline_carbon_gco2eq"] = (total_tokens / 1000) * carbon_per_1k(data["baseline_model"])
+
+    provider = provider_of(model)
+    if input_tokens:
+        TOKENS.inc(input_tokens, provider=provider, model=model, direction="input")
+    if output_tokens:
+        TOKENS.inc(output_tokens, provider=provider, model=model, direction="output")
 
-    # Sauvegarde dans le même fichier qu'EcoLogits
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(data) + "\n")
+    # Sauvegarde par lots en arrière-plan (aucune I/O disque sur le chemin de la requête)
+    trace_writer().write(data)
+    for listener in _TRACE_LISTENERS:
+        try:
+            listener(data)
+        except Exception as e:  # un abonné ne doit jamais faire échouer la requête
+            logging.getLogger("carbon").error(f"Abonné aux traces en échec : {e}")
 
     return data
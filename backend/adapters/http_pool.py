@@ -0,0 +1,62 @@
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+
+@dataclass(frozen=True)
+class HttpPoolConfig:
+    """
+    Paramètres des pools de connexions HTTP partagés par les adaptateurs.
+
+    Variables d'environnement :
+    - HTTP_MAX_CONNECTIONS   : connexions simultanées max par fournisseur
+    - HTTP_MAX_KEEPALIVE     : connexions gardées ouvertes au repos
+    - HTTP_KEEPALIVE_EXPIRY  : durée de vie (s) d'une connexion inactive
+    - HTTP_CONNECT_TIMEOUT   : timeout (s) d'établissement de connexion
+    - HTTP_TIMEOUT           : timeout (s) lecture / écriture
+    """
+
+    max_connections: int = 200
+    max_keepalive_connections: int = 50
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    timeout: float = 120.0
+
+    @classmethod
+    def from_env(cls) -> "HttpPoolConfig":
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", cls.max_connections)),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", cls.max_keepalive_connections)),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", cls.keepalive_expiry)),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", cls.connect_timeout)),
+            timeout=float(os.getenv("HTTP_TIMEOUT", cls.timeout)),
+        )
+
+    @property
+    def limits(self) -> "httpx.Limits":
+        import httpx  # chargé avec le premier client (démarrage rapide)
+
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def timeouts(self) -> "httpx.Timeout":
+        import httpx
+
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def sync_client(self) -> "httpx.Client":
+        import httpx
+
+        return httpx.Client(limits=self.limits, timeout=self.timeouts, follow_redirects=True)
+
+    def async_client(self) -> "httpx.AsyncClient":
+        import httpx
+
+        return httpx.AsyncClient(limits=self.limits, timeout=self.timeouts, follow_redirects=True)
@@ -1,9 +1,14 @@
 import os
-from typing import List, Dict, Any
-from mistralai.client import MistralClient
+import json
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from pydantic import BaseModel  # ✅ on recrée la structure de message
-from .base import BaseAdapter
+from .base import (
+    BaseAdapter, approx_tokens, error_info, stream_done_event,
+    parse_batch_output, batch_line_error, batch_error_response,
+)
+from .http_pool import HttpPoolConfig
 from adapters.carbon_adapter import estimate_carbon
+from startup import REPORT
 
 
 # ✅ Recréation de la structure ChatMessage (équivalente à celle du SDK)
@@ -15,17 +20,163 @@ class ChatMessage(BaseModel):
 class MistralAdapter(BaseAdapter):
     """Adapter pour le fournisseur Mistral (avec calcul d'empreinte carbone)."""
 
-    def __init__(self, api_key: str | None = None):
+    def __init__(self, api_key: str | None = None, pool: HttpPoolConfig | None = None):
         self.api_key = api_key or os.getenv("MISTRAL_API_KEY") or ""
         if not self.api_key:
             raise RuntimeError("MISTRAL_API_KEY manquante")
-        self.client = MistralClient(api_key=self.api_key)
 
-def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
-    """Envoie une requête de chat à l'API Mistral avec format compatible."""
-    model_id = model.split(":", 1)[1] if ":" in model else model
+        self.preload()
+        from mistralai.client import MistralClient
+        from mistralai.async_client import MistralAsyncClient
 
-    try:
+        # Pas de retry dans le SDK : délais, retries et bascule sont gérés par ResilientAdapter.
+        pool = pool or HttpPoolConfig.from_env()
+        # MISTRAL_ENDPOINT : équivalent d'OPENAI_BASE_URL (proxy, serveur de test local)
+        self.endpoint = os.getenv("MISTRAL_ENDPOINT", "https://api.mistral.ai").rstrip("/")
+        self.client = MistralClient(api_key=self.api_key, endpoint=self.endpoint, timeout=int(pool.timeout), max_retries=0)
+        self.async_client = MistralAsyncClient(
+            api_key=self.api_key,
+            endpoint=self.endpoint,
+            timeout=int(pool.timeout),
+            max_retries=0,
+            max_concurrent_requests=pool.max_connections,
+        )
+        # Le SDK 0.4 n'expose que max_connections et ne permet pas de fournir son
+        # client httpx : on remplace le sien (jamais utilisé, fermé avec l'adaptateur)
+        # par le client poolé, qui applique aussi keep-alive et timeout de connexion.
+        # Ce client nous appartient : l'API batch l'utilise directement.
+        self.http = pool.async_client()
+        self._sdk_http = self.async_client._client
+        self.async_client._client = self.http
+
+    @classmethod
+    def preload(cls):
+        """SDK chargé au premier adaptateur, pas à l'import de l'application."""
+        with REPORT.lazy_load("sdk:mistral"):
+            import mistralai.client  # noqa: F401
+            import mistralai.async_client  # noqa: F401
+
+    def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        """Envoie une requête de chat à l'API Mistral avec format compatible."""
+        model_id = model.split(":", 1)[1] if ":" in model else model
+
+        try:
+            # Appel à l’API Mistral
+            response = self.client.chat(
+                model=model_id,
+                messages=self._format_messages(messages),
+            )
+            return self._format_response(model, response)
+
+        except Exception as e:
+            return self._error_response(e)
+
+    async def asend_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        """Version asynchrone, sur le client httpx partagé."""
+        model_id = model.split(":", 1)[1] if ":" in model else model
+
+        try:
+            response = await self.async_client.chat(
+                model=model_id,
+                messages=self._format_messages(messages),
+            )
+            return self._format_response(model, response)
+
+        except Exception as e:
+            return self._error_response(e)
+
+    async def astream_chat(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream token par token via chat_stream ; l'usage arrive dans le dernier chunk."""
+        model_id = model.split(":", 1)[1] if ":" in model else model
+        formatted_messages = self._format_messages(messages)
+
+        parts: List[str] = []
+        usage = None
+        try:
+            async for chunk in self.async_client.chat_stream(model=model_id, messages=formatted_messages):
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield {"event": "token", "content": delta}
+                if chunk.usage:
+                    usage = chunk.usage
+
+        except Exception as e:
+            result = self._error_response(e)
+            yield {"event": "error", "content": result["content"], "error": result["error"]}
+            return
+
+        text = "".join(parts)
+        input_tokens = usage.prompt_tokens if usage else approx_tokens(str(formatted_messages))
+        output_tokens = usage.completion_tokens if usage else approx_tokens(text)
+        yield stream_done_event(model, input_tokens, output_tokens)
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+        await self._sdk_http.aclose()
+        # MistralClient 0.4 n'a pas de close() public (seulement __del__) : on ferme son client httpx
+        self.client._client.close()
+
+    # --- Batch API (le SDK 0.4 ne l'expose pas : appels HTTP directs sur le client poolé) ---
+    supports_batch = True
+    BATCH_DONE = ("SUCCESS", "FAILED", "TIMEOUT_EXCEEDED", "CANCELLED")
+
+    async def _api(self, method: str, path: str, **kwargs):
+        response = await self.http.request(
+            method,
+            f"{self.endpoint}/v1/{path}",
+            headers={"Authorization": f"Bearer {self.api_key}", "Accept": "application/json"},
+            **kwargs,
+        )
+        response.raise_for_status()
+        return response
+
+    async def submit_batch(self, model: str, requests: List[Tuple[str, List[Dict[str, Any]]]]) -> str:
+        model_id = model.split(":", 1)[1] if ":" in model else model
+        lines = [
+            json.dumps({"custom_id": custom_id, "body": {"messages": self._format_messages(messages)}},
+                       ensure_ascii=False)
+            for custom_id, messages in requests
+        ]
+        upload = await self._api(
+            "POST", "files",
+            files={"file": ("batch.jsonl", "\n".join(lines).encode("utf-8"))},
+            data={"purpose": "batch"},
+        )
+        job = await self._api("POST", "batch/jobs", json={
+            "input_files": [upload.json()["id"]],
+            "model": model_id,
+            "endpoint": "/v1/chat/completions",
+        })
+        return job.json()["id"]
+
+    async def batch_status(self, job_id: str) -> Dict[str, Any]:
+        job = (await self._api("GET", f"batch/jobs/{job_id}")).json()
+        return {
+            "status": job["status"],
+            "done": job["status"] in self.BATCH_DONE,
+            "output_file": job.get("output_file"),
+            "error_file": job.get("error_file"),
+        }
+
+    async def batch_output(self, status: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        lines: Dict[str, Dict[str, Any]] = {}
+        for file_id in filter(None, (status.get("error_file"), status.get("output_file"))):
+            content = await self._api("GET", f"files/{file_id}/content")
+            lines.update(parse_batch_output(content.text))
+        return lines
+
+    def format_batch_result(self, model: str, line: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        error = batch_line_error(line)
+        if error is not None:
+            return batch_error_response("Mistral", error)
+        from mistralai.models.chat_completion import ChatCompletionResponse  # déjà chargé avec le SDK
+
+        return self._format_response(model, ChatCompletionResponse(**line["response"]["body"]))
+
+    @staticmethod
+    def _format_messages(messages: List[Any]) -> List[Dict[str, Any]]:
         # Conversion des messages en simples dictionnaires
         formatted_messages = []
         for m in messages:
@@ -35,13 +186,10 @@ def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = F
                 formatted_messages.append(m.dict())
             else:
                 formatted_messages.append({"role": "user", "content": str(m)})
+        return formatted_messages
 
-        # Appel à l’API Mistral
-        response = self.client.chat(
-            model=model_id,
-            messages=formatted_messages,
-        )
-
+    @staticmethod
+    def _format_response(model: str, response) -> Dict[str, Any]:
         # Extraction du contenu
         content = ""
         if response and response.choices:
@@ -65,11 +213,13 @@ def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = F
             "est_co2e_g": round(carbon_data["carbon_gco2eq"], 3),
         }
 
-    except Exception as e:
+    @staticmethod
+    def _error_response(e: Exception) -> Dict[str, Any]:
         return {
             "content": f"❌ Erreur Mistral : {str(e)}",
             "usage": {"input_tokens": 0, "output_tokens": 0},
             "cost_eur": 0.0,
             "est_kwh": 0.0,
             "est_co2e_g": 0.0,
+            "error": error_info(e),
         }
@@ -1,23 +1,43 @@
 import os
-from typing import List, Dict, Any
-from openai import OpenAI
-from .base import BaseAdapter
-from adapters.carbon_adapter import estimate_carbon
+import json
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+from .base import (
+    BaseAdapter, approx_tokens, error_info, stream_done_event,
+    parse_batch_output, batch_line_error, batch_error_response,
+)
+from .http_pool import HttpPoolConfig
+from adapters.carbon_adapter import estimate_carbon, init_ecologits
+from startup import REPORT
 import logging
 
 
 class OpenAIAdapter(BaseAdapter):
     """Adapter pour le fournisseur OpenAI (multi-modèles + calcul carbone)."""
 
-    def __init__(self, api_key: str | None = None):
+    def __init__(self, api_key: str | None = None, pool: HttpPoolConfig | None = None):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY") or ""
         if not self.api_key:
             raise RuntimeError("OPENAI_API_KEY manquante")
-        self.client = OpenAI(api_key=self.api_key)
+
+        self.preload()
+        from openai import OpenAI, AsyncOpenAI
+
+        # Clients créés une seule fois : connexions keep-alive réutilisées.
+        # Pas de retry dans le SDK : délais, retries et bascule sont gérés par ResilientAdapter.
+        pool = pool or HttpPoolConfig.from_env()
+        self.client = OpenAI(api_key=self.api_key, http_client=pool.sync_client(), max_retries=0)
+        self.async_client = AsyncOpenAI(api_key=self.api_key, http_client=pool.async_client(), max_retries=0)
 
         # Logger interne pour traçabilité
         self.logger = logging.getLogger("openai-adapter")
 
+    @classmethod
+    def preload(cls):
+        """SDK chargé et instrumenté par EcoLogits au premier adaptateur, pas à l'import de l'application."""
+        init_ecologits("openai")
+        with REPORT.lazy_load("sdk:openai"):
+            import openai  # noqa: F401
+
     def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
         """Envoie une requête de chat à l'API OpenAI."""
 
@@ -26,53 +46,174 @@ class OpenAIAdapter(BaseAdapter):
 
         # --- Filtrage / sécurité ---
         if model_id.lower() in ["gpt-5", "gpt-6"]:
-            return {
-                "content": "⚠️ GPT-5 n’est pas encore disponible via l’API OpenAI.",
-                "usage": {"input_tokens": 0, "output_tokens": 0},
-                "cost_eur": 0.0,
-                "est_kwh": 0.0,
-                "est_co2e_g": 0.0,
-            }
+            return self._unavailable_response()
 
         # --- Appel API réel ---
         try:
             response = self.client.chat.completions.create(
                 model=model_id,
                 messages=messages,
-                stream=stream
             )
+            return self._format_response(model, model_id, response)
 
-            # 💡 Affiche le vrai modèle utilisé par OpenAI
-            print(f"🧠 Modèle réellement exécuté par OpenAI : {response.model}")
+        except Exception as e:
+            return self._error_response(model_id, e)
 
-            # Contenu du message
-            content = ""
-            if response and response.choices and response.choices[0].message:
-                content = (response.choices[0].message.content or "").strip()
+    async def asend_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        """Version asynchrone : la requête n'occupe aucun thread pendant l'aller-retour."""
+        model_id = model.split(":", 1)[1] if ":" in model else model
 
-            # Nombre de tokens utilisés
-            input_tokens = getattr(response.usage, "prompt_tokens", 0)
-            output_tokens = getattr(response.usage, "completion_tokens", 0)
+        if model_id.lower() in ["gpt-5", "gpt-6"]:
+            return self._unavailable_response()
 
-            # Calcul carbone
-            carbon_data = estimate_carbon(model, input_tokens, output_tokens)
+        try:
+            response = await self.async_client.chat.completions.create(
+                model=model_id,
+                messages=messages,
+            )
+            return self._format_response(model, model_id, response)
 
-            self.logger.info(f"[OpenAI] Modèle utilisé : {model_id} | In: {input_tokens}, Out: {output_tokens}")
+        except Exception as e:
+            return self._error_response(model_id, e)
+
+    async def astream_chat(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream token par token ; l'usage arrive dans le dernier chunk (include_usage)."""
+        model_id = model.split(":", 1)[1] if ":" in model else model
+
+        if model_id.lower() in ["gpt-5", "gpt-6"]:
+            result = self._unavailable_response()
+            yield {"event": "token", "content": result["content"]}
+            yield stream_done_event(model, 0, 0)
+            return
 
-            return {
-                "content": content or "(OpenAI) Pas de contenu renvoyé.",
-                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
-                "cost_eur": 0.0,
-                "est_kwh": round(carbon_data["energy_kwh"], 6),
-                "est_co2e_g": round(carbon_data["carbon_gco2eq"], 3),
-            }
+        parts: List[str] = []
+        usage = None
+        stream = None
+        try:
+            stream = await self.async_client.chat.completions.create(
+                model=model_id,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield {"event": "token", "content": delta}
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
 
         except Exception as e:
-            self.logger.error(f"Erreur OpenAI ({model_id}): {e}")
-            return {
-                "content": f"❌ Erreur lors de l’appel OpenAI : {str(e)}",
-                "usage": {"input_tokens": 0, "output_tokens": 0},
-                "cost_eur": 0.0,
-                "est_kwh": 0.0,
-                "est_co2e_g": 0.0,
-            }
+            result = self._error_response(model_id, e)
+            yield {"event": "error", "content": result["content"], "error": result["error"]}
+            return
+        finally:
+            # Client déconnecté ou fin du stream : on libère la connexion
+            response = getattr(stream, "response", None)
+            if response is not None:
+                await response.aclose()
+
+        text = "".join(parts)
+        input_tokens = getattr(usage, "prompt_tokens", 0) if usage else approx_tokens(str(messages))
+        output_tokens = getattr(usage, "completion_tokens", 0) if usage else approx_tokens(text)
+        self.logger.info(f"[OpenAI] Stream {model_id} | In: {input_tokens}, Out: {output_tokens}")
+        yield stream_done_event(model, input_tokens, output_tokens)
+
+    async def aclose(self) -> None:
+        await self.async_client.close()
+        self.client.close()
+
+    # --- Batch API (résultats sous 24 h, à moitié prix) ---
+    supports_batch = True
+    BATCH_DONE = ("completed", "failed", "expired", "cancelled")
+
+    async def submit_batch(self, model: str, requests: List[Tuple[str, List[Dict[str, Any]]]]) -> str:
+        model_id = model.split(":", 1)[1] if ":" in model else model
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                        "body": {"model": model_id, "messages": messages}}, ensure_ascii=False)
+            for custom_id, messages in requests
+        ]
+        upload = await self.async_client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+        )
+        batch = await self.async_client.batches.create(
+            input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window="24h"
+        )
+        self.logger.info(f"[OpenAI] Batch {batch.id} soumis : {len(lines)} requêtes {model_id}")
+        return batch.id
+
+    async def batch_status(self, job_id: str) -> Dict[str, Any]:
+        batch = await self.async_client.batches.retrieve(job_id)
+        return {
+            "status": batch.status,
+            "done": batch.status in self.BATCH_DONE,
+            "output_file": batch.output_file_id,
+            "error_file": batch.error_file_id,
+        }
+
+    async def batch_output(self, status: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        lines: Dict[str, Dict[str, Any]] = {}
+        for file_id in filter(None, (status.get("error_file"), status.get("output_file"))):
+            content = await self.async_client.files.content(file_id)
+            lines.update(parse_batch_output(content.text))
+        return lines
+
+    def format_batch_result(self, model: str, line: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        error = batch_line_error(line)
+        if error is not None:
+            return batch_error_response("OpenAI", error)
+        from openai.types.chat import ChatCompletion  # déjà chargé avec le SDK
+
+        model_id = model.split(":", 1)[1] if ":" in model else model
+        completion = ChatCompletion.model_validate(line["response"]["body"])
+        return self._format_response(model, model_id, completion)
+
+    def _format_response(self, model: str, model_id: str, response) -> Dict[str, Any]:
+        # 💡 Le vrai modèle utilisé par OpenAI (niveau debug : pas d'I/O console par requête)
+        self.logger.debug(f"🧠 Modèle réellement exécuté par OpenAI : {response.model}")
+
+        # Contenu du message
+        content = ""
+        if response and response.choices and response.choices[0].message:
+            content = (response.choices[0].message.content or "").strip()
+
+        # Nombre de tokens utilisés
+        input_tokens = getattr(response.usage, "prompt_tokens", 0)
+        output_tokens = getattr(response.usage, "completion_tokens", 0)
+
+        # Calcul carbone
+        carbon_data = estimate_carbon(model, input_tokens, output_tokens)
+
+        self.logger.info(f"[OpenAI] Modèle utilisé : {model_id} | In: {input_tokens}, Out: {output_tokens}")
+
+        return {
+            "content": content or "(OpenAI) Pas de contenu renvoyé.",
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+            "cost_eur": 0.0,
+            "est_kwh": round(carbon_data["energy_kwh"], 6),
+            "est_co2e_g": round(carbon_data["carbon_gco2eq"], 3),
+        }
+
+    def _error_response(self, model_id: str, e: Exception) -> Dict[str, Any]:
+        self.logger.error(f"Erreur OpenAI ({model_id}): {e}")
+        return {
+            "content": f"❌ Erreur lors de l’appel OpenAI : {str(e)}",
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+            "cost_eur": 0.0,
+            "est_kwh": 0.0,
+            "est_co2e_g": 0.0,
+            "error": error_info(e),
+        }
+
+    @staticmethod
+    def _unavailable_response() -> Dict[str, Any]:
+        return {
+            "content": "⚠️ GPT-5 n’est pas encore disponible via l’API OpenAI.",
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+            "cost_eur": 0.0,
+            "est_kwh": 0.0,
+            "est_co2e_g": 0.0,
+        }
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Iterable, TypeVar
+
+from fastapi import HTTPException
+
+from adapters.base import BaseAdapter, error_info
+from adapters.carbon_adapter import trace_fields
+
+logger = logging.getLogger("batch-jobs")
+
+# Requêtes max par lot, appels simultanés en mode direct,
+# jobs différés gardés en mémoire et durée de conservation (s)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", 1000))
+BATCH_JOB_TTL = float(os.getenv("BATCH_JOB_TTL", 7 * 24 * 3600))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def run_bounded(items: Iterable[T], fn: Callable[[T], Awaitable[R]], limit: int = BATCH_CONCURRENCY) -> List[R]:
+    """`fn` sur chaque élément, au plus `limit` à la fois ; résultats dans l'ordre des éléments."""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item: T) -> R:
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+# -----------------------------------------------------
+# Jobs différés (API batch des fournisseurs)
+# -----------------------------------------------------
+@dataclass
+class BatchItem:
+    index: int
+    model: str
+    messages: List[Dict[str, Any]]
+    trace: Dict[str, Any] = field(default_factory=dict)  # champs ajoutés à la trace (routage)
+    usage: Dict[str, Any] = field(default_factory=dict)  # ajouté à l'usage (compaction)
+    result: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class ProviderJob:
+    """Un job chez le fournisseur : un seul modèle par fichier de requêtes."""
+
+    model: str
+    job_id: Optional[str]
+    items: List[int]
+    status: str = "submitted"
+    done: bool = False
+
+
+class BatchJob:
+    def __init__(self, user_id: str, items: List[BatchItem]):
+        self.batch_id = "batch_" + secrets.token_urlsafe(12)
+        self.user_id = user_id
+        self.items = items
+        self.jobs: List[ProviderJob] = []
+        self.created_at = time.time()
+        # Un seul rafraîchissement à la fois : les résultats (et leurs traces) ne sont lus qu'une fois
+        self.lock = asyncio.Lock()
+
+    def custom_id(self, index: int) -> str:
+        return f"{self.batch_id}-{index}"
+
+    @property
+    def done(self) -> bool:
+        return all(job.done for job in self.jobs)
+
+    async def submit(self, resolve: Callable[[str], BaseAdapter]):
+        """Un job par modèle ; un échec de soumission n'empêche pas les autres."""
+        by_model: Dict[str, List[int]] = {}
+        for item in self.items:
+            by_model.setdefault(item.model, []).append(item.index)
+
+        for model, indices in by_model.items():
+            requests = [(self.custom_id(i), self.items[i].messages) for i in indices]
+            try:
+                job_id = await resolve(model).submit_batch(model, requests)
+                self.jobs.append(ProviderJob(model, job_id, indices))
+            except Exception as e:
+                logger.error(f"Soumission du lot {self.batch_id} ({model}) impossible : {e}")
+                self.jobs.append(ProviderJob(model, None, indices, status="submit_failed", done=True))
+                for i in indices:
+                    self.items[i].result = {
+                        "content": f"❌ Soumission au traitement différé impossible : {e}",
+                        "usage": {"input_tokens": 0, "output_tokens": 0},
+                        "cost_eur": 0.0,
+                        "est_kwh": 0.0,
+                        "est_co2e_g": 0.0,
+                        "error": error_info(e),
+                    }
+
+    async def refresh(self, resolve: Callable[[str], BaseAdapter]):
+        """Interroge les jobs en cours ; ceux terminés donnent leurs résultats (une trace par requête)."""
+        async with self.lock:
+            for job in self.jobs:
+                if job.done:
+                    continue
+                adapter = resolve(job.model)
+                status = await adapter.batch_status(job.job_id)
+                job.status = status["status"]
+                if not status["done"]:
+                    continue
+                lines = await adapter.batch_output(status)
+                for i in job.items:
+                    item = self.items[i]
+                    with trace_fields(batch_id=self.batch_id, deferred=True, **item.trace):
+                        result = adapter.format_batch_result(item.model, lines.get(self.custom_id(i)))
+                    item.result = {**result, "usage": {**result["usage"], **item.usage}}
+                job.done = True
+
+    def info(self) -> Dict[str, Any]:
+        completed = [item for item in self.items if item.result is not None]
+        return {
+            "batch_id": self.batch_id,
+            "mode": "deferred",
+            "status": "completed" if self.done else "in_progress",
+            "items": len(self.items),
+            "completed": len(completed),
+            "jobs": [{"model": job.model, "job_id": job.job_id, "status": job.status} for job in self.jobs],
+            "results": [
+                {"index": item.index, "model": item.model, **(item.result or {"status": "pending"})}
+                for item in self.items
+            ],
+            "usage": batch_usage([item.result for item in completed]),
+        }
+
+
+def batch_usage(results: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totaux d'un lot (tokens, énergie, CO₂, échecs)."""
+    totals = {"input_tokens": 0, "output_tokens": 0, "est_kwh": 0.0, "est_co2e_g": 0.0, "errors": 0}
+    for result in results:
+        usage = result.get("usage") or {}
+        totals["input_tokens"] += usage.get("input_tokens", 0)
+        totals["output_tokens"] += usage.get("output_tokens", 0)
+        totals["est_kwh"] += result.get("est_kwh", 0.0)
+        totals["est_co2e_g"] += result.get("est_co2e_g", 0.0)
+        totals["errors"] += "error" in result
+    totals["est_kwh"] = round(totals["est_kwh"], 6)
+    totals["est_co2e_g"] = round(totals["est_co2e_g"], 3)
+    return totals
+
+
+class BatchJobStore:
+    """Jobs différés en mémoire du processus, réservés au `user_id` qui les a soumis."""
+
+    def __init__(self, max_jobs: int = BATCH_MAX_JOBS, ttl: float = BATCH_JOB_TTL):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job: BatchJob):
+        with self._lock:
+            self._purge()
+            self._jobs[job.batch_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def get(self, batch_id: str, user_id: str) -> BatchJob:
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(batch_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Lot inconnu ou expiré.")
+        if job.user_id != user_id:
+            raise HTTPException(status_code=403, detail="Ce lot appartient à un autre utilisateur.")
+        return job
+
+    def _purge(self):
+        # Ordre d'insertion = ordre de création : on s'arrête au premier encore valide
+        deadline = time.time() - self.ttl
+        while self._jobs and next(iter(self._jobs.values())).created_at < deadline:
+            self._jobs.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.done)
+        return {"jobs": len(self._jobs), "pending": pending, "max_jobs": self.max_jobs}
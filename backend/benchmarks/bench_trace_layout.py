@@ -0,0 +1,132 @@
+"""
+Benchmark : layout "dicts" vs layout "columnar" du TraceStore.
+
+Génère un JSONL synthétique puis mesure, pour chaque layout :
+- le temps d'ingestion complète (premier refresh)
+- la mémoire retenue par l'index (tracemalloc)
+- le temps de ré-agrégation complète (rollups from scratch)
+- la latence des méthodes d'InsightsAnalyzer
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_trace_layout --traces 500000
+"""
+import argparse
+import gc
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from insights_analyzer import InsightsAnalyzer
+from trace_rollups import TraceRollups
+from trace_store import TraceStore
+
+MODELS = [
+    "openai:gpt-4o-mini", "openai:gpt-4o", "openai:gpt-4-turbo",
+    "openai:gpt-3.5-turbo", "mistral:open-mistral-7b", "mistral:open-mixtral-8x7b",
+]
+
+
+def write_traces(path: Path, count: int, days: int = 365, seed: int = 42):
+    """Écrit `count` traces réparties sur `days` jours, entrecoupées de warnings."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    step = timedelta(days=days) / max(count, 1)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            if i % 50 == 0:
+                f.write("The model architecture has not been released, expect lower precision.\n")
+            tin, tout = rng.randint(5, 2000), rng.randint(5, 1500)
+            carbon = (tin + tout) / 1000 * rng.choice((0.3, 0.5, 0.8, 1.2))
+            f.write(json.dumps({
+                "timestamp": (start + i * step).isoformat(),
+                "model": rng.choice(MODELS),
+                "input_tokens": tin,
+                "output_tokens": tout,
+                "energy_kwh": carbon / 475,
+                "carbon_gco2eq": carbon,
+            }) + "\n")
+
+
+def timed(fn, repeat: int = 1) -> float:
+    """Durée moyenne d'un appel, en millisecondes."""
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def bench_layout(path: Path, layout: str, repeat: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+
+    store = TraceStore(path, layout)
+    t0 = time.perf_counter()
+    store.refresh()
+    if layout == "columnar":
+        store.columns()
+    load_ms = (time.perf_counter() - t0) * 1000
+
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if layout == "columnar":
+        cols = store.columns()
+        rebuild_ms = timed(cols.to_rollups, repeat)
+    else:
+        rebuild_ms = timed(lambda: TraceRollups.from_traces(store.traces), repeat)
+
+    analyzer = InsightsAnalyzer(path, store)
+    query_ms = timed(lambda: (
+        analyzer.get_overview_metrics(),
+        analyzer.get_carbon_timeline("day"),
+        analyzer.get_carbon_timeline("hour"),
+        analyzer.get_model_comparison(),
+        analyzer.get_hourly_heatmap(),
+        analyzer.get_equivalents(),
+        analyzer.get_recommendations(),
+    ), repeat)
+
+    return {
+        "layout": layout,
+        "traces": store.rollups.totals.requests,
+        "load_ms": load_ms,
+        "retained_mb": (current - base) / 1e6,
+        "peak_mb": (peak - base) / 1e6,
+        "rebuild_ms": rebuild_ms,
+        "query_ms": query_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traces", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "traces.jsonl"
+        write_traces(path, args.traces)
+        print(f"Fichier : {path.stat().st_size / 1e6:.1f} Mo, {args.traces} traces\n")
+
+        results = [bench_layout(path, layout, args.repeat) for layout in ("dicts", "columnar")]
+
+    header = f"{'layout':<10}{'traces':>10}{'load ms':>12}{'retenu Mo':>12}{'pic Mo':>10}{'rebuild ms':>12}{'query ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['layout']:<10}{r['traces']:>10}{r['load_ms']:>12.0f}{r['retained_mb']:>12.1f}"
+              f"{r['peak_mb']:>10.1f}{r['rebuild_ms']:>12.1f}{r['query_ms']:>10.2f}")
+
+    d, c = results
+    print(f"\nMémoire retenue : ×{d['retained_mb'] / max(c['retained_mb'], 1e-9):.1f} en faveur du layout colonnaire")
+    print(f"Ré-agrégation   : ×{d['rebuild_ms'] / max(c['rebuild_ms'], 1e-9):.1f} en faveur du layout colonnaire")
+
+
+if __name__ == "__main__":
+    main()
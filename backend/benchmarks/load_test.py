@@ -0,0 +1,470 @@
+"""
+Test de charge hors ligne du middleware : RPS, p50/p95/p99 et RSS.
+
+Lance les faux fournisseurs (benchmarks.mock_providers) puis le middleware
+(uvicorn main:app) pointé dessus, envoie la charge avec N clients simultanés
+et mesure la mémoire résidente du serveur (processus et ses enfants : pool
+de fichiers...). Aucun appel payant.
+
+Scénarios :
+- chat        : POST /chat (OpenAI et Mistral en alternance)
+- chat-stream : POST /chat en SSE (le TTFT est mesuré aussi)
+- file-pdf    : POST /chat/file-to-ai avec des PDF générés (--pages)
+- file-image  : POST /chat/file-to-ai avec des photos générées (--image-size)
+- insights    : GET /insights/* sur un JSONL synthétique de --traces lignes
+- all         : tous les scénarios, un serveur neuf pour chacun
+
+Avec --workers N, le middleware est lancé par serve.py (N workers forkés).
+
+Usage (depuis backend/) :
+    python -m benchmarks.load_test chat --concurrency 32 --duration 20
+    python -m benchmarks.load_test insights --traces 10000000 --requests 200
+    python -m benchmarks.load_test all --json bench.json
+
+Avec --target, la charge vise un serveur déjà lancé (RSS seulement si --pid).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+
+import httpx
+
+from benchmarks.bench_trace_layout import write_traces
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("chat", "chat-stream", "file-pdf", "file-image", "insights")
+CHAT_MODELS = ("openai:gpt-4o-mini", "mistral:open-mistral-7b")
+INSIGHTS_ROUTES = ("overview", "timeline", "models", "heatmap", "equivalents", "recommendations")
+
+# Une requête : (succès, TTFT en s ou None)
+Call = Callable[[httpx.AsyncClient, int], Awaitable[Tuple[bool, Optional[float]]]]
+
+
+# -----------------------------------------------------
+# Mémoire résidente (Linux : /proc)
+# -----------------------------------------------------
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """RSS (octets) du processus et de tous ses descendants ; None hors Linux."""
+    total, found, stack = 0, False, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+                found = True
+        except OSError:
+            continue
+        stack.extend(_children(current))
+    return total if found else None
+
+
+class RssSampler:
+    """Échantillonne le RSS d'un arbre de processus dans un thread (pic et dernière valeur)."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.start = self.peak = self.last = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss = process_rss(self.pid) if self.pid else None
+        if rss is not None:
+            self.start = self.start or rss
+            self.peak = max(self.peak or 0, rss)
+            self.last = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+# -----------------------------------------------------
+# Processus lancés pour la mesure
+# -----------------------------------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """Sous-processus uvicorn, arrêté (SIGTERM puis kill) à la sortie du bloc."""
+
+    def __init__(self, args: List[str], env: Dict[str, str], ready_path: str, ready_timeout: float = 120):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.args = [sys.executable, *args, "--port", str(self.port)]
+        self.env = {**os.environ, **env}
+        self.ready_path = ready_path
+        self.ready_timeout = ready_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.startup_s: Optional[float] = None
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.process = subprocess.Popen(self.args, cwd=BACKEND_DIR, env=self.env)
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{' '.join(self.args)} s'est arrêté (code {self.process.returncode})")
+            try:
+                if httpx.get(self.url + self.ready_path, timeout=1).status_code < 500:
+                    self.startup_s = time.perf_counter() - started
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError(f"{self.url}{self.ready_path} toujours indisponible après {self.ready_timeout} s")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def mock_server(args: argparse.Namespace) -> Server:
+    return Server(
+        ["-m", "benchmarks.mock_providers",
+         "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+         "--token-delay-ms", str(args.token_delay_ms), "--output-tokens", str(args.output_tokens),
+         "--error-rate", str(args.error_rate)],
+        env={}, ready_path="/stats",
+    )
+
+
+def middleware_server(args: argparse.Namespace, mock_url: str, traces: Path) -> Server:
+    env = {
+        "OPENAI_API_KEY": "sk-bench", "MISTRAL_API_KEY": "bench",
+        "OPENAI_BASE_URL": mock_url + "/v1", "MISTRAL_ENDPOINT": mock_url,
+        "TRACES_PATH": str(traces), "UPLOAD_DIR": str(traces.parent / "uploads"),
+        "DOCUMENT_DIR": str(traces.parent / "documents"),
+        # Segments des workers ; /insights les lit avec le fichier synthétique
+        "TRACE_DIR": str(traces.parent / "traces"), "ECOLOGITS_LOG": str(traces.parent / "ecologits-warnings.log"),
+        # On mesure le middleware, pas le cache ni les quotas par utilisateur
+        "RESPONSE_CACHE": "1" if args.cache else "0",
+        "RATE_LIMITS": "0",
+    }
+    env.update(item.split("=", 1) for item in args.env)
+    if args.workers > 1:
+        return Server(["serve.py", "--workers", str(args.workers), "--log-level", "warning"],
+                      env=env, ready_path="/ready")
+    return Server(["-m", "uvicorn", "main:app", "--log-level", "warning"], env=env, ready_path="/ready")
+
+
+# -----------------------------------------------------
+# Fichiers d'exemple
+# -----------------------------------------------------
+def sample_pdf(pages: int, seed: int) -> bytes:
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    words = "empreinte carbone énergie modèle requête token inférence sobriété datacenter".split()
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(
+            f"{number + 1}.{line} " + " ".join(rng.choice(words) for _ in range(12)) for line in range(45)
+        )
+        page.insert_text((50, 60), text, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def sample_image(size: Tuple[int, int], seed: int) -> bytes:
+    """Photo synthétique (dégradé bruité) : compresse mal, comme une vraie photo."""
+    from PIL import Image
+
+    width, height = size
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width, height), 64).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    tint = Image.new("RGB", (width, height), tuple(rng.randint(0, 255) for _ in range(3)))
+    image = Image.blend(Image.blend(noise, gradient, 0.5), tint, 0.3)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+# -----------------------------------------------------
+# Scénarios
+# -----------------------------------------------------
+def ok_json(response: httpx.Response) -> bool:
+    # Une erreur fournisseur revient en 200 avec un champ "error"
+    return response.status_code == 200 and response.json().get("error") is None
+
+
+def chat_call(stream: bool) -> Call:
+    async def call(client: httpx.AsyncClient, i: int):
+        # Prompt unique : jamais servi par le cache de réponses
+        body = {
+            "user_id": f"bench-{i % 64}",
+            "model": CHAT_MODELS[i % len(CHAT_MODELS)],
+            "messages": [{"role": "user", "content": f"Question {i} : quel est le bilan carbone de cette requête ?"}],
+            "stream": stream,
+        }
+        if not stream:
+            return ok_json(await client.post("/chat", json=body)), None
+
+        started, ttft, event, ok = time.perf_counter(), None, None, False
+        async with client.stream("POST", "/chat", json=body) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                    if event == "token" and ttft is None:
+                        ttft = time.perf_counter() - started
+                    ok = ok or event == "done"
+        return response.status_code == 200 and ok, ttft
+    return call
+
+
+def file_call(kind: str, samples: List[bytes]) -> Call:
+    filename, content_type = ("doc.pdf", "application/pdf") if kind == "pdf" else ("photo.jpg", "image/jpeg")
+    model = "openai:gpt-4o-mini"
+
+    async def call(client: httpx.AsyncClient, i: int):
+        messages = [{"role": "user", "content": f"Résume ce fichier ({i})."}]
+        response = await client.post(
+            "/chat/file-to-ai",
+            data={"model": model, "messages": json.dumps(messages), "user_id": f"bench-{i % 64}"},
+            files={"files": (filename, samples[i % len(samples)], content_type)},
+        )
+        return ok_json(response), None
+    return call
+
+
+def insights_call() -> Call:
+    async def call(client: httpx.AsyncClient, i: int):
+        response = await client.get(f"/insights/{INSIGHTS_ROUTES[i % len(INSIGHTS_ROUTES)]}")
+        return response.status_code == 200, None
+    return call
+
+
+# -----------------------------------------------------
+# Charge et rapport
+# -----------------------------------------------------
+@dataclass
+class Report:
+    scenario: str
+    concurrency: int
+    requests: int = 0
+    errors: int = 0
+    duration_s: float = 0.0
+    rps: float = 0.0
+    latency_ms: Dict[str, float] = field(default_factory=dict)
+    ttft_ms: Dict[str, float] = field(default_factory=dict)
+    rss_mb: Dict[str, float] = field(default_factory=dict)
+    startup_s: Optional[float] = None
+    first_request_ms: Optional[float] = None
+    notes: Dict[str, Any] = field(default_factory=dict)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 1), "max": round(ordered[-1] * 1000, 1)}
+
+
+async def run_load(base_url: str, call: Call, concurrency: int, duration: float,
+                   requests: Optional[int], timeout: float) -> Tuple[List[float], List[float], int, float]:
+    """Boucle fermée : `concurrency` clients enchaînent les requêtes jusqu'à `requests` ou `duration`."""
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    counter = iter(range(requests if requests else sys.maxsize))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                if not requests and time.perf_counter() >= deadline:
+                    return
+                started = time.perf_counter()
+                try:
+                    ok, ttft = await call(client, i)
+                except (httpx.HTTPError, ValueError):
+                    ok, ttft = False, None
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+                if ttft is not None:
+                    ttfts.append(ttft)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, ttfts, errors, elapsed
+
+
+def measure(scenario: str, call: Call, base_url: str, pid: Optional[int], args: argparse.Namespace,
+            warmup: int) -> Report:
+    report = Report(scenario, args.concurrency)
+    # Premier appel à part (index des insights, pool de processus...), puis échauffement
+    if warmup:
+        latencies, _, _, _ = asyncio.run(run_load(base_url, call, 1, 0, 1, args.timeout))
+        report.first_request_ms = round(latencies[0] * 1000, 1)
+        asyncio.run(run_load(base_url, call, min(args.concurrency, warmup), 0, warmup, args.timeout))
+
+    with RssSampler(pid) as rss:
+        latencies, ttfts, errors, elapsed = asyncio.run(
+            run_load(base_url, call, args.concurrency, args.duration, args.requests, args.timeout)
+        )
+    report.requests, report.errors = len(latencies), errors
+    report.duration_s = round(elapsed, 2)
+    report.rps = round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    report.latency_ms, report.ttft_ms = percentiles(latencies), percentiles(ttfts)
+    if rss.peak is not None:
+        report.rss_mb = {name: round(value / 2 ** 20, 1)
+                         for name, value in (("start", rss.start), ("peak", rss.peak), ("end", rss.last))}
+    return report
+
+
+def scenario_call(scenario: str, args: argparse.Namespace) -> Call:
+    if scenario in ("chat", "chat-stream"):
+        return chat_call(stream=scenario == "chat-stream")
+    if scenario == "file-pdf":
+        return file_call("pdf", [sample_pdf(args.pages, seed) for seed in range(args.samples)])
+    if scenario == "file-image":
+        return file_call("image", [sample_image(args.image_size, seed) for seed in range(args.samples)])
+    return insights_call()
+
+
+def run_scenario(scenario: str, args: argparse.Namespace) -> Report:
+    call = scenario_call(scenario, args)
+    if args.target:
+        return measure(scenario, call, args.target, args.pid, args, args.warmup)
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        traces = Path(tmp) / "traces.jsonl"
+        notes = {}
+        if scenario == "insights":
+            t0 = time.perf_counter()
+            write_traces(traces, args.traces)
+            notes = {"traces": args.traces, "traces_mb": round(traces.stat().st_size / 2 ** 20, 1),
+                     "write_s": round(time.perf_counter() - t0, 1)}
+        else:
+            traces.touch()
+
+        with mock_server(args) as mock, middleware_server(args, mock.url, traces) as server:
+            report = measure(scenario, call, server.url, server.process.pid, args, args.warmup)
+            report.startup_s = round(server.startup_s, 2)
+            report.notes.update(notes)
+            if scenario != "insights":
+                report.notes["upstream_requests"] = httpx.get(mock.url + "/stats").json()["requests"]
+        return report
+
+
+def print_report(report: Report):
+    line = (f"{report.scenario:<12} {report.requests:>7} req  {report.errors:>5} err  "
+            f"{report.rps:>8.1f} req/s  ")
+    if report.latency_ms:
+        line += "p50 {p50:>7.1f}  p95 {p95:>7.1f}  p99 {p99:>7.1f} ms".format(**report.latency_ms)
+    print(line)
+    details = []
+    if report.ttft_ms:
+        details.append("TTFT p50 {p50} / p95 {p95} ms".format(**report.ttft_ms))
+    if report.rss_mb:
+        details.append("RSS {start} → pic {peak} → {end} Mo".format(**report.rss_mb))
+    if report.startup_s is not None:
+        details.append(f"démarrage {report.startup_s} s")
+    if report.first_request_ms is not None:
+        details.append(f"1re requête {report.first_request_ms} ms")
+    details.extend(f"{k}={v}" for k, v in report.notes.items())
+    if details:
+        print(" " * 13 + " · ".join(details))
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=(*SCENARIOS, "all"))
+    load = parser.add_argument_group("charge")
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--duration", type=float, default=10.0, help="secondes (ignoré avec --requests)")
+    load.add_argument("--requests", type=int, default=None, help="nombre fixe de requêtes")
+    load.add_argument("--warmup", type=int, default=20, help="requêtes d'échauffement non mesurées")
+    load.add_argument("--timeout", type=float, default=120.0)
+    load.add_argument("--json", type=Path, default=None, help="écrit les rapports (comparaison entre versions)")
+
+    server = parser.add_argument_group("serveur")
+    server.add_argument("--target", default=None, help="URL d'un middleware déjà lancé")
+    server.add_argument("--pid", type=int, default=None, help="PID à mesurer avec --target")
+    server.add_argument("--workers", type=int, default=1, help="workers du middleware (serve.py si > 1)")
+    server.add_argument("--cache", action="store_true", help="laisse le cache de réponses actif")
+    server.add_argument("--env", action="append", default=[], metavar="CLÉ=VALEUR",
+                        help="variable d'environnement du middleware (répétable)")
+
+    data = parser.add_argument_group("données")
+    data.add_argument("--traces", type=int, default=10_000, help="lignes du JSONL synthétique (insights)")
+    data.add_argument("--pages", type=int, default=10, help="pages par PDF")
+    data.add_argument("--image-size", type=lambda s: tuple(map(int, s.lower().split("x"))), default=(3000, 2000))
+    data.add_argument("--samples", type=int, default=4, help="fichiers distincts envoyés en alternance")
+
+    mock = parser.add_argument_group("faux fournisseurs")
+    mock.add_argument("--latency-ms", type=float, default=300.0)
+    mock.add_argument("--jitter-ms", type=float, default=100.0)
+    mock.add_argument("--token-delay-ms", type=float, default=10.0)
+    mock.add_argument("--output-tokens", type=int, default=120)
+    mock.add_argument("--error-rate", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    reports = []
+    for scenario in scenarios:
+        report = run_scenario(scenario, args)
+        print_report(report)
+        reports.append(report)
+    if args.json:
+        args.json.write_text(json.dumps([asdict(r) for r in reports], indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
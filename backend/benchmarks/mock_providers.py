@@ -0,0 +1,165 @@
+"""
+Faux fournisseurs OpenAI / Mistral pour les benchmarks (aucun appel payant).
+
+Sert `POST /v1/chat/completions` au format des deux API (réponse complète
+ou stream SSE, usage dans le dernier chunk) :
+- OpenAI  : OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+- Mistral : MISTRAL_ENDPOINT=http://127.0.0.1:9100
+
+Latence, débit de tokens, taille des réponses et taux d'erreur sont réglables
+(options ou variables MOCK_*). Pour des profils différents par fournisseur,
+lancer deux instances sur deux ports.
+
+Usage (depuis backend/) :
+    python -m benchmarks.mock_providers --port 9100 --latency-ms 400 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import time
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "le modèle répond avec une estimation sobre de l'empreinte carbone "
+    "pour chaque requête envoyée au fournisseur via le middleware"
+).split()
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 300.0     # avant la réponse (ou le premier token)
+    jitter_ms: float = 100.0      # ± aléatoire sur la latence
+    token_delay_ms: float = 10.0  # entre deux tokens d'un stream
+    output_tokens: int = 120      # tokens générés par réponse
+    error_rate: float = 0.0       # part des requêtes en erreur
+    error_status: int = 503       # 429, 500, 503...
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        return cls(
+            latency_ms=float(os.getenv("MOCK_LATENCY_MS", cls.latency_ms)),
+            jitter_ms=float(os.getenv("MOCK_JITTER_MS", cls.jitter_ms)),
+            token_delay_ms=float(os.getenv("MOCK_TOKEN_DELAY_MS", cls.token_delay_ms)),
+            output_tokens=int(os.getenv("MOCK_OUTPUT_TOKENS", cls.output_tokens)),
+            error_rate=float(os.getenv("MOCK_ERROR_RATE", cls.error_rate)),
+            error_status=int(os.getenv("MOCK_ERROR_STATUS", cls.error_status)),
+        )
+
+    def latency(self) -> float:
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+
+def prompt_tokens(messages) -> int:
+    """Approximation (4 caractères par token) ; les images comptent pour 85 tokens."""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content) // 4 + 4
+            continue
+        for part in content or []:
+            total += 85 if part.get("type") == "image_url" else len(part.get("text", "")) // 4
+    return max(total, 1)
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Faux fournisseurs LLM")
+    app.state.config = config
+    app.state.requests = 0
+
+    def completion_id() -> str:
+        return "chatcmpl-" + secrets.token_hex(8)
+
+    def usage(body) -> dict:
+        tin = prompt_tokens(body.get("messages", []))
+        return {"prompt_tokens": tin, "completion_tokens": config.output_tokens,
+                "total_tokens": tin + config.output_tokens}
+
+    def error(status: int) -> JSONResponse:
+        # Même enveloppe que les deux API : {"error": {...}} ; Retry-After pour les 429
+        headers = {"retry-after": "1"} if status == 429 else None
+        return JSONResponse(
+            {"error": {"message": "Erreur simulée", "type": "server_error", "code": str(status)},
+             "object": "error", "message": "Erreur simulée"},
+            status_code=status, headers=headers,
+        )
+
+    async def stream(body):
+        cid, created, model = completion_id(), int(time.time()), body.get("model", "mock")
+
+        def chunk(delta, finish=None, **extra):
+            return "data: " + json.dumps({
+                "id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra,
+            }, ensure_ascii=False) + "\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        for i in range(config.output_tokens):
+            yield chunk({"content": ("" if i == 0 else " ") + WORDS[i % len(WORDS)]})
+            if config.token_delay_ms:
+                await asyncio.sleep(config.token_delay_ms / 1000)
+        yield chunk({}, "stop", usage=usage(body))
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(config.latency())
+        if config.error_rate and random.random() < config.error_rate:
+            return error(config.error_status)
+
+        if body.get("stream"):
+            return StreamingResponse(stream(body), media_type="text/event-stream")
+
+        # Sans stream, la génération complète est payée d'un coup
+        if config.token_delay_ms:
+            await asyncio.sleep(config.output_tokens * config.token_delay_ms / 1000)
+        text = " ".join(WORDS[i % len(WORDS)] for i in range(config.output_tokens))
+        return {
+            "id": completion_id(),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage(body),
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "config": config.__dict__}
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    defaults = MockConfig.from_env()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--token-delay-ms", type=float, default=defaults.token_delay_ms)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import uvicorn
+
+    args = parse_args(argv)
+    config = MockConfig(args.latency_ms, args.jitter_ms, args.token_delay_ms,
+                        args.output_tokens, args.error_rate, args.error_status)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
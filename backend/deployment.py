@@ -0,0 +1,64 @@
+import os
+import socket
+from pathlib import Path
+from typing import Optional
+
+# Processus servant l'application sur ce nœud (même variable que `uvicorn --workers`)
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+# Identifiant du nœud (réplique) : le hostname d'un conteneur est unique
+NODE_ID = os.getenv("NODE_ID") or socket.gethostname()
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Format des traces :
+# - "segments" : segments binaires compressés et plafonnés dans TRACE_DIR (trace_segments.py)
+# - "jsonl"    : fichier unique, ou un fichier par worker avec TRACE_DIR (défaut en multi-workers)
+TRACE_FORMATS = ("segments", "jsonl")
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "segments")
+if TRACE_FORMAT not in TRACE_FORMATS:
+    raise ValueError(f"Format de traces inconnu : {TRACE_FORMAT!r} (attendu : {', '.join(TRACE_FORMATS)})")
+
+# Fichier JSONL : traces au format "jsonl", historique relu par /insights sinon
+TRACES_PATH = Path(os.getenv("TRACES_PATH") or BASE_DIR / "ecologits-traces.jsonl")
+# /insights lit tous les segments du répertoire, plus TRACES_PATH
+TRACE_DIR: Optional[Path] = (
+    Path(os.getenv("TRACE_DIR")) if os.getenv("TRACE_DIR")
+    else BASE_DIR / "traces" if TRACE_FORMAT == "segments" or WORKERS > 1
+    else None
+)
+# Warnings d'EcoLogits : journal texte séparé, plus jamais mêlé aux traces
+WARNINGS_LOG = Path(os.getenv("ECOLOGITS_LOG") or BASE_DIR / "ecologits-warnings.log")
+
+# Fichiers reçus, rangés par empreinte (volume partagé entre répliques), servis sous /uploads
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR") or BASE_DIR / "uploads")
+# PDF de /chat/file-to-ai gardés dans DOCUMENT_DIR, jamais servi : une question de
+# suivi peut arriver sur un autre worker, qui ré-indexe le document depuis le disque
+SHARED_DOCUMENTS = os.getenv("SHARED_DOCUMENTS", "1" if WORKERS > 1 else "0") == "1"
+DOCUMENT_DIR = Path(os.getenv("DOCUMENT_DIR") or BASE_DIR / "documents")
+
+
+def worker_id() -> str:
+    """Nœud + PID : unique parmi les workers de toutes les répliques."""
+    return f"{NODE_ID}-{os.getpid()}"
+
+
+def trace_segment() -> Path:
+    """
+    Traces du processus courant (à réévaluer après un fork) : préfixe de ses
+    segments .trc, son fichier JSONL dans TRACE_DIR, ou TRACES_PATH.
+    """
+    if TRACE_DIR is None:
+        return TRACES_PATH
+    if TRACE_FORMAT == "segments":
+        return TRACE_DIR / worker_id()
+    return TRACE_DIR / f"{worker_id()}.jsonl"
+
+
+def prepare_directories():
+    """Répertoires partagés ; idempotent (appelé une fois par le superviseur, ou par chaque worker)."""
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    if SHARED_DOCUMENTS:
+        DOCUMENT_DIR.mkdir(parents=True, exist_ok=True)
+    WARNINGS_LOG.parent.mkdir(parents=True, exist_ok=True)
+    if TRACE_DIR is not None:
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
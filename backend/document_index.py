@@ -0,0 +1,258 @@
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+
+from adapters.base import approx_tokens
+from file_workers import FileProcessingPool
+from uploads import SpooledUpload, UploadStore
+
+# Taille des passages (tokens), recouvrement, pages max indexées, documents gardés en cache
+DOC_CHUNK_TOKENS = int(os.getenv("DOC_CHUNK_TOKENS", 300))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", 40))
+DOC_MAX_PAGES = int(os.getenv("DOC_MAX_PAGES", 500))
+DOC_INDEX_CACHE_ENTRIES = int(os.getenv("DOC_INDEX_CACHE_ENTRIES", 32))
+
+# Budget de tokens de document par requête (≈ les 6000 caractères d'avant par défaut)
+DOC_TOKEN_BUDGET = int(os.getenv("DOC_TOKEN_BUDGET", 1500))
+DOC_TOKEN_BUDGETS: Dict[str, int] = {
+    "openai:gpt-4o": 6000,
+    "openai:gpt-4o-mini": 6000,
+    "openai:gpt-4-turbo": 6000,
+    "openai:gpt-3.5-turbo": 2500,
+    "mistral:open-mistral-7b": 3000,
+    "mistral:open-mixtral-8x7b": 6000,
+}
+# ex. DOC_MODEL_BUDGETS="openai:gpt-4o=8000,mistral:open-mistral-7b=2000"
+for _item in filter(None, os.getenv("DOC_MODEL_BUDGETS", "").split(",")):
+    _model, _, _budget = _item.rpartition("=")
+    DOC_TOKEN_BUDGETS[_model.strip()] = int(_budget)
+
+
+def budget_for(model: str) -> int:
+    return DOC_TOKEN_BUDGETS.get(model, DOC_TOKEN_BUDGET)
+
+
+# -----------------------------------------------------
+# Termes
+# -----------------------------------------------------
+_WORD = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+    au aux avec ce ces cette dans de des du elle en et eux il ils je la le les leur lui ma mais me
+    mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton
+    tu un une vos votre vous est sont été être avoir ont fait plus comme
+    the of and to in is are was were be been for on with as by at from that this it its or an
+""".split())
+
+
+def terms(text: str) -> List[str]:
+    """Mots en minuscules, sans accents ni mots vides."""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return [t for t in _WORD.findall(folded) if len(t) > 1 and t not in STOPWORDS]
+
+
+# -----------------------------------------------------
+# Découpage (exécuté dans les processus workers)
+# -----------------------------------------------------
+@dataclass
+class Chunk:
+    page: int  # numéro de page, à partir de 1
+    text: str
+    tokens: int
+    tf: Dict[str, int]
+
+
+def chunk_text(text: str, page: int, chunk_tokens: int = DOC_CHUNK_TOKENS,
+               overlap: int = DOC_CHUNK_OVERLAP) -> List[Chunk]:
+    """Découpe le texte d'une page en passages d'environ `chunk_tokens` tokens, qui se recouvrent."""
+    # Même estimation que approx_tokens() : ~4 caractères par token
+    max_chars, overlap_chars = chunk_tokens * 4, overlap * 4
+    words = text.split()
+    chunks: List[Chunk] = []
+    start = 0
+    while start < len(words):
+        end, chars = start, 0
+        while end < len(words) and (end == start or chars + len(words[end]) <= max_chars):
+            chars += len(words[end]) + 1
+            end += 1
+        body = " ".join(words[start:end])
+        chunks.append(Chunk(page, body, approx_tokens(body), dict(Counter(terms(body)))))
+        if end >= len(words):
+            break
+        # On recule d'environ `overlap` tokens pour ne pas couper une idée en deux
+        back, kept = end, 0
+        while back > start + 1 and kept < overlap_chars:
+            back -= 1
+            kept += len(words[back]) + 1
+        start = back
+    return chunks
+
+
+def chunk_pdf_pages(path: str, start: int, stop: int, chunk_tokens: int, overlap: int) -> List[Chunk]:
+    """Passages des pages [start, stop) ; le PDF est lu page par page."""
+    import fitz  # PyMuPDF
+    chunks: List[Chunk] = []
+    with fitz.open(path) as doc:
+        for i in range(start, min(stop, doc.page_count)):
+            chunks.extend(chunk_text(doc[i].get_text(), i + 1, chunk_tokens, overlap))
+    return chunks
+
+
+# -----------------------------------------------------
+# Index BM25
+# -----------------------------------------------------
+class DocumentIndex:
+    """Index lexical BM25 des passages d'un document (local, sans réseau)."""
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, doc_id: str, filename: str, pages: int, chunks: List[Chunk]):
+        self.doc_id = doc_id
+        self.filename = filename
+        self.pages = pages
+        self.chunks = chunks
+        self.lengths = [sum(c.tf.values()) for c in chunks]
+        self.avg_length = (sum(self.lengths) / len(chunks)) if chunks else 0.0
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for i, chunk in enumerate(chunks):
+            for term, tf in chunk.tf.items():
+                self.postings[term].append((i, tf))
+
+    @property
+    def tokens(self) -> int:
+        return sum(c.tokens for c in self.chunks)
+
+    def search(self, query: str) -> List[Tuple[int, float]]:
+        """(indice du passage, score) par score décroissant ; seuls les passages pertinents."""
+        n = len(self.chunks)
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = 1 - self.b + self.b * self.lengths[i] / self.avg_length
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def select(self, query: str, budget: int) -> List[Chunk]:
+        """
+        Passages les plus pertinents pour `query` tenant dans `budget` tokens,
+        remis dans l'ordre du document. Sans terme commun : le début du document.
+        """
+        ranked = [i for i, _ in self.search(query)] or range(len(self.chunks))
+        picked, used = [], 0
+        for i in ranked:
+            tokens = self.chunks[i].tokens
+            if used + tokens <= budget:
+                picked.append(i)
+                used += tokens
+        return [self.chunks[i] for i in sorted(picked)]
+
+
+# -----------------------------------------------------
+# Cache et pipeline
+# -----------------------------------------------------
+class DocumentIndexCache:
+    """LRU des index, par sha256 du fichier : une question de suivi ne relit pas le PDF."""
+
+    def __init__(self, max_entries: int = DOC_INDEX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, doc_id: str) -> Optional[DocumentIndex]:
+        with self._lock:
+            index = self._data.get(doc_id)
+            if index is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(doc_id)
+            self.hits += 1
+            return index
+
+    def put(self, index: DocumentIndex):
+        with self._lock:
+            self._data[index.doc_id] = index
+            self._data.move_to_end(index.doc_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class DocumentPipeline:
+    """
+    Documents PDF → passages indexés, mis en cache par empreinte de contenu.
+    Le découpage se fait par tranches de pages dans le pool de processus.
+    Avec un `store` partagé, un document absent du cache (indexé par un autre
+    worker, ou évincé) est ré-indexé depuis le disque.
+    """
+
+    def __init__(self, pool: FileProcessingPool, cache: Optional[DocumentIndexCache] = None,
+                 chunk_tokens: int = DOC_CHUNK_TOKENS, overlap: int = DOC_CHUNK_OVERLAP,
+                 max_pages: int = DOC_MAX_PAGES, store: Optional[UploadStore] = None):
+        self.pool = pool
+        self.store = store
+        self.cache = cache or DocumentIndexCache()
+        self.chunk_tokens = chunk_tokens
+        self.overlap = overlap
+        self.max_pages = max_pages
+
+    def get(self, doc_id: str) -> Optional[DocumentIndex]:
+        return self.cache.get(doc_id)
+
+    async def load(self, doc_id: str) -> Optional[DocumentIndex]:
+        """Index en cache, sinon ré-indexé depuis le store partagé ; None si inconnu."""
+        index = self.cache.get(doc_id)
+        if index is not None or self.store is None:
+            return index
+        path = self.store.find(doc_id, ".pdf")
+        if path is None:
+            return None
+        return await self.index(SpooledUpload(path, path.name, "application/pdf", path.stat().st_size, doc_id))
+
+    async def index(self, spooled: SpooledUpload) -> DocumentIndex:
+        index = self.cache.get(spooled.sha256)
+        if index is None:
+            pages, parts = await self.pool.map_pdf_pages(
+                spooled.path, chunk_pdf_pages, self.chunk_tokens, self.overlap, max_pages=self.max_pages
+            )
+            chunks = [chunk for part in parts for chunk in part]
+            index = DocumentIndex(spooled.sha256, spooled.filename, pages, chunks)
+            self.cache.put(index)
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cache": self.cache.stats()}
+
+
+def document_message(index: DocumentIndex, chunks: List[Chunk]) -> Dict[str, Any]:
+    """Message utilisateur contenant les passages retenus, avec leur page."""
+    passages = "\n\n".join(f"[p. {c.page}] {c.text}" for c in chunks)
+    return {
+        "role": "user",
+        "content": f"Extraits du fichier {index.filename} ({len(chunks)}/{len(index.chunks)} passages) :\n{passages}",
+    }
+
+
+def document_report(index: DocumentIndex, chunks: List[Chunk]) -> Dict[str, Any]:
+    return {
+        "id": index.doc_id,
+        "filename": index.filename,
+        "pages": index.pages,
+        "chunks": len(index.chunks),
+        "chunks_sent": len(chunks),
+        "tokens": index.tokens,
+        "tokens_sent": sum(c.tokens for c in chunks),
+    }
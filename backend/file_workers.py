@@ -0,0 +1,218 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Tuple
+
+from deployment import WORKERS
+
+# Nombre de processus (par worker HTTP : les cœurs sont partagés entre workers),
+# pages par tâche, délai max par fichier, file d'attente max
+FILE_WORKERS = int(os.getenv("FILE_WORKERS", max(1, min(4, os.cpu_count() or 1) // WORKERS)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 8))
+FILE_TIMEOUT = float(os.getenv("FILE_PROCESS_TIMEOUT", 30))
+FILE_MAX_PENDING = int(os.getenv("FILE_MAX_PENDING", 64))
+# Bibliothèques chargées dans chaque processus du pool lors d'un warm-up (PDF, images)
+FILE_MODULES = ("fitz", "PIL.Image", "PIL.ImageOps")
+
+logger = logging.getLogger("file-workers")
+
+# Tâches soumises au pool pour le fichier en cours (abandonnées s'il dépasse son délai)
+_FILE_JOBS: ContextVar[Optional[List[Future]]] = ContextVar("file_jobs", default=None)
+
+
+# -----------------------------------------------------
+# Fonctions exécutées dans les processus workers
+# (niveau module : doivent rester picklables)
+# -----------------------------------------------------
+def preload_modules(modules: Tuple[str, ...]):
+    """Initialiseur des processus : importe `modules` (absents ignorés, l'erreur viendra à l'usage)."""
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def ping() -> int:
+    return os.getpid()
+
+
+def pdf_page_count(path: str) -> int:
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+# -----------------------------------------------------
+# Pool
+# -----------------------------------------------------
+class FileProcessingPool:
+    """
+    Pool de processus borné pour le prétraitement CPU des fichiers
+    (découpage PDF, ré-encodage d'images), hors de la boucle asyncio.
+
+    - au plus `max_workers` processus
+    - au plus `max_pending` fichiers en cours ou en attente (sinon attente)
+    - délai max par fichier : asyncio.TimeoutError au-delà ; ses tâches en
+      attente sont annulées et, si l'une tourne encore, le pool est recyclé
+      (processus terminés) : un fichier bloqué ne garde ni CPU ni processus.
+      Les tâches d'autres fichiers interrompues par ce recyclage sont
+      relancées une fois sur le nouveau pool.
+    """
+
+    def __init__(self, max_workers: int = FILE_WORKERS, timeout: float = FILE_TIMEOUT,
+                 max_pending: int = FILE_MAX_PENDING, pages_per_task: int = PDF_PAGES_PER_TASK):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pages_per_task = pages_per_task
+
+        self.submitted = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.abandoned = 0
+        self.recycled = 0
+
+        self._preload: Tuple[str, ...] = ()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._admission: Optional[asyncio.Semaphore] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Créé au premier fichier ; forkserver évite de dupliquer l'état du serveur
+        if self._executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(method),
+                initializer=preload_modules if self._preload else None,
+                initargs=(self._preload,),
+            )
+        return self._executor
+
+    async def warm_up(self, modules: Tuple[str, ...] = FILE_MODULES) -> int:
+        """
+        Lance tous les processus du pool, chacun important `modules` au démarrage :
+        le premier fichier ne paie ni le fork ni l'import de PyMuPDF / Pillow.
+        Retourne le nombre de processus prêts.
+        """
+        if self._executor is None:
+            self._preload = tuple(modules)
+        loop = asyncio.get_running_loop()
+        # Une tâche par processus : l'executor en démarre un par soumission tant qu'aucun n'est libre
+        pids = await asyncio.gather(*(loop.run_in_executor(self.executor, ping) for _ in range(self.max_workers)))
+        return len(set(pids))
+
+    async def _submit(self, fn, *args):
+        jobs = _FILE_JOBS.get()
+        for attempt in range(2):
+            executor = self.executor
+            future = executor.submit(fn, *args)
+            self.submitted += 1
+            # Terminée quand le processus a fini (ou a été arrêté), pas quand on cesse de l'attendre
+            future.add_done_callback(self._job_done)
+            if jobs is not None:
+                jobs.append(future)
+            try:
+                return await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                if executor is self._executor:
+                    # Processus mort hors recyclage (crash) : le prochain fichier repart d'un pool neuf
+                    self._executor = None
+                elif attempt == 0:
+                    continue  # pool recyclé à cause du délai d'un autre fichier : nouvel essai
+                self.failures += 1
+                raise
+            except Exception:
+                self.failures += 1
+                raise
+
+    def _job_done(self, future: Future):
+        self.completed += 1
+
+    async def run_file(self, coro_fn, *args):
+        """Traite un fichier : admission bornée + délai max global pour ce fichier."""
+        if self._admission is None:
+            self._admission = asyncio.Semaphore(self.max_pending)
+        async with self._admission:
+            jobs: List[Future] = []
+            token = _FILE_JOBS.set(jobs)
+            try:
+                return await asyncio.wait_for(coro_fn(*args), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._abandon(jobs)
+                raise
+            finally:
+                _FILE_JOBS.reset(token)
+
+    def _abandon(self, jobs: List[Future]):
+        """Délai dépassé : annule les tâches en attente, recycle le pool si l'une tourne encore."""
+        running = [job for job in jobs if not job.cancel() and not job.done()]
+        if not running:
+            return
+        self.abandoned += len(running)
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            self.recycled += 1
+            logger.warning(f"Délai de {self.timeout:.0f} s dépassé : {len(running)} tâche(s) arrêtée(s), pool recyclé")
+            _terminate(executor)
+
+    async def map_pdf_pages(self, path: str, fn, *args, max_pages: Optional[int] = None) -> Tuple[int, List[Any]]:
+        """
+        Applique `fn(path, start, stop, *args)` à des tranches de pages réparties
+        entre les workers, par vagues (un gros PDF ne monopolise pas la file).
+        Retourne (nombre de pages, résultats dans l'ordre des tranches).
+        """
+        return await self.run_file(self._map_pdf_pages, str(path), fn, args, max_pages)
+
+    async def _map_pdf_pages(self, path: str, fn, args: tuple, max_pages: Optional[int]) -> Tuple[int, List[Any]]:
+        page_count = await self._submit(pdf_page_count, path)
+        if max_pages is not None:
+            page_count = min(page_count, max_pages)
+        ranges = [(i, min(i + self.pages_per_task, page_count)) for i in range(0, page_count, self.pages_per_task)]
+
+        results: List[Any] = []
+        for wave in range(0, len(ranges), self.max_workers):
+            batch = ranges[wave:wave + self.max_workers]
+            results.extend(await asyncio.gather(*(self._submit(fn, path, a, b, *args) for a, b in batch)))
+        return page_count, results
+
+    async def run(self, fn, *args):
+        """Exécute `fn(*args)` dans un worker (fonction de niveau module), comme un fichier."""
+        return await self.run_file(self._submit, fn, *args)
+
+    def stats(self) -> Dict[str, Any]:
+        in_flight = self.submitted - self.completed
+        return {
+            "workers": self.max_workers,
+            "queue_depth": max(0, in_flight - self.max_workers),
+            "running": min(in_flight, self.max_workers),
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "abandoned": self.abandoned,
+            "recycled": self.recycled,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _terminate(executor: ProcessPoolExecutor):
+    """Arrête les processus du pool sans attendre leurs tâches en cours."""
+    terminate = getattr(executor, "terminate_workers", None)  # Python 3.14+
+    if terminate is not None:
+        terminate()
+        return
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,133 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Dict, Any, Tuple
+
+from adapters.base import approx_tokens
+
+# Budget de tokens d'historique par requête (0 : part HISTORY_CONTEXT_SHARE de la
+# fenêtre de contexte du modèle ; pas de limite pour un modèle sans profil connu),
+# part max réservée au résumé, longueur max d'un tour dans le résumé, stratégie (summary | drop)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 0))
+HISTORY_CONTEXT_SHARE = float(os.getenv("HISTORY_CONTEXT_SHARE", 0.5))
+HISTORY_SUMMARY_SHARE = float(os.getenv("HISTORY_SUMMARY_SHARE", 0.15))
+HISTORY_SUMMARY_TURN_CHARS = int(os.getenv("HISTORY_SUMMARY_TURN_CHARS", 160))
+HISTORY_STRATEGY = os.getenv("HISTORY_STRATEGY", "summary")
+
+HISTORY_TOKEN_BUDGETS: Dict[str, int] = {}
+# ex. HISTORY_MODEL_BUDGETS="openai:gpt-4o=8000,mistral:open-mistral-7b=2000" (0 = pas de limite)
+for _item in filter(None, os.getenv("HISTORY_MODEL_BUDGETS", "").split(",")):
+    _model, _, _budget = _item.rpartition("=")
+    HISTORY_TOKEN_BUDGETS[_model.strip()] = int(_budget)
+
+# Surcoût de mise en forme d'un message dans le prompt (rôle, séparateurs)
+MESSAGE_OVERHEAD = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def budget_for(model: str) -> int:
+    if model in HISTORY_TOKEN_BUDGETS:
+        return HISTORY_TOKEN_BUDGETS[model]
+    if HISTORY_TOKEN_BUDGET > 0:
+        return HISTORY_TOKEN_BUDGET
+    from model_router import MODEL_PROFILES  # importe ce module : import local
+
+    profile = MODEL_PROFILES.get(model)
+    return int(profile.context * HISTORY_CONTEXT_SHARE) if profile is not None else 0
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    content = message.get("content")
+    if isinstance(content, list):  # contenu multimodal : seules les parties texte comptent ici
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return approx_tokens(str(content or "")) + MESSAGE_OVERHEAD
+
+
+def count_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+@dataclass
+class Compaction:
+    original_tokens: int
+    sent_tokens: int
+    dropped_messages: int = 0
+    summarized: bool = False
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.original_tokens - self.sent_tokens)
+
+
+def _summary_line(message: Dict[str, Any]) -> str:
+    content = message.get("content")
+    text = content if isinstance(content, str) else "[contenu multimodal]"
+    text = " ".join(text.split())
+    first = _SENTENCE_END.split(text, 1)[0]
+    if len(first) > HISTORY_SUMMARY_TURN_CHARS:
+        first = first[:HISTORY_SUMMARY_TURN_CHARS].rsplit(" ", 1)[0] + "…"
+    return f"- {message.get('role', 'user')} : {first}"
+
+
+def summarize(messages: List[Dict[str, Any]], budget: int) -> Dict[str, Any]:
+    """
+    Résumé extractif (première phrase de chaque tour, les plus récents en
+    priorité) : déterministe et sans appel au modèle, donc sans coût carbone.
+    """
+    header = "Résumé des échanges précédents (tronqué) :"
+    lines: List[str] = []
+    used = approx_tokens(header) + MESSAGE_OVERHEAD
+    for message in reversed(messages):
+        line = _summary_line(message)
+        cost = approx_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return {"role": "system", "content": "\n".join([header, *reversed(lines)])}
+
+
+def compact_history(model: str, messages: List[Dict[str, Any]],
+                    budget: int = None, strategy: str = None) -> Tuple[List[Dict[str, Any]], Compaction]:
+    """
+    Ramène l'historique sous le budget de tokens du modèle :
+    - les messages système et le dernier message sont toujours gardés en entier ;
+    - les tours les plus récents sont gardés tant qu'ils tiennent ;
+    - les plus anciens sont résumés (strategy="summary") ou abandonnés ("drop").
+    """
+    budget = budget_for(model) if budget is None else budget
+    strategy = strategy or HISTORY_STRATEGY
+    original = count_tokens(messages)
+    if budget <= 0 or original <= budget or len(messages) <= 1:
+        return messages, Compaction(original, original)
+
+    system = [i for i, m in enumerate(messages) if m.get("role") == "system"]
+    last = len(messages) - 1
+    pinned = set(system) | {last}
+    used = sum(message_tokens(messages[i]) for i in pinned)
+
+    # Réserve pour le résumé des tours abandonnés
+    summary_budget = int(budget * HISTORY_SUMMARY_SHARE) if strategy == "summary" else 0
+
+    kept = set(pinned)
+    for i in range(last - 1, -1, -1):
+        if i in pinned:
+            continue
+        cost = message_tokens(messages[i])
+        if used + cost > budget - summary_budget:
+            break
+        kept.add(i)
+        used += cost
+
+    dropped = [m for i, m in enumerate(messages) if i not in kept]
+    compacted = [m for i, m in enumerate(messages) if i in kept]
+    summarized = False
+    if dropped and summary_budget > 0:
+        summary = summarize(dropped, summary_budget)
+        # Le résumé prend la place des tours abandonnés, après les messages système de tête
+        position = next((k for k, m in enumerate(compacted) if m.get("role") != "system"), len(compacted))
+        compacted.insert(position, summary)
+        summarized = True
+
+    return compacted, Compaction(original, count_tokens(compacted), len(dropped), summarized)
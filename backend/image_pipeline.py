@@ -0,0 +1,268 @@
+import base64
+import math
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from io import BytesIO
+from typing import Dict, Any, Optional, Tuple
+
+from file_workers import FileProcessingPool
+from uploads import SpooledUpload
+
+# Politique par défaut et taille max du cache d'images encodées (octets)
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Formats que les API vision acceptent tels quels
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+# -----------------------------------------------------
+# Politiques par modèle
+# -----------------------------------------------------
+@dataclass(frozen=True)
+class ImagePolicy:
+    """
+    Comment préparer une image pour un modèle vision :
+    - max_long / max_short : côtés max (au-delà, le fournisseur réduit de toute façon)
+    - tile / tile_snap     : taille des tuiles facturées ; on accepte de réduire
+                             jusqu'à `tile_snap` de plus pour économiser une rangée
+    - format / quality     : JPEG ou WEBP
+    - detail               : "high" ou "low" (paramètre `detail` d'OpenAI)
+    """
+
+    max_long: int = 2048
+    max_short: int = 768
+    tile: int = 512
+    tile_snap: float = 0.1
+    format: str = IMAGE_FORMAT
+    quality: int = IMAGE_QUALITY
+    detail: str = "high"
+
+    @property
+    def key(self) -> Tuple:
+        return (self.max_long, self.max_short, self.tile, self.tile_snap, self.format, self.quality, self.detail)
+
+
+# GPT-4o : l'image est ramenée dans 2048×2048 puis à 768 px sur le petit côté,
+# et facturée par tuiles de 512 px.
+DEFAULT_POLICY = ImagePolicy()
+IMAGE_POLICIES: Dict[str, ImagePolicy] = {
+    "openai:gpt-4o": DEFAULT_POLICY,
+    "openai:gpt-4o-mini": DEFAULT_POLICY,
+    "openai:gpt-4-turbo": DEFAULT_POLICY,
+}
+
+
+def policy_for(model: str) -> ImagePolicy:
+    return IMAGE_POLICIES.get(model, DEFAULT_POLICY)
+
+
+# -----------------------------------------------------
+# Dimensions et estimation de tokens
+# -----------------------------------------------------
+def target_size(width: int, height: int, policy: ImagePolicy) -> Tuple[int, int]:
+    """Taille finale : dans les bornes de la politique, alignée sur les tuiles si c'est presque gratuit."""
+    scale = min(1.0, policy.max_long / max(width, height), policy.max_short / min(width, height))
+
+    if policy.tile and policy.tile_snap > 0:
+        snap = 1.0
+        for side in (width * scale, height * scale):
+            aligned = (side // policy.tile) * policy.tile
+            if policy.tile <= aligned < side:
+                factor = aligned / side
+                if factor >= 1 - policy.tile_snap:
+                    snap = min(snap, factor)
+        scale *= snap
+
+    return max(1, math.floor(width * scale + 1e-6)), max(1, math.floor(height * scale + 1e-6))
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Tokens facturés pour une image (formule GPT-4o : 85 + 170 par tuile de 512 px)."""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+# -----------------------------------------------------
+# Fonction exécutée dans les processus workers
+# -----------------------------------------------------
+def preprocess_image(path: str, policy: ImagePolicy) -> Dict[str, Any]:
+    """
+    Réduit et ré-encode l'image selon la politique. Si aucune réduction n'est
+    nécessaire et que l'original est plus léger qu'un ré-encodage, l'original
+    est envoyé tel quel.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        source_format = img.format
+        rotated = img.getexif().get(0x0112, 1) in (5, 6, 7, 8)  # orientation EXIF à 90°
+        width, height = img.size[::-1] if rotated else img.size
+        size = target_size(width, height, policy)
+
+        # JPEG : décodage directement à une résolution réduite quand c'est possible
+        img.draft("RGB", size[::-1] if rotated else size)
+        img = ImageOps.exif_transpose(img)
+        resized = img.size != (width, height)
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            resized = True
+
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        if policy.format == "JPEG" and has_alpha:
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if has_alpha else "RGB")
+
+        buf = BytesIO()
+        img.save(buf, format=policy.format, quality=policy.quality, optimize=True)
+        data, mime = buf.getbuffer(), f"image/{policy.format.lower()}"
+
+    if not resized and source_format in PASSTHROUGH_FORMATS and os.path.getsize(path) <= len(data):
+        with open(path, "rb") as f:
+            data, mime = f.read(), PASSTHROUGH_FORMATS[source_format]
+
+    return {
+        "b64": base64.b64encode(data).decode("ascii"),
+        "mime": mime,
+        "bytes": len(data),
+        "width": size[0],
+        "height": size[1],
+        "original_width": width,
+        "original_height": height,
+    }
+
+
+# -----------------------------------------------------
+# Cache et pipeline
+# -----------------------------------------------------
+@dataclass
+class ProcessedImage:
+    b64: str
+    mime: str
+    detail: str
+    width: int
+    height: int
+    original_width: int
+    original_height: int
+    original_bytes: int
+    bytes: int
+    tokens: int
+    original_tokens: int
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{self.b64}"
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(0, self.original_bytes - self.bytes)
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.tokens)
+
+    def report(self) -> Dict[str, Any]:
+        report = {k: v for k, v in asdict(self).items() if k != "b64"}
+        report.update(bytes_saved=self.bytes_saved, tokens_saved=self.tokens_saved)
+        return report
+
+
+class ImageCache:
+    """LRU des images encodées, borné en octets, indexé par (sha256 du contenu, politique)."""
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Tuple, ProcessedImage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[ProcessedImage]:
+        with self._lock:
+            image = self._data.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: Tuple, image: ProcessedImage):
+        cost = len(image.b64)
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.b64)
+            self._data[key] = image
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted.b64)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._data), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+class ImagePipeline:
+    """
+    Prépare les images pour les modèles vision : réduction selon la politique
+    du modèle, ré-encodage JPEG/WebP dans le pool de processus, et cache par
+    empreinte de contenu (une image envoyée deux fois n'est encodée qu'une fois).
+    """
+
+    def __init__(self, pool: FileProcessingPool, cache: Optional[ImageCache] = None):
+        self.pool = pool
+        self.cache = cache or ImageCache()
+        self.images = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+
+    async def process(self, spooled: SpooledUpload, model: str) -> ProcessedImage:
+        policy = policy_for(model)
+        key = (spooled.sha256, policy.key)
+
+        image = self.cache.get(key)
+        if image is None:
+            encoded = await self.pool.run(preprocess_image, str(spooled.path), policy)
+            image = ProcessedImage(
+                b64=encoded["b64"],
+                mime=encoded["mime"],
+                detail=policy.detail,
+                width=encoded["width"],
+                height=encoded["height"],
+                original_width=encoded["original_width"],
+                original_height=encoded["original_height"],
+                original_bytes=spooled.size,
+                bytes=encoded["bytes"],
+                tokens=estimate_image_tokens(encoded["width"], encoded["height"], policy.detail),
+                original_tokens=estimate_image_tokens(encoded["original_width"], encoded["original_height"]),
+            )
+            self.cache.put(key, image)
+
+        self.images += 1
+        self.bytes_saved += image.bytes_saved
+        self.tokens_saved += image.tokens_saved
+        return image
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "images": self.images,
+            "bytes_saved": self.bytes_saved,
+            "tokens_saved_est": self.tokens_saved,
+            "cache": self.cache.stats(),
+        }
+
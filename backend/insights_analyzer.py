@@ -1,123 +1,100 @@
-import json
 from pathlib import Path
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Dict, List, Any
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from trace_rollups import TraceRollups, day_label, hour_label
+from trace_store import TraceStore, get_trace_store
 
 
 class InsightsAnalyzer:
     """Analyse les traces EcoLogits pour générer des insights environnementaux."""
     
-    def __init__(self, traces_path: Path):
+    def __init__(
+        self,
+        traces_path: Path,
+        store: Optional[TraceStore] = None,
+        columnar: bool = False,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        model: Optional[str] = None,
+    ):
         self.traces_path = traces_path
-        self.traces = self._load_traces()
-    
-    def _load_traces(self) -> List[Dict[str, Any]]:
-        """Charge et parse les traces JSONL en filtrant les logs."""
-        traces = []
-        if not self.traces_path.exists():
-            return traces
-        
-        with open(self.traces_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line or not line.startswith('{'):
-                    continue  # Ignore les warnings/logs
-                try:
-                    data = json.loads(line)
-                    if 'timestamp' in data and 'model' in data:
-                        data['timestamp'] = datetime.fromisoformat(data['timestamp'])
-                        traces.append(data)
-                except json.JSONDecodeError:
-                    continue
+        self.store = store or get_trace_store(traces_path, "columnar" if columnar else "dicts")
+        self.store.refresh()
         
-        return sorted(traces, key=lambda x: x['timestamp'])
+        # Sans filtre : rollups globaux. Avec filtre : fenêtre trouvée par dichotomie.
+        if start is None and end is None and model is None:
+            self.rollups = self.store.rollups_snapshot()
+        else:
+            self.rollups = self.store.window_rollups(start, end, model)
+    
+    @classmethod
+    def from_rollups(cls, rollups: TraceRollups) -> "InsightsAnalyzer":
+        """Analyseur sur des rollups déjà calculés (ex. flux /insights/stream), sans relire le store."""
+        analyzer = cls.__new__(cls)
+        analyzer.traces_path = None
+        analyzer.store = None
+        analyzer.rollups = rollups
+        return analyzer
     
     def get_overview_metrics(self) -> Dict[str, Any]:
         """Métriques globales d'usage."""
-        if not self.traces:
+        totals = self.rollups.totals
+        if not totals.requests:
             return self._empty_metrics()
         
-        total_requests = len(self.traces)
-        total_input_tokens = sum(t.get('input_tokens', 0) for t in self.traces)
-        total_output_tokens = sum(t.get('output_tokens', 0) for t in self.traces)
-        total_energy = sum(t.get('energy_kwh', 0) for t in self.traces)
-        total_carbon = sum(t.get('carbon_gco2eq', 0) for t in self.traces)
-        
-        avg_carbon_per_request = total_carbon / total_requests if total_requests > 0 else 0
+        total_requests = totals.requests
+        avg_carbon_per_request = totals.carbon / total_requests if total_requests > 0 else 0
         
         return {
             "total_requests": total_requests,
-            "total_tokens": total_input_tokens + total_output_tokens,
-            "total_energy_kwh": round(total_energy, 4),
-            "total_carbon_gco2eq": round(total_carbon, 2),
+            "total_tokens": totals.tokens,
+            "total_energy_kwh": round(totals.energy, 4),
+            "total_carbon_gco2eq": round(totals.carbon, 2),
             "avg_carbon_per_request": round(avg_carbon_per_request, 3),
+            "cache_hits": totals.cache_hits,
+            "carbon_saved_gco2eq": round(totals.saved_carbon, 2),
+            "routed_requests": totals.routed,
+            "routing_carbon_saved_gco2eq": round(totals.routing_saved_carbon, 2),
             "date_range": {
-                "start": self.traces[0]['timestamp'].isoformat(),
-                "end": self.traces[-1]['timestamp'].isoformat()
+                "start": self.rollups.first_ts.isoformat(),
+                "end": self.rollups.last_ts.isoformat()
             }
         }
     
     def get_carbon_timeline(self, granularity: str = "day") -> List[Dict[str, Any]]:
         """Timeline des émissions carbone."""
-        timeline = defaultdict(lambda: {"carbon": 0, "requests": 0, "energy": 0})
-        
-        for trace in self.traces:
-            if granularity == "day":
-                key = trace['timestamp'].strftime("%Y-%m-%d")
-            elif granularity == "hour":
-                key = trace['timestamp'].strftime("%Y-%m-%d %H:00")
-            else:
-                key = trace['timestamp'].strftime("%Y-%m-%d")
-            
-            timeline[key]["carbon"] += trace.get('carbon_gco2eq', 0)
-            timeline[key]["energy"] += trace.get('energy_kwh', 0)
-            timeline[key]["requests"] += 1
+        if granularity == "hour":
+            buckets, label = self.rollups.per_hour, hour_label
+        else:
+            buckets, label = self.rollups.per_day, day_label
         
         return [
             {
-                "date": date,
-                "carbon_gco2eq": round(data["carbon"], 2),
-                "energy_kwh": round(data["energy"], 4),
-                "requests": data["requests"]
+                "date": label(key),
+                "carbon_gco2eq": round(data.carbon, 2),
+                "energy_kwh": round(data.energy, 4),
+                "requests": data.requests
             }
-            for date, data in sorted(timeline.items())
+            for key, data in sorted(buckets.items())
         ]
     
     def get_model_comparison(self) -> List[Dict[str, Any]]:
         """Comparaison des modèles par efficacité."""
-        model_stats = defaultdict(lambda: {
-            "requests": 0,
-            "carbon": 0,
-            "energy": 0,
-            "tokens": 0,
-            "input_tokens": 0,
-            "output_tokens": 0
-        })
-        
-        for trace in self.traces:
-            model = trace.get('model', 'unknown')
-            stats = model_stats[model]
-            stats["requests"] += 1
-            stats["carbon"] += trace.get('carbon_gco2eq', 0)
-            stats["energy"] += trace.get('energy_kwh', 0)
-            stats["input_tokens"] += trace.get('input_tokens', 0)
-            stats["output_tokens"] += trace.get('output_tokens', 0)
-            stats["tokens"] += trace.get('input_tokens', 0) + trace.get('output_tokens', 0)
-        
         results = []
-        for model, stats in model_stats.items():
-            carbon_per_1k_tokens = (stats["carbon"] / stats["tokens"] * 1000) if stats["tokens"] > 0 else 0
-            avg_carbon_per_request = stats["carbon"] / stats["requests"] if stats["requests"] > 0 else 0
+        for model, stats in self.rollups.per_model.items():
+            carbon_per_1k_tokens = (stats.carbon / stats.tokens * 1000) if stats.tokens > 0 else 0
+            avg_carbon_per_request = stats.carbon / stats.requests if stats.requests > 0 else 0
             
             results.append({
                 "model": model,
-                "requests": stats["requests"],
-                "total_carbon_gco2eq": round(stats["carbon"], 2),
-                "total_energy_kwh": round(stats["energy"], 4),
-                "total_tokens": stats["tokens"],
+                "requests": stats.requests,
+                "total_carbon_gco2eq": round(stats.carbon, 2),
+                "total_energy_kwh": round(stats.energy, 4),
+                "total_tokens": stats.tokens,
                 "carbon_per_1k_tokens": round(carbon_per_1k_tokens, 3),
                 "avg_carbon_per_request": round(avg_carbon_per_request, 3),
+                "cache_hits": stats.cache_hits,
                 "efficiency_score": self._calculate_efficiency_score(carbon_per_1k_tokens)
             })
         
@@ -139,26 +116,19 @@ class InsightsAnalyzer:
     
     def get_hourly_heatmap(self) -> List[Dict[str, Any]]:
         """Carte de chaleur des émissions par heure de la journée."""
-        heatmap = defaultdict(lambda: {"carbon": 0, "requests": 0})
-        
-        for trace in self.traces:
-            hour = trace['timestamp'].hour
-            heatmap[hour]["carbon"] += trace.get('carbon_gco2eq', 0)
-            heatmap[hour]["requests"] += 1
-        
         return [
             {
                 "hour": hour,
-                "carbon_gco2eq": round(data["carbon"], 2),
-                "requests": data["requests"],
-                "intensity": round(data["carbon"] / data["requests"], 3) if data["requests"] > 0 else 0
+                "carbon_gco2eq": round(data.carbon, 2),
+                "requests": data.requests,
+                "intensity": round(data.carbon / data.requests, 3) if data.requests > 0 else 0
             }
-            for hour, data in sorted(heatmap.items())
+            for hour, data in sorted(self.rollups.per_hour_of_day.items())
         ]
     
     def get_equivalents(self) -> Dict[str, Any]:
         """Équivalents tangibles du CO₂ émis."""
-        total_carbon = sum(t.get('carbon_gco2eq', 0) for t in self.traces)
+        total_carbon = self.rollups.totals.carbon
         
         return {
             "netflix_hours": round(total_carbon / 36, 2),  # 36g/h Netflix
@@ -172,17 +142,14 @@ class InsightsAnalyzer:
         """Recommandations basées sur les patterns d'usage."""
         recommendations = []
         
-        if not self.traces:
+        total_requests = self.rollups.totals.requests
+        if not total_requests:
             return recommendations
         
         # Analyse des modèles utilisés
-        model_usage = defaultdict(int)
-        for trace in self.traces:
-            model_usage[trace.get('model', 'unknown')] += 1
-        
-        total_requests = len(self.traces)
+        model_usage = self.rollups.per_model
         heavy_models = ['openai:gpt-4-turbo', 'openai:gpt-4o']
-        heavy_usage = sum(model_usage.get(m, 0) for m in heavy_models)
+        heavy_usage = sum(model_usage[m].requests for m in heavy_models if m in model_usage)
         heavy_ratio = heavy_usage / total_requests if total_requests > 0 else 0
         
         # Recommandation 1: Optimiser le choix de modèle
@@ -209,11 +176,11 @@ class InsightsAnalyzer:
                 })
         
         # Recommandation 3: Tendance hebdomadaire
-        if len(self.traces) > 20:
-            recent = self.traces[-10:]
-            older = self.traces[-20:-10]
-            recent_avg = sum(t.get('carbon_gco2eq', 0) for t in recent) / len(recent)
-            older_avg = sum(t.get('carbon_gco2eq', 0) for t in older) / len(older)
+        if total_requests > 20:
+            recent = self.rollups.recent[-10:]
+            older = self.rollups.recent[-20:-10]
+            recent_avg = sum(carbon for _, carbon in recent) / len(recent)
+            older_avg = sum(carbon for _, carbon in older) / len(older)
             
             if recent_avg > older_avg * 1.2:
                 increase = int((recent_avg / older_avg - 1) * 100)
@@ -227,6 +194,17 @@ class InsightsAnalyzer:
         
         return recommendations
     
+    def get_dashboard(self, granularity: str = "day") -> Dict[str, Any]:
+        """Toutes les vues du dashboard, calculées sur les mêmes rollups (une seule passe)."""
+        return {
+            "overview": self.get_overview_metrics(),
+            "timeline": self.get_carbon_timeline(granularity),
+            "models": self.get_model_comparison(),
+            "heatmap": self.get_hourly_heatmap(),
+            "equivalents": self.get_equivalents(),
+            "recommendations": self.get_recommendations(),
+        }
+    
     def _empty_metrics(self) -> Dict[str, Any]:
         """Métriques vides si pas de données."""
         return {
@@ -235,5 +213,9 @@ class InsightsAnalyzer:
             "total_energy_kwh": 0,
             "total_carbon_gco2eq": 0,
             "avg_carbon_per_request": 0,
+            "cache_hits": 0,
+            "carbon_saved_gco2eq": 0,
+            "routed_requests": 0,
+            "routing_carbon_saved_gco2eq": 0,
             "date_range": None
         }
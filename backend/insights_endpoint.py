@@ -1,36 +1,109 @@
-from fastapi import APIRouter
-from pathlib import Path
+import os
+import hashlib
+from datetime import datetime
+from typing import Optional, Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from insights_analyzer import InsightsAnalyzer
+from insights_feed import INSIGHTS_STREAM, InsightsFeed
+from sse import SSE_HEADERS
+from trace_rollups import to_naive_utc
+from trace_store import get_trace_store
+from deployment import TRACES_PATH, TRACE_DIR
 
 router = APIRouter(prefix="/insights", tags=["Insights"])
-TRACES_PATH = Path(__file__).resolve().parent / "ecologits-traces.jsonl"
+
+# Index partagé par toutes les routes : le JSONL n'est parsé qu'une fois,
+# puis seules les lignes ajoutées sont lues à chaque requête.
+# INSIGHTS_LAYOUT=columnar → colonnes NumPy typées (moins de mémoire).
+# Avec TRACE_DIR (multi-workers), tous les segments des workers sont fusionnés.
+TRACE_STORE = get_trace_store(TRACES_PATH, os.getenv("INSIGHTS_LAYOUT", "dicts"), segments=TRACE_DIR)
+# Vue en direct pour /insights/stream (démarrée par main.py au lancement du worker)
+FEED = InsightsFeed(TRACE_STORE)
+
+
+def trace_filters(
+    start: Optional[datetime] = Query(None, description="Début inclus (ISO 8601, UTC par défaut)"),
+    end: Optional[datetime] = Query(None, description="Fin exclue (ISO 8601, UTC par défaut)"),
+    model: Optional[str] = Query(None, description="Ex. openai:gpt-4o-mini"),
+) -> Dict[str, Any]:
+    """Filtres communs à toutes les routes /insights/*."""
+    if start and end and to_naive_utc(start) >= to_naive_utc(end):
+        raise HTTPException(status_code=400, detail="'start' doit précéder 'end'.")
+    return {"start": start, "end": end, "model": model}
+
+
+def get_analyzer(filters: Dict[str, Any] = Depends(trace_filters)) -> InsightsAnalyzer:
+    return InsightsAnalyzer(TRACES_PATH, TRACE_STORE, **filters)
+
 
 @router.get("/overview")
-def get_insights_overview():
-    analyzer = InsightsAnalyzer(TRACES_PATH)
+def get_insights_overview(analyzer: InsightsAnalyzer = Depends(get_analyzer)):
     return analyzer.get_overview_metrics()
 
 @router.get("/timeline")
-def get_carbon_timeline(granularity: str = "day"):
-    analyzer = InsightsAnalyzer(TRACES_PATH)
+def get_carbon_timeline(granularity: str = "day", analyzer: InsightsAnalyzer = Depends(get_analyzer)):
     return analyzer.get_carbon_timeline(granularity)
 
 @router.get("/models")
-def get_model_comparison():
-    analyzer = InsightsAnalyzer(TRACES_PATH)
+def get_model_comparison(analyzer: InsightsAnalyzer = Depends(get_analyzer)):
     return analyzer.get_model_comparison()
 
 @router.get("/heatmap")
-def get_hourly_heatmap():
-    analyzer = InsightsAnalyzer(TRACES_PATH)
+def get_hourly_heatmap(analyzer: InsightsAnalyzer = Depends(get_analyzer)):
     return analyzer.get_hourly_heatmap()
 
 @router.get("/equivalents")
-def get_carbon_equivalents():
-    analyzer = InsightsAnalyzer(TRACES_PATH)
+def get_carbon_equivalents(analyzer: InsightsAnalyzer = Depends(get_analyzer)):
     return analyzer.get_equivalents()
 
 @router.get("/recommendations")
-def get_recommendations():
-    analyzer = InsightsAnalyzer(TRACES_PATH)
+def get_recommendations(analyzer: InsightsAnalyzer = Depends(get_analyzer)):
     return analyzer.get_recommendations()
+
+@router.get("/dashboard")
+def get_dashboard(request: Request, granularity: str = "day", filters: Dict[str, Any] = Depends(trace_filters)):
+    """
+    Overview, timeline, modèles, heatmap, équivalents et recommandations
+    en une seule réponse, calculés sur les mêmes rollups.
+    Réponse 304 si le client possède déjà cette version (If-None-Match).
+    """
+    TRACE_STORE.refresh()
+    params = f"{granularity}|{filters['start']}|{filters['end']}|{filters['model']}"
+    digest = hashlib.sha1(f"{TRACE_STORE.fingerprint()}|{params}".encode()).hexdigest()[:20]
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    analyzer = InsightsAnalyzer(TRACES_PATH, TRACE_STORE, **filters)
+    return JSONResponse(content=analyzer.get_dashboard(granularity), headers=headers)
+
+@router.get("/stream")
+async def stream_insights(granularity: str = "day"):
+    """
+    Dashboard en direct (Server-Sent Events) :
+    - `snapshot` : le dashboard complet, à la connexion ;
+    - `update`   : totaux, équivalents et seules les lignes modifiées
+                   (timeline jour / heure, modèles, heatmap), au plus une fois
+                   par INSIGHTS_STREAM_INTERVAL ;
+    - `reset`    : traces supprimées ou remplacées, recharger le dashboard.
+    Sans filtres : pour une fenêtre ou un modèle, utiliser /insights/dashboard.
+    """
+    if not INSIGHTS_STREAM:
+        raise HTTPException(status_code=404, detail="Flux désactivé (INSIGHTS_STREAM=0).")
+    queue = await FEED.subscribe()
+
+    async def events():
+        try:
+            yield FEED.snapshot(granularity)
+            while True:
+                message = await queue.get()
+                if message is None:  # client trop lent : fin du flux
+                    return
+                yield message
+        finally:
+            FEED.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
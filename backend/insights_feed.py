@@ -0,0 +1,273 @@
+"""
+Flux temps réel des insights (/insights/stream, Server-Sent Events).
+
+Chaque worker tient une vue à jour des rollups :
+- `base` : les traces sur disque, lues par le store partagé avec /insights
+           (segments des autres workers, historique, et traces de ce
+           worker antérieures à son démarrage) ;
+- `live` : les traces enregistrées par ce worker depuis son démarrage,
+           reçues directement d'estimate_carbon() (sans attendre l'écriture).
+
+Une trace ne met à jour que quelques buckets (totaux, modèle, jour, heure,
+heure de la journée) : ils sont marqués modifiés, puis toutes les
+INSIGHTS_STREAM_INTERVAL secondes un seul événement "update" est calculé
+sur ces buckets, sérialisé une fois et envoyé à tous les dashboards
+connectés. Les traces des autres workers arrivent par relecture
+incrémentale du store toutes les INSIGHTS_STREAM_REFRESH secondes.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Optional, Set, Tuple, Union
+
+from adapters.carbon_adapter import add_trace_listener
+from deployment import trace_segment
+from insights_analyzer import InsightsAnalyzer
+from sse import format_sse
+from trace_rollups import EPOCH, ONE_HOUR, Bucket, TraceRollups
+from trace_segments import SUFFIX as SEGMENT_SUFFIX, parse_trace
+from trace_store import SegmentedTraceStore, TraceStore
+
+logger = logging.getLogger("insights-feed")
+
+# Flux activé ; fréquence max des mises à jour poussées (s) ; relecture des autres workers (s)
+INSIGHTS_STREAM = os.getenv("INSIGHTS_STREAM", "1") != "0"
+STREAM_INTERVAL = float(os.getenv("INSIGHTS_STREAM_INTERVAL", 1.0))
+STREAM_REFRESH = float(os.getenv("INSIGHTS_STREAM_REFRESH", 5.0))
+# Événements en attente par client : au-delà, le client trop lent est déconnecté
+STREAM_QUEUE = int(os.getenv("INSIGHTS_STREAM_QUEUE", 32))
+# Commentaire SSE envoyé en l'absence de mise à jour (proxies, détection des déconnexions)
+KEEPALIVE = 15.0
+
+TABLES = ("per_model", "per_day", "per_hour", "per_hour_of_day")
+
+_CLOSE = None
+
+
+def is_own_trace_file(path: Path) -> bool:
+    """Fichier de traces écrit par ce processus (son JSONL, ou un de ses segments .trc)."""
+    own = trace_segment().resolve()
+    path = path.resolve()
+    if path == own:
+        return True
+    prefix = f"{own.name}-"
+    return (path.parent == own.parent and path.suffix == SEGMENT_SUFFIX
+            and path.name.startswith(prefix) and path.stem[len(prefix):].isdigit())
+
+
+class InsightsFeed:
+    """
+    Vue en direct des rollups et diffusion des mises à jour aux abonnés.
+
+    Les traces de ce worker sont datées après `started_at` : côté disque,
+    ses propres fichiers ne sont comptés que jusqu'à cette date, ce qui
+    évite de compter deux fois une trace reçue en direct puis relue.
+    """
+
+    def __init__(self, store: Union[TraceStore, SegmentedTraceStore], interval: float = STREAM_INTERVAL,
+                 refresh: float = STREAM_REFRESH, max_queue: int = STREAM_QUEUE):
+        self.store = store
+        self.interval = interval
+        self.refresh = refresh
+        self.max_queue = max_queue
+
+        self.started_at: Optional[datetime] = None
+        self.live = TraceRollups()
+        self.base: Optional[TraceRollups] = None
+        self.events = 0
+        self.dropped = 0
+
+        self._dirty: Dict[str, Set[Any]] = {table: set() for table in TABLES}
+        self._dirty_totals = False
+        self._reset = False
+        self._lock = threading.Lock()
+        self._base_lock = threading.Lock()
+        self._fingerprint: Optional[Tuple] = None
+        self._own_before: Dict[Path, TraceRollups] = {}
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    # -------------------------------------------------
+    # Traces
+    # -------------------------------------------------
+    def start(self):
+        """Démarrage du worker : toute trace enregistrée ensuite passe par record()."""
+        self.started_at = datetime.utcnow()
+        add_trace_listener(self.record)
+
+    def record(self, data: Dict[str, Any]):
+        """Abonné d'estimate_carbon() : quelques additions sous verrou, appelable depuis n'importe quel thread."""
+        trace = parse_trace(data)
+        hours = (trace["timestamp"] - EPOCH) // ONE_HOUR
+        with self._lock:
+            self.live.add(trace)
+            if self._task is not None:
+                self._mark(trace.get("model", "unknown"), hours)
+
+    def _mark(self, model: str, hours: int):
+        self._dirty_totals = True
+        self._dirty["per_model"].add(model)
+        self._dirty["per_day"].add(hours // 24)
+        self._dirty["per_hour"].add(hours)
+        self._dirty["per_hour_of_day"].add(hours % 24)
+
+    def refresh_base(self):
+        """
+        Relit le store (bloquant : à appeler hors de la boucle). Les buckets
+        modifiés par d'autres workers sont marqués pour la prochaine mise à jour.
+        """
+        with self._base_lock:
+            self.store.refresh()
+            readers = self.store.readers() if isinstance(self.store, SegmentedTraceStore) else [self.store]
+            own = [r for r in readers if is_own_trace_file(r.path)]
+            foreign = [r for r in readers if not is_own_trace_file(r.path)]
+            fingerprint = (tuple(r.path for r in own), tuple((r.path, r.fingerprint()) for r in foreign))
+            if fingerprint == self._fingerprint:
+                return
+
+            base = TraceRollups()
+            for reader in own:
+                # Avant started_at : n'évolue plus (calculé une fois par fichier)
+                before = self._own_before.get(reader.path)
+                if before is None:
+                    before = self._own_before[reader.path] = reader.window_rollups(end=self.started_at)
+                base.merge(before)
+            for reader in foreign:
+                reader.merge_rollups_into(base)
+
+            with self._lock:
+                if self.base is not None:
+                    self._diff(self.base, base)
+                self.base = base
+            self._fingerprint = fingerprint
+
+    def _diff(self, old: TraceRollups, new: TraceRollups):
+        if new.totals.requests < old.totals.requests:
+            self._reset = True  # rotation ou suppression de traces : les clients repartent d'un snapshot
+            return
+        if new.totals.requests != old.totals.requests:
+            self._dirty_totals = True
+        for table in TABLES:
+            before = getattr(old, table)
+            for key, bucket in getattr(new, table).items():
+                previous = before.get(key)
+                if previous is None or previous.requests != bucket.requests:
+                    self._dirty[table].add(key)
+
+    # -------------------------------------------------
+    # Vues
+    # -------------------------------------------------
+    def view(self) -> TraceRollups:
+        """Rollups complets (disque + direct) ; coût proportionnel au nombre de buckets."""
+        with self._lock:
+            view = self.base.copy() if self.base is not None else TraceRollups()
+            view.merge(self.live)
+        return view
+
+    def snapshot(self, granularity: str = "day") -> str:
+        """Premier événement d'un abonné : le dashboard complet, comme /insights/dashboard."""
+        return format_sse("snapshot", InsightsAnalyzer.from_rollups(self.view()).get_dashboard(granularity))
+
+    def _update(self) -> Optional[str]:
+        """Événement des buckets modifiés depuis le précédent (None si rien n'a changé)."""
+        with self._lock:
+            if self._reset:
+                self._reset = False
+                self._clear()
+                return format_sse("reset", {})
+            if not self._dirty_totals:
+                return None
+            base = self.base or TraceRollups()
+            changed = TraceRollups()
+            changed.totals = _combined(base.totals, self.live.totals)
+            changed.first_ts = min(filter(None, (base.first_ts, self.live.first_ts)), default=None)
+            changed.last_ts = max(filter(None, (base.last_ts, self.live.last_ts)), default=None)
+            for table, keys in self._dirty.items():
+                ours, theirs = getattr(self.live, table), getattr(base, table)
+                target = getattr(changed, table)
+                for key in keys:
+                    target[key] = _combined(theirs.get(key), ours.get(key))
+            self._clear()
+
+        # Mêmes formats que les routes /insights/*, restreints aux lignes modifiées
+        analyzer = InsightsAnalyzer.from_rollups(changed)
+        return format_sse("update", {
+            "overview": analyzer.get_overview_metrics(),
+            "equivalents": analyzer.get_equivalents(),
+            "timeline": {"day": analyzer.get_carbon_timeline("day"),
+                         "hour": analyzer.get_carbon_timeline("hour")},
+            "models": analyzer.get_model_comparison(),
+            "heatmap": analyzer.get_hourly_heatmap(),
+        })
+
+    def _clear(self):
+        self._dirty_totals = False
+        for keys in self._dirty.values():
+            keys.clear()
+
+    # -------------------------------------------------
+    # Abonnés
+    # -------------------------------------------------
+    async def subscribe(self) -> asyncio.Queue:
+        if self.base is None:
+            await asyncio.to_thread(self.refresh_base)
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue)
+        self._subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _broadcast(self, message: str):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Client trop lent : déconnecté, EventSource se reconnecte et repart d'un snapshot
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(_CLOSE)
+                self.dropped += 1
+
+    async def _run(self):
+        """Boucle de diffusion, active tant qu'il reste au moins un abonné."""
+        last_refresh = last_sent = time.monotonic()
+        try:
+            while self._subscribers:
+                await asyncio.sleep(self.interval)
+                if time.monotonic() - last_refresh >= self.refresh:
+                    try:
+                        await asyncio.to_thread(self.refresh_base)
+                    except Exception as e:
+                        logger.error(f"Relecture des traces en échec : {e}")
+                    last_refresh = time.monotonic()
+                message = self._update()
+                if message is None and time.monotonic() - last_sent >= KEEPALIVE:
+                    message = ": keepalive\n\n"
+                if message is not None:
+                    self._broadcast(message)
+                    self.events += message.startswith("event:")
+                    last_sent = time.monotonic()
+        finally:
+            with self._lock:
+                self._task = None
+                self._clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"subscribers": len(self._subscribers), "events": self.events, "dropped": self.dropped,
+                "live_traces": self.live.totals.requests}
+
+
+def _combined(*buckets: Optional[Bucket]) -> Bucket:
+    total = Bucket()
+    for bucket in buckets:
+        if bucket is not None:
+            total.merge(bucket)
+    return total
@@ -1,33 +1,64 @@
+# En premier : le rapport de démarrage chronomètre l'import de l'application
+from startup import REPORT, STARTUP_WARMUP
+
 import os
 import json
-import tempfile
-import base64
+import asyncio
+import secrets
+import time
+from contextlib import nullcontext
 from pathlib import Path
-from io import BytesIO
-from typing import List
+from typing import List, Dict, Optional, Callable, Tuple
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from dotenv import load_dotenv
-from PIL import Image
 
-from models import ChatRequest, ChatResponse, ModelInfo
+from models import ChatRequest, ChatResponse, ModelInfo, SessionCreate, SessionTurn, SessionInfo, BatchRequest
+from sessions import Session, SessionStore
+from sse import format_sse, SSE_HEADERS
+from response_cache import ResponseCache, CachingAdapter
+from uploads import SpooledUpload, UploadStore, spool_to_temp
+from file_workers import FileProcessingPool
+from image_pipeline import ImagePipeline
+from document_index import DocumentPipeline, budget_for, document_message, document_report
+from history_compaction import Compaction, compact_history, count_tokens
+from model_router import ModelRouter, RoutingDecision, is_auto
+from resilience import ResilientAdapter, FailoverAdapter
+from rate_limits import RateLimiter, Admission
+from batch_jobs import BatchItem, BatchJob, BatchJobStore, BATCH_CONCURRENCY, BATCH_MAX_ITEMS, batch_usage, run_bounded
 from adapters.mistral_adapter import MistralAdapter
 from adapters.openai_adapter import OpenAIAdapter
+from adapters.base import BaseAdapter
+from adapters.http_pool import HttpPoolConfig
+from adapters.carbon_adapter import trace_fields
+from deployment import (WORKERS, UPLOAD_DIR, SHARED_DOCUMENTS, DOCUMENT_DIR, TRACE_DIR, TRACE_FORMAT,
+                        WARNINGS_LOG, prepare_directories, worker_id)
+from insights_endpoint import router as insights_router, FEED as INSIGHTS_FEED
+from insights_feed import INSIGHTS_STREAM
 
 # -----------------------------------------------------
 # 🌱 Tracking empreinte carbone
 # -----------------------------------------------------
-from ecologits import EcoLogits
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from trace_writer import close_trace_writers
+from metrics import METRICS, REGISTRY, CONTENT_TYPE, FILE_PROCESSING, MetricsMiddleware
+
+# EcoLogits instrumente le SDK OpenAI à la création du premier adaptateur (init_ecologits) ;
+# son logger (classe dédiée, avec warning_once) se charge sans le SDK
+from ecologits.log import logger
 
-EcoLogits.init(providers=["openai"])
-logger = logging.getLogger("ecologits")
 logger.setLevel(logging.INFO)
-handler = logging.FileHandler("ecologits-traces.jsonl", mode="a", encoding="utf-8")
-handler.setFormatter(logging.Formatter("%(message)s"))
-logger.addHandler(handler)
+# Écriture des logs EcoLogits hors du chemin de la requête (thread dédié,
+# démarré dans chaque worker : un thread ne survit pas au fork du superviseur)
+log_queue: queue.Queue = queue.Queue()
+logger.addHandler(QueueHandler(log_queue))
+log_listener: Optional[QueueListener] = None
 
 # -----------------------------------------------------
 # ⚙️ Configuration initiale
@@ -45,16 +76,36 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if METRICS:
+    app.add_middleware(MetricsMiddleware)
 
-# 📁 Répertoire d’upload
-UPLOAD_DIR = Path(__file__).parent / "uploads"
-UPLOAD_DIR.mkdir(exist_ok=True)
+# 📁 Uploads rangés par empreinte (UPLOAD_DIR, partageable entre répliques, servi sous /uploads)
+prepare_directories()
+UPLOADS = UploadStore(UPLOAD_DIR)
+# PDF de /chat/file-to-ai gardés pour les autres workers (SHARED_DOCUMENTS) : jamais servis
+DOCUMENTS = UploadStore(DOCUMENT_DIR)
+
+# ⚙️ Pool de processus pour l'extraction PDF / l'encodage d'images
+FILE_POOL = FileProcessingPool()
+# 🖼️ Réduction / ré-encodage des images vision, avec cache par empreinte
+IMAGE_PIPELINE = ImagePipeline(FILE_POOL)
+# 📄 PDF découpés en passages et indexés (BM25), avec cache par empreinte
+DOCUMENT_PIPELINE = DocumentPipeline(FILE_POOL, store=DOCUMENTS)
+# 🗂️ Conversations côté serveur (historique, pièces jointes traitées, PDF indexés)
+SESSIONS = SessionStore()
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
+# 📊 Insights (index de traces partagé dans le processus)
+app.include_router(insights_router)
+
 # -----------------------------------------------------
 # 📦 Liste des modèles
 # -----------------------------------------------------
 MODELS: List[ModelInfo] = [
+    # --- Routeur : modèle choisi par requête (carbone / latence / coût) ---
+    ModelInfo(provider="auto", model="auto", label="Auto (le plus sobre adapté)", enabled=True),
+
     # --- OpenAI ---
     ModelInfo(provider="openai", model="openai:gpt-4o-mini", label="GPT-4o-Mini", enabled=True),
     ModelInfo(provider="openai", model="openai:gpt-4o", label="GPT-4o (Vision)", enabled=True),
@@ -68,45 +119,402 @@ MODELS: List[ModelInfo] = [
 ]
 
 # -----------------------------------------------------
-# 🧩 Sélection automatique d’adaptateur
+# 🧩 Adaptateurs (créés une fois, clients HTTP poolés)
 # -----------------------------------------------------
-def pick_adapter(model_name: str):
-    if model_name.startswith("openai:"):
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="Clé API OpenAI absente du .env")
-        return OpenAIAdapter(api_key)
+PROVIDERS = {
+    "openai": (OpenAIAdapter, "OPENAI_API_KEY", "Clé API OpenAI absente du .env"),
+    "mistral": (MistralAdapter, "MISTRAL_API_KEY", "Clé API Mistral absente du .env"),
+}
+HTTP_POOL = HttpPoolConfig.from_env()
+RESPONSE_CACHE = ResponseCache.from_env()
+ADAPTERS: Dict[str, ResilientAdapter] = {}
+ROUTER = ModelRouter()
+LIMITER = RateLimiter.from_env()
+BATCH_JOBS = BatchJobStore()
 
-    if model_name.startswith("mistral:"):
-        api_key = os.getenv("MISTRAL_API_KEY")
+
+def get_provider_adapter(provider: str) -> ResilientAdapter:
+    """Retourne l'adaptateur partagé du fournisseur (créé au premier besoin)."""
+    adapter = ADAPTERS.get(provider)
+    if adapter is None:
+        adapter_cls, env_key, missing_msg = PROVIDERS[provider]
+        api_key = os.getenv(env_key)
         if not api_key:
-            raise HTTPException(status_code=500, detail="Clé API Mistral absente du .env")
-        return MistralAdapter(api_key)
+            raise HTTPException(status_code=500, detail=missing_msg)
+        # Délai max, retries, disjoncteur et appels en vol plafonnés, propres à chaque fournisseur
+        gate = LIMITER.gate(provider) if LIMITER is not None else None
+        adapter = ResilientAdapter(adapter_cls(api_key, pool=HTTP_POOL), provider, gate=gate)
+        ADAPTERS[provider] = adapter
+    return adapter
+
+
+def resolve_adapter(model_name: str) -> Optional[BaseAdapter]:
+    """Adaptateur du fournisseur d'un modèle, ou None s'il n'est pas configuré."""
+    provider = model_name.split(":", 1)[0]
+    if provider not in PROVIDERS or not os.getenv(PROVIDERS[provider][1]):
+        return None
+    return get_provider_adapter(provider)
+
+
+# Point d'entrée de tous les appels : cache, puis bascule entre fournisseurs
+FAILOVER = FailoverAdapter(resolve_adapter)
+CHAT_CLIENT: BaseAdapter = CachingAdapter(FAILOVER, RESPONSE_CACHE) if RESPONSE_CACHE is not None else FAILOVER
+
+
+@app.on_event("startup")
+def start_trace_log():
+    """Logs EcoLogits vers WARNINGS_LOG, séparé des traces (une ligne préfixée par worker)."""
+    global log_listener
+    handler = logging.FileHandler(WARNINGS_LOG, mode="a", encoding="utf-8")
+    handler.setFormatter(logging.Formatter(f"%(asctime)s {worker_id()} %(levelname)s %(message)s"))
+    log_listener = QueueListener(log_queue, handler)
+    log_listener.start()
+
+
+@app.on_event("startup")
+def start_insights_feed():
+    """Les traces de ce worker alimentent /insights/stream dès leur enregistrement."""
+    if INSIGHTS_STREAM:
+        INSIGHTS_FEED.start()
+
+
+def configured_providers() -> List[str]:
+    return [provider for provider, (_, env_key, _) in PROVIDERS.items() if os.getenv(env_key)]
+
+
+def preload_providers():
+    """SDK (et instrumentation EcoLogits) des fournisseurs configurés, sans client : appelable avant un fork."""
+    for provider in configured_providers():
+        PROVIDERS[provider][0].preload()
+
+
+_WARMUP_TASK: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    """
+    Sans STARTUP_WARMUP : prêt immédiatement, tout se charge au premier usage.
+    Avec : SDK, adaptateurs (clients HTTP poolés) et pool de fichiers créés en
+    tâche de fond ; /ready répond 503 jusqu'à la fin, /health reste disponible.
+    """
+    global _WARMUP_TASK
+    if not STARTUP_WARMUP:
+        REPORT.mark_ready()
+        return
+    _WARMUP_TASK = asyncio.create_task(warm_up())
+
+
+async def warm_up():
+    with REPORT.phase("warmup"):
+        try:
+            # Imports bloquants hors de la boucle ; clients créés sur la boucle (pas de course avec une requête)
+            await asyncio.to_thread(preload_providers)
+            for provider in configured_providers():
+                get_provider_adapter(provider)
+            await FILE_POOL.warm_up()
+        except Exception as e:  # un warm-up raté ne doit pas empêcher de servir
+            logging.getLogger("startup").error(f"Warm-up incomplet : {e}")
+    REPORT.mark_ready()
+
+
+@app.on_event("shutdown")
+async def close_adapters():
+    for adapter in ADAPTERS.values():
+        await adapter.aclose()
+    ADAPTERS.clear()
+
+
+@app.on_event("shutdown")
+def flush_traces():
+    """Écrit les derniers lots de traces avant l'arrêt."""
+    close_trace_writers()
+    if log_listener is not None:
+        log_listener.stop()
+
+
+@app.on_event("shutdown")
+def stop_file_pool():
+    FILE_POOL.shutdown()
+
+
+# -----------------------------------------------------
+# 🧩 Sélection automatique d’adaptateur
+# -----------------------------------------------------
+def pick_adapter(model_name: str) -> BaseAdapter:
+    provider = model_name.split(":", 1)[0] if ":" in model_name else None
+    if provider in PROVIDERS:
+        get_provider_adapter(provider)  # 500 si la clé du fournisseur est absente
+        return CHAT_CLIENT
 
     raise HTTPException(status_code=404, detail=f"Modèle '{model_name}' non reconnu.")
 
+def available_models() -> List[str]:
+    """Modèles activés dont le fournisseur est configuré."""
+    return [
+        m.model for m in MODELS
+        if m.enabled and m.provider in PROVIDERS and os.getenv(PROVIDERS[m.provider][1])
+    ]
+
+
+def route_model(model: str, messages: list, vision: bool = False) -> Tuple[str, Optional[RoutingDecision]]:
+    """`auto` / `auto:<politique>` → modèle choisi par le routeur ; sinon le modèle demandé."""
+    if not is_auto(model):
+        return model, None
+    try:
+        decision = ROUTER.route(model, messages, available_models(), vision=vision)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return decision.model, decision
+
+
+def routing_context(routing: Optional[RoutingDecision]):
+    """Les traces écrites dans ce bloc portent la décision du routeur."""
+    return trace_fields(**routing.trace_fields()) if routing else nullcontext()
+
+
+def with_routing(result: dict, routing: Optional[RoutingDecision]) -> dict:
+    if routing is None:
+        return result
+    # Après une bascule, le modèle effectivement utilisé n'est plus celui choisi
+    return {**result, "model": result.get("model", routing.model), "routing": routing.report()}
+
+
+def observe_latency(model: str, result: dict, duration_ms: float):
+    # Les réponses servies par le cache ou en échec ne disent rien de la latence du modèle
+    if not result.get("cached") and "error" not in result:
+        ROUTER.observe(result.get("model", model), duration_ms)
+
+
+async def admit(user_id: Optional[str], model: str, messages: list, batch: bool = False) -> Optional[Admission]:
+    """
+    Attend que les limites de l'utilisateur et du modèle autorisent l'appel (429 sinon).
+    Élément d'un lot (`batch`) : hors limite de requêtes/s de l'utilisateur, tokens comptés.
+    """
+    if LIMITER is None:
+        return None
+    return await LIMITER.admit(user_id or "anonymous", model, count_tokens(messages) + LIMITER.output_tokens,
+                               count_request=not batch)
+
+
+def settle(admission: Optional[Admission], result: dict):
+    if LIMITER is not None:
+        LIMITER.settle(admission, result.get("usage"))
+
+
+async def call_model(adapter: BaseAdapter, model: str, messages: list,
+                     routing: Optional[RoutingDecision], admission: Optional[Admission] = None) -> dict:
+    """Appel non streamé : traces marquées par le routage, latence observée, usage décompté."""
+    started = time.perf_counter()
+    with routing_context(routing):
+        result = await adapter.asend_chat(model, messages)
+    observe_latency(model, result, (time.perf_counter() - started) * 1000)
+    settle(admission, result)
+    return with_routing(result, routing)
+
 # -----------------------------------------------------
 # 🌡️ Health Check & Liste des modèles
 # -----------------------------------------------------
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "models_supported": len(MODELS)}
+    return {"status": "ok", "models_supported": len(MODELS), "file_pool": FILE_POOL.stats(),
+            "images": IMAGE_PIPELINE.stats(), "documents": DOCUMENT_PIPELINE.stats(),
+            "sessions": SESSIONS.stats(), "router": ROUTER.stats(),
+            "providers": {p: a.stats() for p, a in ADAPTERS.items()}, "failover": FAILOVER.stats(),
+            "rate_limits": LIMITER.stats() if LIMITER is not None else None,
+            "batches": BATCH_JOBS.stats(),
+            "insights_stream": INSIGHTS_FEED.stats() if INSIGHTS_STREAM else None,
+            "deployment": {"worker": worker_id(), "workers": WORKERS,
+                           "trace_dir": str(TRACE_DIR) if TRACE_DIR else None, "trace_format": TRACE_FORMAT,
+                           "shared_documents": SHARED_DOCUMENTS}}
+
+@app.get("/ready")
+def readiness():
+    """Sonde de disponibilité : 503 tant que le warm-up n'est pas terminé ; rapport de démarrage."""
+    report = REPORT.as_dict()
+    if not REPORT.ready:
+        return JSONResponse(report, status_code=503)
+    return report
+
+@app.get("/metrics")
+def get_metrics():
+    """Métriques au format texte Prometheus (latences, tokens, erreurs, cache, appels en cours)."""
+    if not METRICS:
+        raise HTTPException(status_code=404, detail="Métriques désactivées (METRICS=0).")
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 @app.get("/models", response_model=List[ModelInfo])
 def get_models():
     return [m for m in MODELS if m.enabled]
 
+@app.get("/cache/stats")
+def get_cache_stats():
+    if RESPONSE_CACHE is None:
+        return {"enabled": False}
+    return {"enabled": True, **RESPONSE_CACHE.stats()}
+
 # -----------------------------------------------------
 # 💬 Endpoint texte simple
 # -----------------------------------------------------
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest):
+    model, messages, compaction, routing = prepare_chat(request)
+    adapter = pick_adapter(model)
+    admission = await admit(request.user_id, model, messages)
+
+    if request.stream:
+        return StreamingResponse(
+            stream_chat_events(adapter, model, messages, compaction, routing=routing, admission=admission),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    result = await call_model(adapter, model, messages, routing, admission)
+    return with_history_usage(result, compaction)
+
+
+def prepare_chat(request: ChatRequest) -> Tuple[str, list, Compaction, Optional[RoutingDecision]]:
+    """Modèle à appeler (choisi par le routeur en mode auto) et historique compacté."""
     model_info = next((m for m in MODELS if m.model == request.model), None)
     if model_info and not model_info.enabled:
         raise HTTPException(status_code=400, detail=f"Le modèle '{model_info.label}' n’est pas encore disponible.")
-    adapter = pick_adapter(request.model)
-    result = adapter.send_chat(request.model, request.messages)
-    return result
+    messages = [m.model_dump() for m in request.messages]
+    model, routing = route_model(request.model, messages)
+    # Historique ramené sous le budget de tokens du modèle
+    messages, compaction = compact_history(model, messages)
+    return model, messages, compaction, routing
+
+
+def with_history_usage(result: dict, compaction: Compaction) -> dict:
+    """Ajoute à `usage` les tokens d'historique économisés par la compaction."""
+    usage = {
+        **(result.get("usage") or {}),
+        "history_tokens_saved": compaction.saved_tokens,
+        "history_messages_dropped": compaction.dropped_messages,
+    }
+    return {**result, "usage": usage}
+
+
+async def stream_chat_events(adapter: BaseAdapter, model: str, messages: list, compaction: Compaction,
+                             on_done: Optional[Callable[[str, dict], None]] = None,
+                             routing: Optional[RoutingDecision] = None,
+                             admission: Optional[Admission] = None):
+    """
+    Relaie le stream de l'adaptateur en Server-Sent Events :
+    `token` à chaque fragment, puis `done` (usage, kWh, CO₂, time-to-first-token).
+    `on_done(texte complet, événement done)` est appelé si le stream aboutit.
+    """
+    started = time.perf_counter()
+    ttft_ms = None
+    parts = []
+    with routing_context(routing):
+        async for event in adapter.astream_chat(model, messages):
+            kind = event.pop("event")
+            if kind == "token":
+                parts.append(event["content"])
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+            if kind == "done":
+                event = with_routing(with_history_usage(event, compaction), routing)
+                event["ttft_ms"] = ttft_ms
+                event["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                observe_latency(model, event, event["duration_ms"])
+                if on_done is not None:
+                    on_done("".join(parts), event)
+            if kind in ("done", "error"):
+                settle(admission, event)
+            yield format_sse(kind, event)
+
+# -----------------------------------------------------
+# 📦 Lots de requêtes (direct ou différé)
+# -----------------------------------------------------
+@app.post("/chat/batch")
+async def chat_batch(request: BatchRequest):
+    """
+    Plusieurs requêtes de chat en un appel :
+    - sync : exécutées en parallèle, au plus `max_concurrency` à la fois, comme /chat ;
+      une erreur n'interrompt pas le lot. Limites de débit : les éléments ne
+      consomment pas la limite de requêtes/s de l'utilisateur (USER_RPS, réservée
+      au trafic interactif) mais comptent dans ses tokens/min (USER_TPM) ; les
+      limites par modèle s'appliquent à chaque élément ;
+    - deferred : soumises à l'API batch du fournisseur (moins chère, résultats sous
+      24 h) ; les résultats s'obtiennent avec GET /chat/batch/{batch_id}.
+    """
+    if not request.requests:
+        raise HTTPException(status_code=400, detail="Le lot ne contient aucune requête.")
+    if len(request.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Au plus {BATCH_MAX_ITEMS} requêtes par lot.")
+    if request.mode == "deferred":
+        return await submit_deferred_batch(request)
+
+    async def run(item: Tuple[int, ChatRequest]) -> dict:
+        index, chat_request = item
+        try:
+            model, messages, compaction, routing = prepare_chat(chat_request)
+            adapter = pick_adapter(model)
+            admission = await admit(request.user_id, model, messages, batch=True)
+            result = with_history_usage(await call_model(adapter, model, messages, routing, admission), compaction)
+            return {"index": index, "model": model, **result}
+        except HTTPException as e:
+            return {
+                "index": index,
+                "model": chat_request.model,
+                "content": f"❌ {e.detail}",
+                "usage": {"input_tokens": 0, "output_tokens": 0},
+                "cost_eur": 0.0,
+                "est_kwh": 0.0,
+                "est_co2e_g": 0.0,
+                "error": {"type": "HTTPException", "status": e.status_code, "retryable": e.status_code == 429},
+            }
+
+    concurrency = min(request.max_concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    batch_id = "batch_" + secrets.token_urlsafe(12)
+    # Chaque requête écrit sa propre trace, marquée par l'identifiant du lot
+    with trace_fields(batch_id=batch_id):
+        results = await run_bounded(list(enumerate(request.requests)), run, concurrency)
+    return {"batch_id": batch_id, "mode": "sync", "status": "completed", "items": len(results),
+            "results": results, "usage": batch_usage(results)}
+
+
+def batch_adapter(model: str) -> BaseAdapter:
+    """Adaptateur brut du fournisseur (sans cache ni bascule), s'il propose l'API batch."""
+    pick_adapter(model)
+    adapter = get_provider_adapter(model.split(":", 1)[0]).inner
+    if not adapter.supports_batch:
+        raise HTTPException(status_code=400, detail=f"Pas de traitement différé pour '{model}'.")
+    return adapter
+
+
+async def submit_deferred_batch(request: BatchRequest) -> dict:
+    items = []
+    for index, chat_request in enumerate(request.requests):
+        model, messages, compaction, routing = prepare_chat(chat_request)
+        batch_adapter(model)
+        items.append(BatchItem(
+            index, model, messages,
+            trace=routing.trace_fields() if routing else {},
+            usage=with_history_usage({}, compaction)["usage"],
+        ))
+    job = BatchJob(request.user_id, items)
+    await job.submit(batch_adapter)
+    BATCH_JOBS.add(job)
+    return job.info()
+
+
+@app.get("/chat/batch/{batch_id}")
+async def get_batch(batch_id: str, user_id: str = "anonymous"):
+    """État d'un lot différé ; les résultats arrivent au fil des jobs terminés."""
+    job = BATCH_JOBS.get(batch_id, user_id)
+    if not job.done:
+        try:
+            await job.refresh(batch_adapter)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"État du lot indisponible : {e}")
+    return job.info()
 
 # -----------------------------------------------------
 # 📤 Endpoint multiple upload (images / PDF)
@@ -115,20 +523,27 @@ def chat(request: ChatRequest):
 async def chat_upload(files: List[UploadFile] = File(...)):
     """
     Upload multiple de fichiers (images, PDF, etc.)
-    Retourne leurs métadonnées (filename, mime, url)
+    Retourne leurs métadonnées (filename, mime, sha256, url)
     """
     uploaded_files = []
 
     for file in files:
         try:
-            dest_path = UPLOAD_DIR / file.filename
-            with open(dest_path, "wb") as f:
-                f.write(await file.read())
+            # Copie par blocs, plafonnée à MAX_UPLOAD_BYTES, nommée par empreinte :
+            # pas de collision entre utilisateurs, workers ou répliques
+            spooled = await UPLOADS.save(file)
 
             uploaded_files.append({
                 "filename": file.filename,
                 "mime": file.content_type,
-                "url": f"/uploads/{file.filename}"
+                "size": spooled.size,
+                "sha256": spooled.sha256,
+                "url": UPLOADS.url(spooled)
+            })
+        except HTTPException as e:
+            uploaded_files.append({
+                "filename": file.filename,
+                "error": e.detail
             })
         except Exception as e:
             uploaded_files.append({
@@ -145,60 +560,249 @@ async def chat_upload(files: List[UploadFile] = File(...)):
 async def chat_with_files(
     model: str = Form(...),
     messages: str = Form(...),
-    files: List[UploadFile] = File(None)
+    files: List[UploadFile] = File(None),
+    documents: str = Form(None),
+    user_id: str = Form("anonymous")
 ):
     """
-    Combine plusieurs fichiers et envoie au modèle IA (Vision / PDF)
+    Combine plusieurs fichiers et envoie au modèle IA (Vision / PDF).
+    `documents` : liste JSON d'identifiants de PDF déjà envoyés (questions de suivi).
     """
     try:
         messages = json.loads(messages)
     except Exception:
         raise HTTPException(status_code=400, detail="Format JSON invalide pour 'messages'.")
+    try:
+        document_ids = json.loads(documents) if documents else []
+    except Exception:
+        document_ids = None
+    if not isinstance(document_ids, list) or not all(isinstance(d, str) for d in document_ids):
+        raise HTTPException(status_code=400, detail="'documents' doit être une liste JSON d'identifiants (chaînes).")
 
+    model, routing = route_model(model, messages, vision=has_images(files))
     adapter = pick_adapter(model)
+    messages, compaction = compact_history(model, messages)
+
+    # Les passages des PDF sont choisis selon la dernière question de l'utilisateur
+    query = next((m["content"] for m in reversed(messages)
+                  if m.get("role") == "user" and isinstance(m.get("content"), str)), "")
+    converted = await process_files(model, files, query, document_ids)
+    messages.extend(message for message, _, _ in converted if message is not None)
+
+    admission = await admit(user_id, model, messages)
+    result = await call_model(adapter, model, messages, routing, admission)
+    return with_file_reports(with_history_usage(result, compaction), converted)
+
+
+def has_images(files: Optional[List[UploadFile]]) -> bool:
+    return any(Path(f.filename or "").suffix.lower() in IMAGE_SUFFIXES for f in files or [])
+
+
+async def process_files(model: str, files: List[UploadFile], query: str, document_ids: List[str]):
+    """
+    Fichiers reçus + PDF déjà indexés → liste de (message, type, rapport),
+    dans l'ordre des fichiers puis des documents.
+    """
+    # Copie par blocs sur disque (plafonnée) : jamais le fichier entier en mémoire
+    spooled_files = []
+    temporary = []
+    try:
+        for file in files or []:
+            if SHARED_DOCUMENTS and Path(file.filename or "").suffix.lower() == ".pdf":
+                # Gardé dans le store partagé (non servi) : un autre worker pourra le ré-indexer
+                spooled_files.append(await DOCUMENTS.save(file))
+            else:
+                temporary.append(await spool_to_temp(file))
+                spooled_files.append(temporary[-1])
 
-    for file in files or []:
-        suffix = Path(file.filename).suffix.lower()
-        temp_path = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        temp_path.write(await file.read())
-        temp_path.close()
-
-        if suffix == ".pdf":
-            try:
-                import fitz  # PyMuPDF
-                doc = fitz.open(temp_path.name)
-                text = "".join([page.get_text() for page in doc])
-                messages.append({
-                    "role": "user",
-                    "content": f"Texte extrait du fichier {file.filename} :\n{text[:6000]}..."
-                })
-                doc.close()
-            except Exception as e:
-                messages.append({
-                    "role": "user",
-                    "content": f"[Erreur PDF: {str(e)}]"
-                })
-
-        elif suffix in [".jpg", ".jpeg", ".png"]:
-            try:
-                img = Image.open(temp_path.name)
-                buf = BytesIO()
-                img.save(buf, format="PNG")
-                image_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": f"Image '{file.filename}' envoyée :"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
-                    ]
-                })
-            except Exception as e:
-                messages.append({
-                    "role": "user",
-                    "content": f"[Erreur image {file.filename} : {str(e)}]"
-                })
-
-        os.remove(temp_path.name)
-
-    result = adapter.send_chat(model, messages)
+        # Budget de tokens du modèle partagé entre les PDF de la requête
+        pdf_count = sum(1 for f in spooled_files if f.suffix == ".pdf") + len(document_ids)
+        doc_budget = budget_for(model) // max(1, pdf_count)
+
+        # Prétraitement CPU dans le pool de processus, fichiers en parallèle
+        converted = await asyncio.gather(*(file_to_message(f, model, query, doc_budget) for f in spooled_files))
+    finally:
+        for spooled in temporary:
+            spooled.remove()
+
+    # PDF déjà indexés : pas de nouvel envoi ni de nouvelle lecture
+    uploaded = {report["id"] for _, kind, report in converted if kind == "document"}
+    for doc_id in document_ids:
+        if doc_id in uploaded:
+            continue
+        try:
+            index = await DOCUMENT_PIPELINE.load(doc_id)
+        except Exception:
+            index = None  # document du store illisible ou trop long : ignoré comme un inconnu
+        if index is not None:
+            chunks = index.select(query, doc_budget)
+            converted.append((document_message(index, chunks), "document", document_report(index, chunks)))
+    return converted
+
+
+def with_file_reports(result: dict, converted: list) -> dict:
+    """Ajoute à la réponse le gain du prétraitement des images et les documents utilisés."""
+    reports = {"image": [], "document": []}
+    for _, kind, report in converted:
+        if report is not None:
+            reports[kind].append(report)
+    images, docs = reports["image"], reports["document"]
+
+    if images:
+        # Gain du prétraitement : octets (vs. fichier d'origine) et tokens estimés
+        result = {**result, "images": {
+            "files": images,
+            "bytes_saved": sum(i["bytes_saved"] for i in images),
+            "tokens_saved_est": sum(i["tokens_saved"] for i in images),
+        }}
+    if docs:
+        result = {**result, "documents": docs}
     return result
+
+
+async def file_to_message(spooled: SpooledUpload, model: str, query: str, doc_budget: int):
+    """
+    Transforme un fichier reçu en message pour le modèle (passages PDF ou image inline).
+    Retourne (message, type, rapport ou None).
+    """
+    suffix = spooled.suffix
+
+    if suffix == ".pdf":
+        try:
+            with FILE_PROCESSING.time(kind="pdf"):
+                index = await DOCUMENT_PIPELINE.index(spooled)
+                chunks = index.select(query, doc_budget)
+            return document_message(index, chunks), "document", document_report(index, chunks)
+        except asyncio.TimeoutError:
+            return {"role": "user", "content": f"[Erreur PDF: délai de traitement dépassé pour {spooled.filename}]"}, None, None
+        except Exception as e:
+            return {"role": "user", "content": f"[Erreur PDF: {str(e)}]"}, None, None
+
+    if suffix in IMAGE_SUFFIXES:
+        try:
+            with FILE_PROCESSING.time(kind="image"):
+                image = await IMAGE_PIPELINE.process(spooled, model)
+            return {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": f"Image '{spooled.filename}' envoyée :"},
+                    {"type": "image_url", "image_url": {"url": image.data_url, "detail": image.detail}}
+                ]
+            }, "image", {"filename": spooled.filename, **image.report()}
+        except asyncio.TimeoutError:
+            return {"role": "user", "content": f"[Erreur image {spooled.filename} : délai de traitement dépassé]"}, None, None
+        except Exception as e:
+            return {"role": "user", "content": f"[Erreur image {spooled.filename} : {str(e)}]"}, None, None
+
+    return None, None, None
+
+
+# -----------------------------------------------------
+# 🗂️ Conversations côté serveur (le client n'envoie que le nouveau message)
+# -----------------------------------------------------
+@app.post("/sessions", response_model=SessionInfo)
+def create_session(request: SessionCreate):
+    session = SESSIONS.create(
+        request.user_id,
+        model=request.model,
+        messages=[m.model_dump() for m in request.messages],
+    )
+    return session.info()
+
+
+@app.get("/sessions/{session_id}", response_model=SessionInfo)
+def get_session(session_id: str, user_id: str = "anonymous"):
+    return SESSIONS.get(session_id, user_id).info()
+
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str, user_id: str = "anonymous"):
+    SESSIONS.delete(session_id, user_id)
+    return {"deleted": session_id}
+
+
+@app.post("/sessions/{session_id}/chat")
+async def session_chat(session_id: str, turn: SessionTurn):
+    """Nouveau message dans une conversation : historique et PDF indexés sont côté serveur."""
+    session = SESSIONS.get(session_id, turn.user_id)
+    return await run_session_turn(session, turn.model, turn.content, [], turn.stream)
+
+
+@app.post("/sessions/{session_id}/files")
+async def session_chat_with_files(
+    session_id: str,
+    content: str = Form(""),
+    user_id: str = Form("anonymous"),
+    model: str = Form(None),
+    files: List[UploadFile] = File(None)
+):
+    """Comme /sessions/{id}/chat, avec des fichiers : images gardées dans l'historique, PDF indexés."""
+    session = SESSIONS.get(session_id, user_id)
+    return await run_session_turn(session, model, content, files or [], stream=False)
+
+
+async def run_session_turn(session: Session, model: Optional[str], content: str,
+                           files: List[UploadFile], stream: bool):
+    requested = model or session.model
+    if not requested:
+        raise HTTPException(status_code=400, detail="Aucun modèle indiqué pour cette conversation.")
+    session.model = requested
+    # En mode auto, le modèle est choisi à chaque tour
+    model, routing = route_model(
+        requested, session.messages + [{"role": "user", "content": content}], vision=has_images(files)
+    )
+    adapter = pick_adapter(model)
+    # Estimation avant traitement des pièces jointes, corrigée avec l'usage réel
+    admission = await admit(session.user_id, model, compact_history(
+        model, session.messages + [{"role": "user", "content": content}])[0])
+
+    if stream:
+        return StreamingResponse(
+            stream_session_turn(session, adapter, model, content, routing, admission),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    async with session.lock:
+        messages, new_messages, converted, compaction = await prepare_session_turn(session, model, content, files)
+        result = with_history_usage(await call_model(adapter, model, messages, routing, admission), compaction)
+        session.record_turn(new_messages, result)
+    return {**with_file_reports(result, converted), "session_id": session.session_id}
+
+
+async def prepare_session_turn(session: Session, model: str, content: str, files: List[UploadFile]):
+    """
+    Messages à envoyer pour ce tour : historique compacté + nouveau message +
+    pièces jointes. Les images traitées entrent dans l'historique ; les passages
+    PDF sont choisis à chaque tour selon la question.
+    """
+    user_message = {"role": "user", "content": content} if content else None
+    messages, compaction = compact_history(model, session.messages + ([user_message] if user_message else []))
+
+    query = content or next((m["content"] for m in reversed(session.messages)
+                             if m.get("role") == "user" and isinstance(m.get("content"), str)), "")
+    converted = await process_files(model, files, query, session.documents)
+
+    new_messages = [user_message] if user_message else []
+    for message, kind, _ in converted:
+        if message is not None:
+            messages.append(message)
+            if kind != "document":
+                new_messages.append(message)
+    # PDF nouveaux ou encore en cache : proposés aux tours suivants
+    session.documents = [report["id"] for _, kind, report in converted if kind == "document"]
+    return messages, new_messages, converted, compaction
+
+
+async def stream_session_turn(session: Session, adapter: BaseAdapter, model: str, content: str,
+                              routing: Optional[RoutingDecision], admission: Optional[Admission]):
+    async with session.lock:
+        messages, new_messages, converted, compaction = await prepare_session_turn(session, model, content, [])
+        def on_done(text: str, done: dict):
+            session.record_turn(new_messages, {**done, "content": text})
+
+        async for chunk in stream_chat_events(adapter, model, messages, compaction, on_done, routing, admission):
+            yield chunk
+
+
+REPORT.since_import("import")
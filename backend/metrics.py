@@ -0,0 +1,262 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+# Métriques activées (format texte Prometheus sur /metrics)
+METRICS = os.getenv("METRICS", "1") != "0"
+
+# Bornes des histogrammes de durée (s) : de la milliseconde aux appels LLM les plus longs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Métrique avec étiquettes ; une série par combinaison de valeurs d'étiquettes."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} : étiquettes attendues {self.labelnames}, reçues {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], str, float]]:
+        """(suffixe, valeurs d'étiquettes, étiquette supplémentaire, valeur)."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("_total", key, "", value) for key, value in sorted(self._series.items())]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function  # valeurs lues au moment de l'export (ex. taille d'une file)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        if self.function is not None:
+            return [("", key, "", value) for key, value in sorted(self.function().items())]
+        with self._lock:
+            return [("", key, "", value) for key, value in sorted(self._series.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Comptes par tranche (non cumulés), total, nombre
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe la durée du bloc (s), même s'il lève une exception."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), counts):
+                cumulative += n
+                out.append(("_bucket", key, f'le="{_format_value(bound)}"', cumulative))
+            out.append(("_sum", key, "", total))
+            out.append(("_count", key, "", count))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrique déjà déclarée : {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def provider_of(model: str) -> str:
+    return model.split(":", 1)[0] if ":" in model else "unknown"
+
+
+# -----------------------------------------------------
+# Métriques du service
+# -----------------------------------------------------
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds",
+    "Durée de bout en bout des requêtes HTTP (jusqu'au dernier octet, streams compris).",
+    ("method", "route", "status"),
+))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Requêtes HTTP en cours de traitement.",
+))
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    "upstream_request_duration_seconds",
+    "Durée d'un appel au fournisseur (par tentative ; pour un stream, jusqu'au dernier token).",
+    ("provider", "model", "outcome"),
+))
+UPSTREAM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "upstream_requests_in_flight", "Appels en cours vers chaque fournisseur.", ("provider",),
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "upstream_errors", "Appels au fournisseur en échec, par type d'erreur.", ("provider", "model", "type"),
+))
+TTFT = REGISTRY.register(Histogram(
+    "time_to_first_token_seconds", "Délai avant le premier token d'un stream.", ("provider", "model"),
+))
+FILE_PROCESSING = REGISTRY.register(Histogram(
+    "file_processing_duration_seconds",
+    "Prétraitement d'une pièce jointe (pool de processus compris).",
+    ("kind",),
+))
+TRACE_WRITE = REGISTRY.register(Histogram(
+    "trace_write_duration_seconds", "Écriture d'un lot de traces (write + fsync).", (),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+))
+TRACE_RECORDS = REGISTRY.register(Counter(
+    "trace_records_written", "Traces carbone écrites sur disque.", (),
+))
+TOKENS = REGISTRY.register(Counter(
+    "llm_tokens", "Tokens consommés (hors réponses servies par le cache).", ("provider", "model", "direction"),
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "response_cache_requests", "Consultations du cache de réponses.", ("model", "result"),
+))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "rate_limit_rejections", "Requêtes refusées par le limiteur de débit (429).", ("scope",),
+))
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI : durée de chaque requête HTTP jusqu'au dernier octet
+    envoyé (streams SSE compris), par route (le gabarit, pas le chemin brut).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with HTTP_IN_FLIGHT.track_inprogress():
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Le routeur FastAPI ajoute la route au scope une fois la requête aiguillée
+                route = getattr(scope.get("route"), "path", "other")
+                HTTP_DURATION.observe(time.perf_counter() - started,
+                                      method=scope["method"], route=route, status=str(status))
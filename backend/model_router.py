@@ -0,0 +1,249 @@
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Iterable
+
+from adapters.base import approx_tokens
+from adapters.carbon_adapter import carbon_per_1k
+from history_compaction import count_tokens
+
+# Politique par défaut (preset ou poids "carbon=0.5,latency=0.3,cost=0.2"),
+# modèle de référence pour mesurer le gain, lissage des latences observées
+ROUTER_POLICY = os.getenv("ROUTER_POLICY", "balanced")
+ROUTER_BASELINE = os.getenv("ROUTER_BASELINE", "openai:gpt-4o")
+ROUTER_LATENCY_ALPHA = float(os.getenv("ROUTER_LATENCY_ALPHA", 0.2))
+
+AUTO_MODEL = "auto"
+
+POLICIES: Dict[str, Dict[str, float]] = {
+    "balanced": {"carbon": 0.4, "latency": 0.3, "cost": 0.3},
+    "carbon": {"carbon": 0.7, "latency": 0.15, "cost": 0.15},
+    "latency": {"carbon": 0.15, "latency": 0.7, "cost": 0.15},
+    "cost": {"carbon": 0.15, "latency": 0.15, "cost": 0.7},
+}
+
+
+# -----------------------------------------------------
+# Profils des modèles
+# -----------------------------------------------------
+@dataclass
+class ModelProfile:
+    """
+    Ce que le routeur sait d'un modèle :
+    - tier       : niveau de complexité traité (1 simple, 2 standard, 3 complexe)
+    - vision     : accepte des images
+    - context    : fenêtre de contexte (tokens)
+    - cost_per_1k: prix indicatif en € / 1000 tokens (entrée et sortie confondues)
+    - latency_ms : latence a priori, remplacée au fil de l'eau par la latence observée
+    - carbon_hint: gCO2eq / 1000 tokens pour le classement du routeur seulement ;
+                   à défaut, le coefficient de l'estimateur (MODEL_COEFFICIENTS).
+                   Les traces, elles, restent calculées par l'estimateur.
+    """
+
+    model: str
+    tier: int
+    vision: bool = False
+    context: int = 16_000
+    cost_per_1k: float = 0.001
+    latency_ms: float = 800.0
+    carbon_hint: Optional[float] = None
+
+    @property
+    def carbon_per_1k(self) -> float:
+        return self.carbon_hint if self.carbon_hint is not None else carbon_per_1k(self.model)
+
+
+MODEL_PROFILES: Dict[str, ModelProfile] = {p.model: p for p in [
+    ModelProfile("openai:gpt-3.5-turbo", tier=1, context=16_000, cost_per_1k=0.0009, latency_ms=500,
+                 carbon_hint=0.5),
+    ModelProfile("openai:gpt-4o-mini", tier=2, vision=True, context=128_000, cost_per_1k=0.0004, latency_ms=600),
+    ModelProfile("openai:gpt-4o", tier=3, vision=True, context=128_000, cost_per_1k=0.006, latency_ms=900,
+                 carbon_hint=1.0),
+    ModelProfile("openai:gpt-4-turbo", tier=3, vision=True, context=128_000, cost_per_1k=0.018, latency_ms=1500),
+    ModelProfile("mistral:open-mistral-7b", tier=1, context=32_000, cost_per_1k=0.00025, latency_ms=500,
+                 carbon_hint=0.3),
+    ModelProfile("mistral:open-mixtral-8x7b", tier=2, context=32_000, cost_per_1k=0.0007, latency_ms=800,
+                 carbon_hint=0.6),
+]}
+
+
+def is_auto(model: Optional[str]) -> bool:
+    return bool(model) and (model == AUTO_MODEL or model.startswith(AUTO_MODEL + ":"))
+
+
+def parse_policy(spec: str) -> Dict[str, float]:
+    """Preset ("carbon") ou poids explicites ("carbon=0.5,latency=0.3,cost=0.2")."""
+    if spec in POLICIES:
+        return POLICIES[spec]
+    weights = {"carbon": 0.0, "latency": 0.0, "cost": 0.0}
+    for item in filter(None, spec.split(",")):
+        key, _, value = item.partition("=")
+        if key.strip() not in weights:
+            raise ValueError(f"Critère de routage inconnu : {key!r}")
+        weights[key.strip()] = float(value)
+    total = sum(weights.values()) or 1.0
+    return {k: v / total for k, v in weights.items()}
+
+
+# -----------------------------------------------------
+# Complexité du prompt (heuristiques, sans appel au modèle)
+# -----------------------------------------------------
+_CODE = re.compile(r"```|\bdef |\bclass |\bfunction\b|\bSELECT\b|\bimport |=>|\{\s*\n|;\s*$", re.M)
+_REASONING = re.compile(
+    r"\b(pourquoi|explique|démontre|prouve|analyse|compare|évalue|optimise|raisonne|étape par étape|"
+    r"architecture|stratégie|why|explain|prove|analy[sz]e|compare|evaluate|optimi[sz]e|step by step|design)\b",
+    re.I,
+)
+_MATH = re.compile(r"[∑∫√≤≥≠]|\d+\s*[\^*/]\s*\d+|\b(équation|intégrale|dérivée|théorème|equation|integral|theorem)\b", re.I)
+
+
+@dataclass
+class Complexity:
+    tier: int
+    vision: bool
+    prompt_tokens: int
+    context_tokens: int
+    reasons: List[str] = field(default_factory=list)
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content or "")
+
+
+def classify(messages: List[Dict[str, Any]], vision: bool = False) -> Complexity:
+    """Niveau de complexité de la dernière demande (longueur, code, raisonnement, maths, images)."""
+    last = next((m for m in reversed(messages) if m.get("role") == "user"), {})
+    prompt = _text(last.get("content"))
+    prompt_tokens = approx_tokens(prompt)
+    vision = vision or any(
+        isinstance(m.get("content"), list)
+        and any(isinstance(p, dict) and p.get("type") == "image_url" for p in m["content"])
+        for m in messages
+    )
+
+    reasons = []
+    if prompt_tokens > 400:
+        reasons.append("prompt long")
+    if prompt_tokens > 1500:
+        reasons.append("prompt très long")
+    if _CODE.search(prompt):
+        reasons.append("code")
+    if _REASONING.search(prompt):
+        reasons.append("raisonnement")
+    if _MATH.search(prompt):
+        reasons.append("mathématiques")
+    if prompt.count("?") >= 3:
+        reasons.append("questions multiples")
+
+    tier = 1 if not reasons else 2 if len(reasons) <= 2 else 3
+    return Complexity(tier, vision, prompt_tokens, count_tokens(messages), reasons)
+
+
+# -----------------------------------------------------
+# Routeur
+# -----------------------------------------------------
+@dataclass
+class RoutingDecision:
+    model: str
+    policy: str
+    complexity: Complexity
+    scores: Dict[str, float]
+    baseline: str = ROUTER_BASELINE
+
+    def trace_fields(self) -> Dict[str, Any]:
+        """Champs ajoutés aux traces carbone des requêtes routées."""
+        return {
+            "routed": True,
+            "router_policy": self.policy,
+            "router_tier": self.complexity.tier,
+            "baseline_model": self.baseline,
+        }
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "policy": self.policy,
+            "tier": self.complexity.tier,
+            "vision": self.complexity.vision,
+            "reasons": self.complexity.reasons,
+            "scores": {m: round(s, 3) for m, s in self.scores.items()},
+            "baseline": self.baseline,
+        }
+
+
+class ModelRouter:
+    """
+    Mode `model: "auto"` : choisit, parmi les modèles disponibles capables de
+    traiter la demande, celui qui minimise un score pondéré carbone / latence /
+    coût. `auto:<politique>` choisit la pondération pour une requête.
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, ModelProfile]] = None, policy: str = ROUTER_POLICY,
+                 baseline: str = ROUTER_BASELINE, latency_alpha: float = ROUTER_LATENCY_ALPHA):
+        self.profiles = profiles if profiles is not None else MODEL_PROFILES
+        self.policy = policy
+        self.baseline = baseline
+        self.latency_alpha = latency_alpha
+        self.decisions: Dict[str, int] = {}
+        self._latency: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def latency_ms(self, model: str) -> float:
+        return self._latency.get(model, self.profiles[model].latency_ms)
+
+    def observe(self, model: str, duration_ms: float):
+        """Latence mesurée d'un appel (moyenne mobile exponentielle)."""
+        if model not in self.profiles or duration_ms is None:
+            return
+        with self._lock:
+            previous = self._latency.get(model, self.profiles[model].latency_ms)
+            self._latency[model] = previous + self.latency_alpha * (duration_ms - previous)
+
+    def route(self, requested: str, messages: List[Dict[str, Any]], available: Iterable[str],
+              vision: bool = False) -> RoutingDecision:
+        _, _, policy = requested.partition(":")
+        policy = policy or self.policy
+        try:
+            weights = parse_policy(policy)
+        except ValueError as e:
+            raise ValueError(f"Politique de routage invalide : {e}")
+
+        complexity = classify(messages, vision)
+        profiles = [self.profiles[m] for m in available if m in self.profiles]
+        fits = [
+            p for p in profiles
+            if (p.vision or not complexity.vision) and p.context > complexity.context_tokens * 1.2
+        ]
+        if not fits:
+            raise LookupError("Aucun modèle disponible ne peut traiter cette demande.")
+        # Le moins capable des modèles suffisants ; à défaut, les plus capables disponibles
+        capable = [p for p in fits if p.tier >= complexity.tier]
+        if not capable:
+            top = max(p.tier for p in fits)
+            capable = [p for p in fits if p.tier == top]
+
+        metrics = {
+            p.model: {"carbon": p.carbon_per_1k, "latency": self.latency_ms(p.model), "cost": p.cost_per_1k}
+            for p in capable
+        }
+        peaks = {k: max(m[k] for m in metrics.values()) or 1.0 for k in weights}
+        scores = {
+            model: sum(weights[k] * m[k] / peaks[k] for k in weights)
+            for model, m in metrics.items()
+        }
+        chosen = min(capable, key=lambda p: (scores[p.model], p.tier)).model
+
+        with self._lock:
+            self.decisions[chosen] = self.decisions.get(chosen, 0) + 1
+        return RoutingDecision(chosen, policy, complexity, scores, self.baseline)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "baseline": self.baseline,
+            "decisions": dict(self.decisions),
+            "latency_ms": {m: round(self.latency_ms(m), 1) for m in self.profiles},
+        }
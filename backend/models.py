@@ -1,4 +1,4 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 from pydantic import BaseModel
 
 # ───────────────────────────────────────────────
@@ -21,6 +21,37 @@ class ChatResponse(BaseModel):
     cost_eur: float
     est_kwh: float
     est_co2e_g: float
+    cached: bool = False
+    model: Optional[str] = None  # modèle effectivement utilisé (mode auto)
+    routing: Optional[Dict[str, Any]] = None
+    failover_from: Optional[str] = None  # modèle demandé, si l'équivalent a répondu à sa place
+    hedged_from: Optional[str] = None
+    error: Optional[Dict[str, Any]] = None  # type, statut, retryable (réponse en échec)
+
+class BatchRequest(BaseModel):
+    user_id: Optional[str] = "anonymous"
+    requests: List[ChatRequest]
+    mode: Literal["sync", "deferred"] = "sync"  # deferred : API batch du fournisseur (résultats à interroger)
+    max_concurrency: Optional[int] = None
+
+class SessionCreate(BaseModel):
+    user_id: Optional[str] = "anonymous"
+    model: Optional[str] = None
+    messages: List[Message] = []  # historique initial (reprise d'une conversation)
+
+class SessionTurn(BaseModel):
+    user_id: Optional[str] = "anonymous"
+    content: str
+    model: Optional[str] = None
+    stream: Optional[bool] = False
+
+class SessionInfo(BaseModel):
+    session_id: str
+    user_id: str
+    model: Optional[str]
+    messages: int
+    documents: List[str]
+    idle_seconds: float
 
 class ModelInfo(BaseModel):
     provider: str
@@ -0,0 +1,355 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+
+from fastapi import HTTPException
+
+from metrics import RATE_LIMITED
+
+logger = logging.getLogger("rate-limits")
+
+# Limites par utilisateur et par modèle : requêtes/s (+ rafale) et tokens/min (0 = pas de limite).
+# Par utilisateur : désactivées par défaut, user_id étant fourni par le client sans
+# authentification ; à n'activer que derrière une identité fiable (proxy, SSO).
+USER_RPS = float(os.getenv("USER_RPS", 0))
+USER_BURST = float(os.getenv("USER_BURST", 10))
+USER_TPM = float(os.getenv("USER_TPM", 0))
+MODEL_RPS = float(os.getenv("MODEL_RPS", 20))
+MODEL_BURST = float(os.getenv("MODEL_BURST", 40))
+MODEL_TPM = float(os.getenv("MODEL_TPM", 400_000))
+
+# Appels en vol max par fournisseur (par processus), attente max en file (s),
+# tokens de sortie comptés d'avance (corrigés avec l'usage réel)
+PROVIDER_MAX_INFLIGHT = int(os.getenv("PROVIDER_MAX_INFLIGHT", 32))
+RATE_LIMIT_WAIT = float(os.getenv("RATE_LIMIT_WAIT", 10))
+RATE_LIMIT_OUTPUT_TOKENS = int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", 500))
+
+# ex. MODEL_RATE_LIMITS="openai:gpt-4o=5/90000,mistral:open-mistral-7b=10/200000" (req/s / tokens/min)
+MODEL_RATE_LIMITS: Dict[str, Tuple[float, float]] = {}
+for _item in filter(None, os.getenv("MODEL_RATE_LIMITS", "").split(",")):
+    _model, _, _limits = _item.rpartition("=")
+    _rps, _, _tpm = _limits.partition("/")
+    MODEL_RATE_LIMITS[_model.strip()] = (float(_rps), float(_tpm or MODEL_TPM))
+
+# ex. PROVIDER_INFLIGHT="openai=64,mistral=16"
+PROVIDER_INFLIGHT: Dict[str, int] = {}
+for _item in filter(None, os.getenv("PROVIDER_INFLIGHT", "").split(",")):
+    _provider, _, _limit = _item.rpartition("=")
+    PROVIDER_INFLIGHT[_provider.strip()] = int(_limit)
+
+
+@dataclass(frozen=True)
+class Limit:
+    """Seau à jetons : `rate` jetons/s, au plus `capacity` jetons (la rafale permise)."""
+
+    rate: float
+    capacity: float
+
+    @classmethod
+    def per_second(cls, rps: float, burst: float) -> Optional["Limit"]:
+        return cls(rps, max(1.0, burst, rps)) if rps > 0 else None
+
+    @classmethod
+    def per_minute(cls, per_minute: float) -> Optional["Limit"]:
+        return cls(per_minute / 60, per_minute) if per_minute > 0 else None
+
+
+# -----------------------------------------------------
+# Backends
+# -----------------------------------------------------
+class BucketBackend(ABC):
+    """
+    Stockage des seaux à jetons, partagé ou non entre workers.
+    `blocking` : take() fait un aller-retour réseau, exécuté hors de la boucle asyncio.
+    """
+
+    blocking = False
+
+    @abstractmethod
+    def take(self, key: str, limit: Limit, cost: float, force: bool = False) -> float:
+        """
+        Prélève `cost` jetons. Renvoie 0 s'ils sont accordés, sinon l'attente (s)
+        avant qu'ils soient disponibles. `force` prélève quoi qu'il arrive (le
+        solde peut devenir négatif) ; un coût négatif rend des jetons.
+        """
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class InMemoryBucketBackend(BucketBackend):
+    """Seaux propres au processus ; les seaux pleins et inactifs sont oubliés."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, cost: float, force: bool = False) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + (now - last) * limit.rate)
+            if force or tokens >= cost:
+                self._buckets[key] = (min(limit.capacity, tokens - cost), now)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / limit.rate
+
+    def _prune(self, now: float):
+        # Sans la limite de chaque seau, on garde ceux utilisés dans la dernière minute
+        stale = [k for k, (_, last) in self._buckets.items() if now - last > 60]
+        for k in stale:
+            del self._buckets[k]
+
+    def size(self) -> Optional[int]:
+        return len(self._buckets)
+
+
+_REDIS_TAKE = """
+local rate, capacity, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = redis.call("TIME")
+local now = tonumber(t[1]) + tonumber(t[2]) / 1e6
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if ARGV[4] == "1" or tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+else
+    wait = (cost - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class RedisBucketBackend(BucketBackend):
+    """
+    Seaux partagés entre workers / instances (nécessite `redis`). Le prélèvement
+    est atomique (script Lua) et utilise l'horloge du serveur Redis.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str, prefix: str = "middleware-ia:ratelimit:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Le backend de limites Redis nécessite le paquet `redis` (pip install redis)")
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._take = self.client.register_script(_REDIS_TAKE)
+
+    def take(self, key: str, limit: Limit, cost: float, force: bool = False) -> float:
+        wait = self._take(keys=[self.prefix + key],
+                          args=[limit.rate, limit.capacity, cost, "1" if force else "0"])
+        return float(wait)
+
+
+# -----------------------------------------------------
+# Appels en vol par fournisseur
+# -----------------------------------------------------
+class ConcurrencyGate:
+    """Nombre max d'appels en vol vers un fournisseur (par processus), file d'attente bornée."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+
+    async def acquire(self, timeout: float) -> bool:
+        """Attend une place au plus `timeout` secondes ; False si la file n'a pas avancé à temps."""
+        if self._semaphore is None:
+            return True
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        if self._semaphore is not None:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting, "rejected": self.rejected}
+
+
+# -----------------------------------------------------
+# Limiteur
+# -----------------------------------------------------
+@dataclass
+class Admission:
+    """Requête admise : les tokens comptés d'avance, corrigés une fois l'usage connu."""
+
+    user_id: str
+    model: str
+    tokens: int
+
+
+class RateLimiter:
+    """
+    Admission des requêtes avant l'appel au fournisseur : seaux à jetons par
+    utilisateur et par modèle (requêtes et tokens). Une requête hors limite
+    attend son tour si l'attente tient dans `max_wait` secondes, sinon elle est
+    refusée tout de suite (429 + Retry-After).
+    """
+
+    def __init__(self, backend: BucketBackend, max_wait: float = RATE_LIMIT_WAIT,
+                 output_tokens: int = RATE_LIMIT_OUTPUT_TOKENS,
+                 model_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 provider_inflight: Optional[Dict[str, int]] = None):
+        self.backend = backend
+        self.max_wait = max_wait
+        self.output_tokens = output_tokens
+        self.model_limits = model_limits if model_limits is not None else MODEL_RATE_LIMITS
+        self.provider_inflight = provider_inflight if provider_inflight is not None else PROVIDER_INFLIGHT
+        self.user_requests = Limit.per_second(USER_RPS, USER_BURST)
+        self.user_tokens = Limit.per_minute(USER_TPM)
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self._gates: Dict[str, ConcurrencyGate] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["RateLimiter"]:
+        """
+        Variables d'environnement :
+        - RATE_LIMITS            : 0 pour désactiver (activé par défaut)
+        - RATE_LIMIT_BACKEND     : memory (défaut) | redis
+        - RATE_LIMIT_REDIS_URL   : URL Redis pour le backend partagé
+        - USER_RPS / USER_BURST / USER_TPM, MODEL_RPS / MODEL_BURST / MODEL_TPM, MODEL_RATE_LIMITS
+        - PROVIDER_MAX_INFLIGHT, PROVIDER_INFLIGHT, RATE_LIMIT_WAIT
+        """
+        if os.getenv("RATE_LIMITS", "1") == "0":
+            return None
+        if os.getenv("RATE_LIMIT_BACKEND", "memory") == "redis":
+            backend = RedisBucketBackend(os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0"))
+        else:
+            backend = InMemoryBucketBackend()
+        return cls(backend)
+
+    def _model_limits(self, model: str) -> Tuple[Optional[Limit], Optional[Limit]]:
+        rps, tpm = self.model_limits.get(model, (MODEL_RPS, MODEL_TPM))
+        return Limit.per_second(rps, MODEL_BURST), Limit.per_minute(tpm)
+
+    def _buckets(self, user_id: str, model: str, tokens: int,
+                 count_request: bool = True) -> List[Tuple[str, Limit, float]]:
+        model_requests, model_tokens = self._model_limits(model)
+        buckets = [
+            (f"user:{user_id}:req", self.user_requests if count_request else None, 1),
+            (f"user:{user_id}:tok", self.user_tokens, tokens),
+            (f"model:{model}:req", model_requests, 1),
+            (f"model:{model}:tok", model_tokens, tokens),
+        ]
+        # Une requête plus grosse que le seau entier passe quand il est plein
+        return [(key, limit, min(cost, limit.capacity)) for key, limit, cost in buckets if limit is not None]
+
+    def _take(self, key: str, limit: Limit, cost: float, force: bool = False) -> float:
+        try:
+            return self.backend.take(key, limit, cost, force)
+        except Exception as e:
+            # Backend indisponible : on laisse passer plutôt que de bloquer le service
+            logger.warning(f"Limiteur indisponible : {e}")
+            return 0.0
+
+    async def _atake(self, key: str, limit: Limit, cost: float, force: bool = False) -> float:
+        if self.backend.blocking:
+            return await asyncio.to_thread(self._take, key, limit, cost, force)
+        return self._take(key, limit, cost, force)
+
+    async def admit(self, user_id: str, model: str, tokens: int, count_request: bool = True) -> Admission:
+        """
+        Attend que toutes les limites de la requête l'autorisent, ou lève 429.
+        `count_request=False` (éléments d'un lot) : seuls les tokens sont comptés
+        pour l'utilisateur, pas la requête ; les limites du modèle s'appliquent.
+        """
+        deadline = time.monotonic() + self.max_wait
+        taken: List[Tuple[str, Limit, float]] = []
+        queued = False
+        for key, limit, cost in self._buckets(user_id, model, tokens, count_request):
+            while True:
+                wait = await self._atake(key, limit, cost)
+                if wait <= 0:
+                    taken.append((key, limit, cost))
+                    break
+                if time.monotonic() + wait > deadline:
+                    # Rien ne sera consommé : les jetons déjà pris sont rendus
+                    for k, l, c in taken:
+                        await self._atake(k, l, -c, force=True)
+                    self.rejected += 1
+                    RATE_LIMITED.inc(scope=key.split(":", 1)[0])
+                    scope = "utilisateur" if key.startswith("user:") else "modèle"
+                    raise HTTPException(
+                        status_code=429,
+                        detail=f"Limite de débit atteinte ({scope}), réessayez dans {math.ceil(wait)} s.",
+                        headers={"Retry-After": str(math.ceil(wait))},
+                    )
+                if not queued:
+                    queued = True
+                    self.queued += 1
+                await asyncio.sleep(wait)
+        self.admitted += 1
+        return Admission(user_id, model, tokens)
+
+    def settle(self, admission: Optional[Admission], usage: Optional[Dict[str, Any]]):
+        """Remplace l'estimation par l'usage réel (0 pour une réponse en cache ou en échec)."""
+        if admission is None:
+            return
+        usage = usage or {}
+        actual = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+        delta = actual - admission.tokens
+        if delta == 0:
+            return
+        model_tokens = self._model_limits(admission.model)[1]
+        corrections = [(key, limit, delta) for key, limit in ((f"user:{admission.user_id}:tok", self.user_tokens),
+                                                              (f"model:{admission.model}:tok", model_tokens))
+                       if limit is not None]
+        if self.backend.blocking:
+            # Correction sans attente : envoyée depuis un thread, la réponse part tout de suite
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self._correct, corrections)
+                return
+            except RuntimeError:
+                pass  # hors de la boucle (appel synchrone)
+        self._correct(corrections)
+
+    def _correct(self, corrections: List[Tuple[str, Limit, float]]):
+        for key, limit, delta in corrections:
+            self._take(key, limit, delta, force=True)
+
+    def gate(self, provider: str) -> ConcurrencyGate:
+        gate = self._gates.get(provider)
+        if gate is None:
+            gate = self._gates[provider] = ConcurrencyGate(self.provider_inflight.get(provider, PROVIDER_MAX_INFLIGHT))
+        return gate
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "buckets": self.backend.size(),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "user_limits": self.user_requests is not None or self.user_tokens is not None,
+        }
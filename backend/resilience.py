@@ -0,0 +1,446 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator
+
+from adapters.base import BaseAdapter
+from rate_limits import ConcurrencyGate, RATE_LIMIT_WAIT
+from metrics import UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_IN_FLIGHT, TTFT
+
+logger = logging.getLogger("resilience")
+
+# Délai max d'un appel (s, surchargeable par fournisseur : OPENAI_TIMEOUT, MISTRAL_TIMEOUT),
+# nombre de nouvelles tentatives et backoff exponentiel avec jitter
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", 30))
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", 2))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", 0.25))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", 4.0))
+
+# Disjoncteur : fenêtre glissante (s), appels min. pour juger, taux d'erreur ou p95 (ms)
+# au-delà desquels il s'ouvre, durée d'ouverture avant un appel d'essai (s)
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", 60))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 10))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+BREAKER_SLOW_MS = float(os.getenv("BREAKER_SLOW_MS", 15_000))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 30))
+
+# Bascule vers le modèle équivalent de l'autre fournisseur, et requêtes « hedgées »
+FAILOVER = os.getenv("FAILOVER", "1") != "0"
+HEDGING = os.getenv("HEDGING", "0") == "1"
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", 2000))  # tant que le p95 n'est pas mesuré
+
+EQUIVALENT_MODELS: Dict[str, str] = {
+    "openai:gpt-3.5-turbo": "mistral:open-mistral-7b",
+    "mistral:open-mistral-7b": "openai:gpt-3.5-turbo",
+    "openai:gpt-4o-mini": "mistral:open-mixtral-8x7b",
+    "mistral:open-mixtral-8x7b": "openai:gpt-4o-mini",
+}
+# ex. EQUIVALENT_MODELS="openai:gpt-4o=mistral:open-mixtral-8x7b"
+for _item in filter(None, os.getenv("EQUIVALENT_MODELS", "").split(",")):
+    _model, _, _equivalent = _item.partition("=")
+    EQUIVALENT_MODELS[_model.strip()] = _equivalent.strip()
+
+
+def provider_error(provider: str, content: str, kind: str, status: Optional[int] = None) -> Dict[str, Any]:
+    """Réponse d'échec au format des adaptateurs (toujours réessayable ailleurs)."""
+    return {
+        "content": f"❌ {provider} : {content}",
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+        "cost_eur": 0.0,
+        "est_kwh": 0.0,
+        "est_co2e_g": 0.0,
+        "error": {"type": kind, "status": status, "retryable": True},
+    }
+
+
+def is_retryable(result: Dict[str, Any]) -> bool:
+    error = result.get("error")
+    return bool(error and error.get("retryable"))
+
+
+# -----------------------------------------------------
+# Retries et disjoncteur
+# -----------------------------------------------------
+@dataclass
+class RetryPolicy:
+    timeout: float = PROVIDER_TIMEOUT
+    attempts: int = RETRY_ATTEMPTS
+    backoff_base: float = RETRY_BACKOFF_BASE
+    backoff_max: float = RETRY_BACKOFF_MAX
+
+    @classmethod
+    def from_env(cls, provider: str) -> "RetryPolicy":
+        return cls(timeout=float(os.getenv(f"{provider.upper()}_TIMEOUT", PROVIDER_TIMEOUT)))
+
+    def backoff(self, retry: int) -> float:
+        """Backoff exponentiel « full jitter » : évite que les clients réessaient en rafale."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur sur fenêtre glissante :
+    - closed    : les appels passent ; s'ouvre si le taux d'erreur ou le p95 dépasse le seuil
+    - open      : les appels sont refusés pendant `cooldown` secondes
+    - half_open : un seul appel d'essai ; succès → closed, échec → open
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str = "", window: float = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE, slow_ms: float = BREAKER_SLOW_MS,
+                 cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_ms = slow_ms
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self._calls: deque = deque()  # (instant, succès, latence ms)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state, self._probe = self.HALF_OPEN, False
+            if self.state == self.HALF_OPEN:
+                if self._probe:
+                    return False
+                self._probe = True
+            return True
+
+    def record(self, ok: Optional[bool], latency_ms: float):
+        """Résultat d'un appel autorisé ; ok=None : appel annulé (ni succès ni échec)."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe = False
+                if ok is None:
+                    return
+                if ok and latency_ms < self.slow_ms:
+                    self.state = self.CLOSED
+                    self._calls.clear()
+                else:
+                    self._trip()
+                return
+            if ok is None:
+                return
+
+            now = time.monotonic()
+            self._calls.append((now, ok, latency_ms))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            if self.state == self.CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, success, _ in self._calls if not success)
+                p95 = self._p95()
+                if failures / len(self._calls) >= self.error_rate or (p95 is not None and p95 > self.slow_ms):
+                    self._trip()
+
+    def _trip(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.trips += 1
+        logger.warning(f"Disjoncteur ouvert : {self.name} ({self.cooldown:g} s)")
+
+    def _p95(self) -> Optional[float]:
+        latencies = sorted(latency for _, ok, latency in self._calls if ok)
+        if len(latencies) < 5:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def p95_ms(self) -> Optional[float]:
+        with self._lock:
+            return self._p95()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self._calls)
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            p95 = self._p95()
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "calls": calls,
+            "error_rate": round(failures / calls, 3) if calls else 0.0,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+        }
+
+
+class ResilientAdapter(BaseAdapter):
+    """
+    Décore l'adaptateur d'un fournisseur : délai max par appel, nouvelles
+    tentatives avec backoff + jitter sur les erreurs transitoires (réseau,
+    délai, 429, 5xx), et disjoncteur. En stream, on ne réessaie qu'avant le
+    premier token. Avec `gate`, le nombre d'appels en vol est plafonné : au-delà,
+    l'appel attend au plus `queue_timeout` secondes puis échoue (et peut basculer).
+    """
+
+    def __init__(self, inner: BaseAdapter, provider: str, policy: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None, gate: Optional[ConcurrencyGate] = None,
+                 queue_timeout: float = RATE_LIMIT_WAIT):
+        self.inner = inner
+        self.provider = provider
+        self.policy = policy or RetryPolicy.from_env(provider)
+        self.breaker = breaker or CircuitBreaker(provider)
+        self.gate = gate
+        self.queue_timeout = queue_timeout
+        self.retries = 0
+        self.timeouts = 0
+
+    def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        return self.inner.send_chat(model, messages, stream)
+
+    def _timeout_response(self) -> Dict[str, Any]:
+        self.timeouts += 1
+        return provider_error(self.provider, f"pas de réponse en {self.policy.timeout:g} s", "Timeout")
+
+    def _open_response(self) -> Dict[str, Any]:
+        return provider_error(self.provider, "momentanément indisponible (disjoncteur ouvert)", "CircuitOpen", 503)
+
+    def _saturated_response(self) -> Dict[str, Any]:
+        return provider_error(self.provider, f"trop d'appels en cours (attente > {self.queue_timeout:g} s)",
+                              "Saturated", 503)
+
+    async def asend_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        if self.gate is None:
+            return await self._asend_chat(model, messages, stream)
+        if not await self.gate.acquire(self.queue_timeout):
+            return self._saturated_response()
+        try:
+            return await self._asend_chat(model, messages, stream)
+        finally:
+            self.gate.release()
+
+    async def _asend_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool):
+        result = None
+        for attempt in range(self.policy.attempts + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(self.policy.backoff(attempt - 1))
+            if not self.breaker.allow():
+                return result or self._open_response()
+
+            started = time.perf_counter()
+            outcome = None
+            UPSTREAM_IN_FLIGHT.inc(provider=self.provider)
+            try:
+                outcome = await asyncio.wait_for(self.inner.asend_chat(model, messages, stream), self.policy.timeout)
+            except asyncio.TimeoutError:
+                outcome = self._timeout_response()
+            finally:
+                UPSTREAM_IN_FLIGHT.dec(provider=self.provider)
+                # Une requête invalide (4xx) ne dit rien de la santé du fournisseur ; None : annulée
+                healthy = None if outcome is None else not is_retryable(outcome)
+                self.breaker.record(healthy, (time.perf_counter() - started) * 1000)
+                self._observe(model, started, outcome)
+            result = outcome
+            if not is_retryable(result):
+                return result
+        return result
+
+    async def astream_chat(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        if self.gate is not None and not await self.gate.acquire(self.queue_timeout):
+            yield {"event": "error", **self._saturated_response()}
+            return
+        try:
+            async for event in self._astream_chat(model, messages):
+                yield event
+        finally:
+            if self.gate is not None:
+                self.gate.release()
+
+    async def _astream_chat(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        for attempt in range(self.policy.attempts + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(self.policy.backoff(attempt - 1))
+            if not self.breaker.allow():
+                yield {"event": "error", **self._open_response()}
+                return
+
+            started = time.perf_counter()
+            latency_ms = None
+            healthy, retry, outcome = None, False, None
+            stream = self.inner.astream_chat(model, messages)
+            UPSTREAM_IN_FLIGHT.inc(provider=self.provider)
+            try:
+                while True:
+                    try:
+                        event = await asyncio.wait_for(stream.__anext__(), self.policy.timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        event = {"event": "error", **self._timeout_response()}
+
+                    if event["event"] == "error":
+                        outcome = event
+                        healthy = not is_retryable(event)
+                        if latency_ms is None and not healthy and attempt < self.policy.attempts:
+                            retry = True
+                            break
+                        yield event
+                        return
+                    if event["event"] == "token" and latency_ms is None:
+                        latency_ms = (time.perf_counter() - started) * 1000
+                        TTFT.observe(latency_ms / 1000, provider=self.provider, model=model)
+                    if event["event"] == "done":
+                        healthy, outcome = True, event
+                    yield event
+            finally:
+                await stream.aclose()
+                UPSTREAM_IN_FLIGHT.dec(provider=self.provider)
+                # Pour un stream, la latence qui compte est celle du premier token
+                elapsed = latency_ms if latency_ms is not None else (time.perf_counter() - started) * 1000
+                self.breaker.record(healthy, elapsed)
+                self._observe(model, started, outcome)
+            if not retry:
+                return
+
+    def _observe(self, model: str, started: float, outcome: Optional[Dict[str, Any]]):
+        """Métriques d'une tentative ; `outcome` : réponse, événement final, ou None si annulée."""
+        error = outcome.get("error") if outcome is not None else None
+        label = "cancelled" if outcome is None else "error" if error else "ok"
+        UPSTREAM_DURATION.observe(time.perf_counter() - started, provider=self.provider, model=model, outcome=label)
+        if error:
+            UPSTREAM_ERRORS.inc(provider=self.provider, model=model, type=error.get("type", "unknown"))
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "timeout_s": self.policy.timeout,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "breaker": self.breaker.stats(),
+            "in_flight": self.gate.stats() if self.gate is not None else None,
+        }
+
+
+# -----------------------------------------------------
+# Bascule et hedging entre fournisseurs
+# -----------------------------------------------------
+class FailoverAdapter(BaseAdapter):
+    """
+    Point d'entrée unique pour tous les modèles :
+    - bascule : si le fournisseur échoue (erreur transitoire, délai, disjoncteur
+      ouvert), la requête part vers le modèle équivalent de l'autre fournisseur ;
+    - hedging (optionnel) : si la réponse tarde au-delà du p95 du fournisseur,
+      la même requête part aussi vers l'équivalent ; la première réponse gagne,
+      l'autre est annulée. Pas de hedging en stream (bascule seulement avant le
+      premier token).
+    """
+
+    def __init__(self, resolve: Callable[[str], Optional[BaseAdapter]],
+                 equivalents: Optional[Dict[str, str]] = None, failover: bool = FAILOVER,
+                 hedging: bool = HEDGING, hedge_delay_ms: float = HEDGE_DELAY_MS):
+        self.resolve = resolve
+        self.equivalents = equivalents if equivalents is not None else EQUIVALENT_MODELS
+        self.failover = failover
+        self.hedging = hedging
+        self.hedge_delay_ms = hedge_delay_ms
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        return self.resolve(model).send_chat(model, messages, stream)
+
+    def _alternative(self, model: str) -> Optional[str]:
+        alternative = self.equivalents.get(model)
+        if alternative and (self.failover or self.hedging) and self.resolve(alternative) is not None:
+            return alternative
+        return None
+
+    def _hedge_delay(self, adapter: BaseAdapter) -> float:
+        breaker = getattr(adapter, "breaker", None)
+        p95 = breaker.p95_ms() if breaker is not None else None
+        return max(50.0, p95 if p95 is not None else self.hedge_delay_ms) / 1000
+
+    async def asend_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        primary = self.resolve(model)
+        alternative = self._alternative(model)
+        if alternative is None:
+            return await primary.asend_chat(model, messages, stream)
+        if self.hedging:
+            return await self._hedged(primary, model, alternative, messages, stream)
+
+        result = await primary.asend_chat(model, messages, stream)
+        if self.failover and is_retryable(result):
+            return await self._fail_over(model, alternative, messages, stream, result)
+        return result
+
+    async def _fail_over(self, model: str, alternative: str, messages, stream: bool, failed: Dict[str, Any]):
+        self.failovers += 1
+        logger.warning(f"Bascule {model} → {alternative} : {failed['content']}")
+        result = await self.resolve(alternative).asend_chat(alternative, messages, stream)
+        if "error" in result:
+            return failed
+        return {**result, "model": alternative, "failover_from": model}
+
+    async def _hedged(self, primary: BaseAdapter, model: str, alternative: str, messages, stream: bool):
+        tasks = {asyncio.create_task(primary.asend_chat(model, messages, stream)): model}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self._hedge_delay(primary))
+            if done:
+                result = next(iter(done)).result()
+                if not is_retryable(result) or not self.failover:
+                    return result
+                return await self._fail_over(model, alternative, messages, stream, result)
+
+            # Le fournisseur principal tarde : la même requête part chez l'équivalent
+            self.hedges += 1
+            hedge = asyncio.create_task(self.resolve(alternative).asend_chat(alternative, messages, stream))
+            tasks[hedge] = alternative
+            failed = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if "error" not in result:
+                        if tasks[task] == alternative:
+                            self.hedge_wins += 1
+                            return {**result, "model": alternative, "hedged_from": model}
+                        return result
+                    failed = failed or result
+            return failed
+        finally:
+            # Le perdant est annulé (sa connexion est libérée par le client httpx)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def astream_chat(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        alternative = self._alternative(model) if self.failover else None
+        streamed = False
+        async for event in self.resolve(model).astream_chat(model, messages):
+            if event["event"] == "error" and not streamed and alternative and is_retryable(event):
+                self.failovers += 1
+                logger.warning(f"Bascule {model} → {alternative} : {event['content']}")
+                async for fallback in self.resolve(alternative).astream_chat(alternative, messages):
+                    if fallback["event"] == "done":
+                        fallback = {**fallback, "model": alternative, "failover_from": model}
+                    yield fallback
+                return
+            streamed = streamed or event["event"] == "token"
+            yield event
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "failover": self.failover,
+            "hedging": self.hedging,
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
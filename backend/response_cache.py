@@ -0,0 +1,296 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+from adapters.base import BaseAdapter
+from adapters.carbon_adapter import estimate_carbon
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger("response-cache")
+
+
+# -----------------------------------------------------
+# Clé de cache
+# -----------------------------------------------------
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return " ".join(content.split())
+    return content
+
+
+def cache_key(model: str, messages: List[Dict[str, Any]]) -> str:
+    """Empreinte de (modèle, messages normalisés) : espaces et casse des rôles ignorés."""
+    normalized = [
+        [str(m.get("role", "")).strip().lower(), _normalize_content(m.get("content"))]
+        for m in messages
+    ]
+    raw = json.dumps([model, normalized], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# -----------------------------------------------------
+# Backends
+# -----------------------------------------------------
+class CacheBackend(ABC):
+    """
+    Stockage clé → réponse, avec expiration par entrée.
+    `blocking` : get/set font un aller-retour réseau, exécuté hors de la boucle asyncio.
+    """
+
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """LRU borné en nombre d'entrées, TTL par entrée (propre au processus)."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._data)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Backend partagé entre workers / instances (nécessite `redis`).
+    Le TTL est porté par Redis ; l'éviction LRU relève de `maxmemory-policy`.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str, prefix: str = "middleware-ia:cache:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Le backend de cache Redis nécessite le paquet `redis` (pip install redis)")
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+
+# -----------------------------------------------------
+# Cache de réponses
+# -----------------------------------------------------
+class ResponseCache:
+    """
+    Cache exact des réponses par (modèle, messages normalisés).
+    TTL par modèle (0 = pas de cache pour ce modèle), compteurs hit/miss.
+    """
+
+    def __init__(self, backend: CacheBackend, default_ttl: float = 300.0,
+                 model_ttls: Optional[Dict[str, float]] = None):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.model_ttls = model_ttls or {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """
+        Variables d'environnement :
+        - RESPONSE_CACHE      : 0 pour désactiver (activé par défaut)
+        - CACHE_BACKEND       : memory (défaut) | redis
+        - CACHE_MAX_ENTRIES   : taille du LRU en mémoire
+        - CACHE_TTL           : TTL par défaut (s)
+        - CACHE_MODEL_TTLS    : ex. "openai:gpt-4o=600,mistral:open-mistral-7b=0"
+        - CACHE_REDIS_URL     : URL Redis pour le backend partagé
+        """
+        if os.getenv("RESPONSE_CACHE", "1") == "0":
+            return None
+
+        if os.getenv("CACHE_BACKEND", "memory") == "redis":
+            backend = RedisCacheBackend(os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"))
+        else:
+            backend = InMemoryCacheBackend(int(os.getenv("CACHE_MAX_ENTRIES", 1024)))
+
+        model_ttls = {}
+        for item in filter(None, os.getenv("CACHE_MODEL_TTLS", "").split(",")):
+            model, _, ttl = item.rpartition("=")
+            model_ttls[model.strip()] = float(ttl)
+
+        return cls(backend, float(os.getenv("CACHE_TTL", 300)), model_ttls)
+
+    def ttl_for(self, model: str) -> float:
+        return self.model_ttls.get(model, self.default_ttl)
+
+    def get(self, model: str, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if self.ttl_for(model) <= 0:
+            return None
+        try:
+            value = self.backend.get(cache_key(model, messages))
+        except Exception as e:
+            logger.warning(f"Lecture du cache impossible : {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        CACHE_REQUESTS.inc(model=model, result="miss" if value is None else "hit")
+        return value
+
+    def put(self, model: str, messages: List[Dict[str, Any]], result: Dict[str, Any]):
+        # Réponse de l'équivalent (bascule, hedging) : rangée sous le modèle qui a
+        # répondu, jamais servie ni tracée comme venant du modèle demandé
+        model = result.get("model") or model
+        ttl = self.ttl_for(model)
+        if ttl <= 0 or not _cacheable(result):
+            return
+        try:
+            self.backend.set(cache_key(model, messages), result, ttl)
+        except Exception as e:
+            logger.warning(f"Écriture du cache impossible : {e}")
+
+    async def aget(self, model: str, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.get, model, messages)
+        return self.get(model, messages)
+
+    async def aput(self, model: str, messages: List[Dict[str, Any]], result: Dict[str, Any]):
+        if self.backend.blocking:
+            await asyncio.to_thread(self.put, model, messages, result)
+        else:
+            self.put(model, messages, result)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "evictions": getattr(self.backend, "evictions", None),
+        }
+
+
+def _cacheable(result: Dict[str, Any]) -> bool:
+    """Seules les vraies réponses sont mises en cache (pas les erreurs)."""
+    usage = result.get("usage") or {}
+    return bool(result.get("content")) and (usage.get("input_tokens", 0) + usage.get("output_tokens", 0)) > 0
+
+
+def cached_result(model: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Réponse servie depuis le cache : trace à zéro token / zéro carbone,
+    avec ce qui a été économisé, pour que le dashboard montre le gain.
+    """
+    usage = entry.get("usage") or {}
+    saved_tokens = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    estimate_carbon(
+        model, 0, 0,
+        cached=True,
+        saved_tokens=saved_tokens,
+        saved_carbon_gco2eq=entry.get("est_co2e_g", 0.0),
+    )
+    return {
+        "content": entry["content"],
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+        "cost_eur": 0.0,
+        "est_kwh": 0.0,
+        "est_co2e_g": 0.0,
+        "cached": True,
+    }
+
+
+class CachingAdapter(BaseAdapter):
+    """Décore un adaptateur : consulte le cache avant tout appel au fournisseur."""
+
+    def __init__(self, inner: BaseAdapter, cache: ResponseCache):
+        self.inner = inner
+        self.cache = cache
+
+    def send_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        entry = self.cache.get(model, messages)
+        if entry is not None:
+            return cached_result(model, entry)
+        result = self.inner.send_chat(model, messages, stream)
+        self.cache.put(model, messages, result)
+        return result
+
+    async def asend_chat(self, model: str, messages: List[Dict[str, Any]], stream: bool = False):
+        entry = await self.cache.aget(model, messages)
+        if entry is not None:
+            return cached_result(model, entry)
+        result = await self.inner.asend_chat(model, messages, stream)
+        await self.cache.aput(model, messages, result)
+        return result
+
+    async def astream_chat(self, model: str, messages: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        entry = await self.cache.aget(model, messages)
+        if entry is not None:
+            result = cached_result(model, entry)
+            yield {"event": "token", "content": result.pop("content")}
+            yield {"event": "done", **result}
+            return
+
+        parts: List[str] = []
+        async for event in self.inner.astream_chat(model, messages):
+            if event["event"] == "token":
+                parts.append(event["content"])
+            elif event["event"] == "done":
+                result = {k: v for k, v in event.items() if k != "event"}
+                await self.cache.aput(model, messages, {**result, "content": "".join(parts)})
+            yield event
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
@@ -0,0 +1,120 @@
+"""
+Lancement du middleware sur un ou plusieurs workers (WEB_CONCURRENCY).
+
+Le superviseur importe l'application une seule fois (configuration,
+répertoires partagés ; SDK et EcoLogits aussi avec STARTUP_WARMUP=1),
+ouvre le port, puis fork les workers : ils héritent de ce travail sans le
+refaire et se partagent la socket. Chaque worker démarre ensuite ce qui lui est propre (clients HTTP,
+threads d'écriture des traces dans son segment) ; un worker qui s'arrête
+est relancé.
+
+Sessions, lots différés, cache et limites "memory" restent propres à
+chaque worker : derrière un répartiteur, activer l'affinité par
+utilisateur, ou CACHE_BACKEND=redis / RATE_LIMIT_BACKEND=redis.
+
+Usage (depuis backend/) :
+    WEB_CONCURRENCY=4 python serve.py --host 0.0.0.0 --port 8010
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+
+logger = logging.getLogger("serve")
+
+# Un worker mort moins de RESPAWN_DELAY s après son lancement : pause avant de le relancer
+RESPAWN_DELAY = 1.0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8010)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", 1)))
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Lu par deployment.py à l'import : workers et pool de fichiers s'y accordent
+    os.environ["WEB_CONCURRENCY"] = str(max(1, args.workers))
+
+    import uvicorn
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s:     %(message)s")
+    config = uvicorn.Config("main:app", host=args.host, port=args.port, log_level=args.log_level)
+    started = time.perf_counter()
+    config.load()  # import de main : une seule fois, avant le fork
+    logger.info(f"Application chargée en {time.perf_counter() - started:.2f} s")
+    if args.workers > 1 and os.getenv("STARTUP_WARMUP", "0") == "1":
+        # SDK et instrumentation EcoLogits chargés une fois, hérités par les workers
+        # (les clients HTTP, eux, sont créés après le fork par le warm-up de chaque worker)
+        sys.modules["main"].preload_providers()
+
+    sock = config.bind_socket()
+    if args.workers <= 1:
+        uvicorn.Server(config).run(sockets=[sock])
+        return
+
+    children = {}
+    stopping = False
+
+    def spawn() -> bool:
+        """Fork un worker ; True dans le worker lui-même."""
+        pid = os.fork()
+        if pid == 0:
+            return True
+        children[pid] = time.monotonic()
+        return False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        if spawn():
+            return serve_worker(config, sock)
+    logger.info(f"{args.workers} workers (PID {', '.join(map(str, children))})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        spawned = children.pop(pid, None)
+        if stopping or spawned is None:
+            continue
+        logger.warning(f"Worker {pid} arrêté (code {os.waitstatus_to_exitcode(status)}) : relance")
+        if time.monotonic() - spawned < RESPAWN_DELAY:
+            time.sleep(RESPAWN_DELAY)
+        if spawn():
+            return serve_worker(config, sock)
+    sock.close()
+
+
+def serve_worker(config, sock) -> int:
+    """
+    Boucle d'un worker forké. Il sort ensuite normalement de main() :
+    les handlers atexit (pool de fichiers, traces) s'exécutent.
+    """
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    uvicorn.Server(config).run(sockets=[sock])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+from fastapi import HTTPException
+
+# Nombre max de conversations, inactivité avant éviction (s), messages gardés par conversation
+SESSION_MAX = int(os.getenv("SESSION_MAX", 10_000))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", 1800))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", 200))
+
+
+class Session:
+    """Une conversation : historique (pièces jointes déjà traitées incluses) et PDF indexés."""
+
+    def __init__(self, session_id: str, user_id: str, model: Optional[str],
+                 messages: Optional[List[Dict[str, Any]]] = None, max_messages: int = SESSION_MAX_MESSAGES):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.model = model
+        self.max_messages = max_messages
+        self.messages: List[Dict[str, Any]] = []
+        self.documents: List[str] = []
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        # Un seul tour à la fois par conversation
+        self.lock = asyncio.Lock()
+        self.append(messages or [])
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def append(self, messages: List[Dict[str, Any]]):
+        """Ajoute des messages ; au-delà de `max_messages`, les plus anciens (hors système) sont oubliés."""
+        self.messages.extend(messages)
+        overflow = len(self.messages) - self.max_messages
+        if overflow > 0:
+            kept, dropped = [], 0
+            for m in self.messages:
+                if dropped < overflow and m.get("role") != "system":
+                    dropped += 1
+                    continue
+                kept.append(m)
+            self.messages = kept
+
+    def record_turn(self, new_messages: List[Dict[str, Any]], result: Dict[str, Any]):
+        """Enregistre le tour seulement s'il a abouti : un échec peut être renvoyé tel quel."""
+        usage = result.get("usage") or {}
+        if result.get("cached") or usage.get("output_tokens", 0) > 0:
+            self.append([*new_messages, {"role": "assistant", "content": result.get("content", "")}])
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "model": self.model,
+            "messages": len(self.messages),
+            "documents": list(self.documents),
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+class SessionStore:
+    """
+    Conversations en mémoire du processus : LRU borné en nombre, éviction
+    après `idle_ttl` secondes d'inactivité, accès réservé au `user_id` créateur.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_messages: int = SESSION_MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.evictions = 0
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, user_id: str, model: Optional[str] = None,
+               messages: Optional[List[Dict[str, Any]]] = None) -> Session:
+        session = Session(secrets.token_urlsafe(16), user_id, model, messages, self.max_messages)
+        with self._lock:
+            self._purge()
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return session
+
+    def get(self, session_id: str, user_id: str) -> Session:
+        with self._lock:
+            self._purge()
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise HTTPException(status_code=404, detail="Conversation inconnue ou expirée.")
+            if session.user_id != user_id:
+                raise HTTPException(status_code=403, detail="Cette conversation appartient à un autre utilisateur.")
+            session.touch()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str, user_id: str):
+        self.get(session_id, user_id)
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _purge(self):
+        # Les moins récemment utilisées sont en tête : on s'arrête à la première encore active
+        deadline = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used > deadline:
+                break
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "evictions": self.evictions,
+        }
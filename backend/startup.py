@@ -0,0 +1,106 @@
+"""
+Démarrage rapide : rapport de démarrage et warm-up optionnel.
+
+Les dépendances lourdes ne sont plus importées avec main.py : SDK OpenAI /
+Mistral et instrumentation EcoLogits au premier adaptateur créé, PyMuPDF et
+Pillow dans les processus du pool de fichiers. Chaque chargement différé est
+chronométré (`REPORT.lazy_load`) et le rapport est servi par /ready.
+
+STARTUP_WARMUP=1 : adaptateurs des fournisseurs configurés (clients HTTP
+poolés) et processus du pool de fichiers créés dès le démarrage, en tâche de
+fond ; /ready répond 503 tant qu'ils ne sont pas prêts. Sans warm-up, le
+premier appel à chaque fournisseur paie ces chargements.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger("startup")
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "0") == "1"
+
+
+def process_age() -> Optional[float]:
+    """Secondes écoulées depuis le lancement du processus (Linux ; None ailleurs)."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Champ 22 (starttime, en ticks depuis le boot) ; le nom du programme peut contenir des espaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class StartupReport:
+    """
+    Durées du démarrage :
+    - `before_import` : lancement de l'interpréteur -> import de main.py
+    - `phases`        : étapes du démarrage (import de l'application, warm-up...)
+    - `lazy_loads`    : premiers chargements différés (SDK, EcoLogits...), où qu'ils aient lieu
+    - `ready_after`   : lancement du processus -> application prête
+    """
+
+    def __init__(self):
+        self.before_import = process_age()
+        self._created = time.perf_counter()
+        self._origin = self._created - (self.before_import or 0.0)
+        self.phases: Dict[str, float] = {}
+        self.lazy_loads: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._origin
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 4)
+
+    def since_import(self, name: str):
+        """Note la durée écoulée depuis la création du rapport (ex. fin de l'import de main.py)."""
+        self.phases[name] = round(time.perf_counter() - self._created, 4)
+
+    @contextmanager
+    def lazy_load(self, name: str):
+        """Chronomètre le premier chargement de `name` ; les suivants ne sont pas notés."""
+        if name in self.lazy_loads:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.lazy_loads.setdefault(name, round(time.perf_counter() - started, 4))
+
+    def mark_ready(self):
+        self.ready_after = round(self.elapsed(), 4)
+        details = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.phases.items())
+        logger.info(f"Prêt en {self.ready_after:.2f} s ({details})")
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_after is not None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "ready_after": self.ready_after,
+            "before_import": round(self.before_import, 4) if self.before_import is not None else None,
+            "phases": dict(self.phases),
+            "lazy_loads": dict(self.lazy_loads),
+            "warmup": STARTUP_WARMUP,
+        }
+
+
+# Créé au premier import (tout en haut de main.py)
+REPORT = StartupReport()
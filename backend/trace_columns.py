@@ -0,0 +1,203 @@
+from datetime import timedelta
+from typing import Dict, List, Any, Optional, Iterable
+
+try:
+    import numpy as np
+except ImportError:  # numpy est optionnel : seul le layout "columnar" en dépend
+    np = None
+
+from trace_rollups import EPOCH, RECENT_SIZE, Bucket, TraceRollups
+
+US_PER_HOUR = 3_600_000_000
+ONE_US = timedelta(microseconds=1)
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("numpy est requis pour le layout colonnaire des traces (pip install numpy)")
+
+
+class TraceColumns:
+    """
+    Représentation colonnaire typée des traces.
+
+    - timestamp     : int64, microsecondes depuis l'epoch (UTC)
+    - model_code    : int16, index dans `models` (catégoriel)
+    - input_tokens  : int32
+    - output_tokens : int32
+    - energy_kwh    : float64
+    - carbon_gco2eq : float64
+    - saved_carbon  : float64, carbone évité par le cache (NaN = trace non servie par le cache)
+    - routing_saved : float64, carbone évité par le routeur auto (NaN = requête non routée)
+
+    Environ 50 octets par trace, contre plusieurs centaines pour un dict
+    Python contenant un objet datetime.
+    """
+
+    def __init__(self, timestamp, model_code, models: List[str],
+                 input_tokens, output_tokens, energy_kwh, carbon_gco2eq, saved_carbon, routing_saved):
+        self.timestamp = timestamp
+        self.model_code = model_code
+        self.models = models
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.energy_kwh = energy_kwh
+        self.carbon_gco2eq = carbon_gco2eq
+        self.saved_carbon = saved_carbon
+        self.routing_saved = routing_saved
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    @classmethod
+    def empty(cls, models: Optional[List[str]] = None) -> "TraceColumns":
+        return cls.from_traces([], models)
+
+    @classmethod
+    def from_traces(cls, traces: Iterable[Dict[str, Any]],
+                    models: Optional[List[str]] = None) -> "TraceColumns":
+        """
+        Construit les colonnes depuis des traces parsées.
+        `models` est le dictionnaire de catégories, complété en place si besoin
+        (le partager entre plusieurs lots garde des codes cohérents).
+        """
+        require_numpy()
+        models = models if models is not None else []
+        codes = {m: i for i, m in enumerate(models)}
+
+        ts, code, tin, tout, energy, carbon, saved, routed = [], [], [], [], [], [], [], []
+        for t in traces:
+            model = t.get("model", "unknown")
+            c = codes.get(model)
+            if c is None:
+                c = codes[model] = len(models)
+                models.append(model)
+            ts.append((t["timestamp"] - EPOCH) // ONE_US)
+            code.append(c)
+            tin.append(t.get("input_tokens", 0))
+            tout.append(t.get("output_tokens", 0))
+            energy.append(t.get("energy_kwh", 0))
+            carbon.append(t.get("carbon_gco2eq", 0))
+            saved.append(t.get("saved_carbon_gco2eq", 0) if t.get("cached") else np.nan)
+            routed.append(
+                t.get("baseline_carbon_gco2eq", 0) - t.get("carbon_gco2eq", 0) if t.get("routed") else np.nan
+            )
+
+        return cls(
+            np.array(ts, dtype=np.int64),
+            np.array(code, dtype=np.int16),
+            models,
+            np.array(tin, dtype=np.int32),
+            np.array(tout, dtype=np.int32),
+            np.array(energy, dtype=np.float64),
+            np.array(carbon, dtype=np.float64),
+            np.array(saved, dtype=np.float64),
+            np.array(routed, dtype=np.float64),
+        )
+
+    @classmethod
+    def concat(cls, chunks: List["TraceColumns"], models: List[str]) -> "TraceColumns":
+        """Concatène des lots partageant le même dictionnaire `models`, trié par timestamp."""
+        require_numpy()
+        if not chunks:
+            return cls.empty(models)
+        cols = cls(
+            np.concatenate([c.timestamp for c in chunks]),
+            np.concatenate([c.model_code for c in chunks]),
+            models,
+            np.concatenate([c.input_tokens for c in chunks]),
+            np.concatenate([c.output_tokens for c in chunks]),
+            np.concatenate([c.energy_kwh for c in chunks]),
+            np.concatenate([c.carbon_gco2eq for c in chunks]),
+            np.concatenate([c.saved_carbon for c in chunks]),
+            np.concatenate([c.routing_saved for c in chunks]),
+        )
+        if len(cols) > 1 and np.any(cols.timestamp[1:] < cols.timestamp[:-1]):
+            cols = cols.take(np.argsort(cols.timestamp, kind="stable"))
+        return cols
+
+    def take(self, index) -> "TraceColumns":
+        """Sous-ensemble des lignes (slice, masque booléen ou indices)."""
+        return TraceColumns(
+            self.timestamp[index],
+            self.model_code[index],
+            self.models,
+            self.input_tokens[index],
+            self.output_tokens[index],
+            self.energy_kwh[index],
+            self.carbon_gco2eq[index],
+            self.saved_carbon[index],
+            self.routing_saved[index],
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (
+            self.timestamp, self.model_code, self.input_tokens,
+            self.output_tokens, self.energy_kwh, self.carbon_gco2eq, self.saved_carbon, self.routing_saved,
+        ))
+
+    # -------------------------------------------------
+    # Agrégation vectorisée
+    # -------------------------------------------------
+    def to_rollups(self) -> TraceRollups:
+        """Calcule les rollups par group-by vectorisé (bincount), sans boucle par trace."""
+        rollups = TraceRollups()
+        n = len(self)
+        if n == 0:
+            return rollups
+
+        hours = self.timestamp // US_PER_HOUR
+        rollups.totals = _buckets(np.zeros(n, dtype=np.intp), 1, self)[0]
+
+        per_model = _buckets(self.model_code, len(self.models), self)
+        rollups.per_model = {self.models[i]: b for i, b in enumerate(per_model) if b.requests}
+
+        per_hod = _buckets(hours % 24, 24, self)
+        rollups.per_hour_of_day = {h: b for h, b in enumerate(per_hod) if b.requests}
+
+        for table, keys in ((rollups.per_day, hours // 24), (rollups.per_hour, hours)):
+            uniq, inverse = np.unique(keys, return_inverse=True)
+            for key, bucket in zip(uniq.tolist(), _buckets(inverse, len(uniq), self)):
+                table[key] = bucket
+
+        rollups.first_ts = EPOCH + int(self.timestamp.min()) * ONE_US
+        rollups.last_ts = EPOCH + int(self.timestamp.max()) * ONE_US
+
+        order = np.argsort(self.timestamp, kind="stable")[-RECENT_SIZE:]
+        rollups.recent = [
+            (EPOCH + ts * ONE_US, carbon)
+            for ts, carbon in zip(self.timestamp[order].tolist(), self.carbon_gco2eq[order].tolist())
+        ]
+        return rollups
+
+
+def _buckets(groups, size: int, cols: TraceColumns) -> List[Bucket]:
+    """Un Bucket par groupe, via np.bincount sur chaque colonne."""
+    requests = np.bincount(groups, minlength=size).tolist()
+    tin = np.bincount(groups, weights=cols.input_tokens, minlength=size).tolist()
+    tout = np.bincount(groups, weights=cols.output_tokens, minlength=size).tolist()
+    energy = np.bincount(groups, weights=cols.energy_kwh, minlength=size).tolist()
+    carbon = np.bincount(groups, weights=cols.carbon_gco2eq, minlength=size).tolist()
+    cached = ~np.isnan(cols.saved_carbon)
+    hits = np.bincount(groups, weights=cached, minlength=size).tolist()
+    saved = np.bincount(groups, weights=np.where(cached, cols.saved_carbon, 0.0), minlength=size).tolist()
+    routed_mask = ~np.isnan(cols.routing_saved)
+    routed = np.bincount(groups, weights=routed_mask, minlength=size).tolist()
+    routing_saved = np.bincount(groups, weights=np.where(routed_mask, cols.routing_saved, 0.0),
+                                minlength=size).tolist()
+
+    buckets = []
+    for i in range(size):
+        b = Bucket()
+        b.requests = requests[i]
+        b.input_tokens = int(tin[i])
+        b.output_tokens = int(tout[i])
+        b.energy = energy[i]
+        b.carbon = carbon[i]
+        b.cache_hits = int(hits[i])
+        b.saved_carbon = saved[i]
+        b.routed = int(routed[i])
+        b.routing_saved_carbon = routing_saved[i]
+        buckets.append(b)
+    return buckets
@@ -0,0 +1,212 @@
+from bisect import insort
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+EPOCH = datetime(1970, 1, 1)
+ONE_HOUR = timedelta(hours=1)
+ONE_DAY = timedelta(days=1)
+
+# Nombre de traces récentes conservées pour l'analyse de tendance
+RECENT_SIZE = 20
+
+
+def to_naive_utc(ts: datetime) -> datetime:
+    """Normalise un datetime en UTC naïf (convention des traces utcnow())."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+class Bucket:
+    """Agrégat additif (requêtes, tokens, énergie, carbone, hits du cache, routage auto)."""
+
+    __slots__ = ("requests", "input_tokens", "output_tokens", "energy", "carbon",
+                 "cache_hits", "saved_carbon", "routed", "routing_saved_carbon")
+
+    def __init__(self):
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.energy = 0.0
+        self.carbon = 0.0
+        self.cache_hits = 0
+        self.saved_carbon = 0.0
+        self.routed = 0
+        self.routing_saved_carbon = 0.0
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, trace: Dict[str, Any]):
+        self.requests += 1
+        self.input_tokens += trace.get("input_tokens", 0)
+        self.output_tokens += trace.get("output_tokens", 0)
+        self.energy += trace.get("energy_kwh", 0)
+        self.carbon += trace.get("carbon_gco2eq", 0)
+        if trace.get("cached"):
+            self.cache_hits += 1
+            self.saved_carbon += trace.get("saved_carbon_gco2eq", 0)
+        if trace.get("routed"):
+            # Gain net du routeur : ce qu'aurait émis le modèle de référence, moins l'émis
+            self.routed += 1
+            self.routing_saved_carbon += trace.get("baseline_carbon_gco2eq", 0) - trace.get("carbon_gco2eq", 0)
+
+    def merge(self, other: "Bucket"):
+        self.requests += other.requests
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.energy += other.energy
+        self.carbon += other.carbon
+        self.cache_hits += other.cache_hits
+        self.saved_carbon += other.saved_carbon
+        self.routed += other.routed
+        self.routing_saved_carbon += other.routing_saved_carbon
+
+    def copy(self) -> "Bucket":
+        clone = Bucket()
+        clone.merge(self)
+        return clone
+
+    def to_list(self) -> List[Any]:
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values: List[Any]) -> "Bucket":
+        bucket = cls()
+        for name, value in zip(cls.__slots__, values):
+            setattr(bucket, name, value)
+        return bucket
+
+
+class TraceRollups:
+    """
+    Tables pré-agrégées mises à jour une fois par trace ingérée.
+
+    - totals           : totaux globaux
+    - per_model        : totaux par modèle
+    - per_hour_of_day  : totaux par heure de la journée (0-23)
+    - per_day          : buckets journaliers (clé = jours depuis l'epoch)
+    - per_hour         : buckets horaires (clé = heures depuis l'epoch)
+
+    Les requêtes d'insights ne lisent que ces tables : leur coût dépend
+    du nombre de buckets, pas du nombre de traces.
+    """
+
+    def __init__(self):
+        self.totals = Bucket()
+        self.per_model: Dict[str, Bucket] = {}
+        self.per_hour_of_day: Dict[int, Bucket] = {}
+        self.per_day: Dict[int, Bucket] = {}
+        self.per_hour: Dict[int, Bucket] = {}
+        self.first_ts: Optional[datetime] = None
+        self.last_ts: Optional[datetime] = None
+        # (timestamp, carbone) des RECENT_SIZE traces les plus récentes
+        self.recent: List[Tuple[datetime, float]] = []
+
+    @classmethod
+    def from_traces(cls, traces: Iterable[Dict[str, Any]]) -> "TraceRollups":
+        rollups = cls()
+        for trace in traces:
+            rollups.add(trace)
+        return rollups
+
+    def add(self, trace: Dict[str, Any]):
+        ts: datetime = trace["timestamp"]
+        hours = (ts - EPOCH) // ONE_HOUR
+
+        self.totals.add(trace)
+        self._bucket(self.per_model, trace.get("model", "unknown")).add(trace)
+        self._bucket(self.per_hour_of_day, ts.hour).add(trace)
+        self._bucket(self.per_day, hours // 24).add(trace)
+        self._bucket(self.per_hour, hours).add(trace)
+
+        if self.first_ts is None or ts < self.first_ts:
+            self.first_ts = ts
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+
+        if len(self.recent) < RECENT_SIZE or ts >= self.recent[0][0]:
+            insort(self.recent, (ts, trace.get("carbon_gco2eq", 0)), key=lambda x: x[0])
+            if len(self.recent) > RECENT_SIZE:
+                del self.recent[0]
+
+    def merge(self, other: "TraceRollups"):
+        """Fusionne d'autres rollups (ex. calculés sur un lot de traces)."""
+        self.totals.merge(other.totals)
+        for mine, theirs in (
+            (self.per_model, other.per_model),
+            (self.per_hour_of_day, other.per_hour_of_day),
+            (self.per_day, other.per_day),
+            (self.per_hour, other.per_hour),
+        ):
+            for key, bucket in theirs.items():
+                self._bucket(mine, key).merge(bucket)
+
+        if other.first_ts is not None and (self.first_ts is None or other.first_ts < self.first_ts):
+            self.first_ts = other.first_ts
+        if other.last_ts is not None and (self.last_ts is None or other.last_ts > self.last_ts):
+            self.last_ts = other.last_ts
+
+        if other.recent:
+            recent = sorted(self.recent + other.recent, key=lambda x: x[0])
+            self.recent = recent[-RECENT_SIZE:]
+
+    def copy(self) -> "TraceRollups":
+        clone = TraceRollups()
+        clone.totals = self.totals.copy()
+        clone.per_model = {k: b.copy() for k, b in self.per_model.items()}
+        clone.per_hour_of_day = {k: b.copy() for k, b in self.per_hour_of_day.items()}
+        clone.per_day = {k: b.copy() for k, b in self.per_day.items()}
+        clone.per_hour = {k: b.copy() for k, b in self.per_hour.items()}
+        clone.first_ts = self.first_ts
+        clone.last_ts = self.last_ts
+        clone.recent = list(self.recent)
+        return clone
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Forme sérialisable en JSON (footer des segments de traces)."""
+        def table(buckets):
+            return {str(k): b.to_list() for k, b in buckets.items()}
+
+        return {
+            "totals": self.totals.to_list(),
+            "per_model": table(self.per_model),
+            "per_hour_of_day": table(self.per_hour_of_day),
+            "per_day": table(self.per_day),
+            "per_hour": table(self.per_hour),
+            "first_ts": self.first_ts.isoformat() if self.first_ts else None,
+            "last_ts": self.last_ts.isoformat() if self.last_ts else None,
+            "recent": [[ts.isoformat(), carbon] for ts, carbon in self.recent],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TraceRollups":
+        def table(raw, key):
+            return {key(k): Bucket.from_list(v) for k, v in raw.items()}
+
+        rollups = cls()
+        rollups.totals = Bucket.from_list(data["totals"])
+        rollups.per_model = table(data["per_model"], str)
+        rollups.per_hour_of_day = table(data["per_hour_of_day"], int)
+        rollups.per_day = table(data["per_day"], int)
+        rollups.per_hour = table(data["per_hour"], int)
+        rollups.first_ts = datetime.fromisoformat(data["first_ts"]) if data["first_ts"] else None
+        rollups.last_ts = datetime.fromisoformat(data["last_ts"]) if data["last_ts"] else None
+        rollups.recent = [(datetime.fromisoformat(ts), carbon) for ts, carbon in data["recent"]]
+        return rollups
+
+    @staticmethod
+    def _bucket(table: Dict[Any, Bucket], key: Any) -> Bucket:
+        bucket = table.get(key)
+        if bucket is None:
+            bucket = table[key] = Bucket()
+        return bucket
+
+
+def day_label(day: int) -> str:
+    return (EPOCH + day * ONE_DAY).strftime("%Y-%m-%d")
+
+
+def hour_label(hour: int) -> str:
+    return (EPOCH + hour * ONE_HOUR).strftime("%Y-%m-%d %H:00")
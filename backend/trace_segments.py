@@ -0,0 +1,386 @@
+"""
+Segments de traces binaires compressés (.trc).
+
+Un worker écrit ses traces dans `<préfixe>-000001.trc`, `<préfixe>-000002.trc`...
+Chaque segment est plafonné en taille (TRACE_SEGMENT_BYTES) puis scellé :
+
+    MAGIC | bloc | bloc | ... | footer | trailer
+
+- bloc    : un lot du TraceWriter. En-tête BLOCK (taille compressée, nombre
+            de traces, timestamps min/max) puis charge zlib : dictionnaire
+            des modèles et champs annexes en JSON, suivis d'un enregistrement
+            à largeur fixe RECORD par trace (~50 octets avant compression).
+- footer  : rollups complets du segment (totaux, par modèle, par heure,
+            par jour, min/max) et index des blocs, en JSON compressé.
+- trailer : taille du footer, pour le lire depuis la fin du fichier.
+
+/insights additionne les footers des segments scellés sans décoder leurs
+blocs ; une requête fenêtrée ignore les segments (et les blocs) hors de la
+fenêtre et ne décode que ceux qui la chevauchent.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from trace_rollups import EPOCH, TraceRollups, to_naive_utc
+from trace_columns import ONE_US
+from trace_writer import TraceWriter, write_all
+
+logger = logging.getLogger("trace-segments")
+
+SUFFIX = ".trc"
+MAGIC = b"ECOTRC01"
+BLOCK = struct.Struct("<4sIIqq")    # b"ECOB", taille compressée, traces, ts min, ts max (µs)
+FOOTER = struct.Struct("<4sI")      # b"ECOF", taille du footer compressé
+TRAILER = struct.Struct("<I4s")     # taille du footer compressé, b"ECOE"
+PAYLOAD = struct.Struct("<II")      # tailles des JSON modèles / champs annexes
+# ts (µs), code modèle, tokens in/out, énergie, carbone,
+# carbone évité par le cache (NaN = non servie par le cache),
+# carbone du modèle de référence (NaN = requête non routée)
+RECORD = struct.Struct("<qhiidddd")
+
+NAN = float("nan")
+_CORE_FIELDS = {"timestamp", "model", "input_tokens", "output_tokens", "energy_kwh", "carbon_gco2eq"}
+
+# Taille au-delà de laquelle un segment est scellé et le suivant ouvert
+DEFAULT_SEGMENT_BYTES = 8 * 1024 * 1024
+
+
+def _micros(ts: datetime) -> int:
+    return (ts - EPOCH) // ONE_US
+
+
+def parse_trace(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Trace telle qu'écrite par estimate_carbon() (timestamp ISO) -> timestamp datetime UTC naïf."""
+    ts = record["timestamp"]
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    return {**record, "timestamp": to_naive_utc(ts)}
+
+
+# -----------------------------------------------------
+# Blocs
+# -----------------------------------------------------
+def encode_block(traces: List[Dict[str, Any]], level: int = 6) -> bytes:
+    """Encode des traces parsées (parse_trace) en un bloc, sans perte de champ."""
+    models: List[str] = []
+    codes: Dict[str, int] = {}
+    extras: List[list] = []
+    rows = []
+    stamps = []
+    for i, t in enumerate(traces):
+        model = t.get("model", "unknown")
+        code = codes.get(model)
+        if code is None:
+            code = codes[model] = len(models)
+            models.append(model)
+
+        extra = {k: v for k, v in t.items() if k not in _CORE_FIELDS}
+        saved = baseline = NAN
+        if extra.get("cached") is True and "saved_carbon_gco2eq" in extra:
+            del extra["cached"]
+            saved = extra.pop("saved_carbon_gco2eq")
+        if extra.get("routed") is True and "baseline_carbon_gco2eq" in extra:
+            del extra["routed"]
+            baseline = extra.pop("baseline_carbon_gco2eq")
+        if extra:
+            extras.append([i, extra])
+
+        ts = _micros(t["timestamp"])
+        stamps.append(ts)
+        rows.append(RECORD.pack(ts, code, t.get("input_tokens", 0), t.get("output_tokens", 0),
+                                t.get("energy_kwh", 0), t.get("carbon_gco2eq", 0), saved, baseline))
+
+    head = json.dumps(models).encode("utf-8")
+    tail = json.dumps(extras, default=str).encode("utf-8")
+    body = zlib.compress(PAYLOAD.pack(len(head), len(tail)) + head + tail + b"".join(rows), level)
+    return BLOCK.pack(b"ECOB", len(body), len(traces), min(stamps), max(stamps)) + body
+
+
+def decode_block(body: bytes) -> List[Dict[str, Any]]:
+    """Traces d'un bloc (charge compressée, sans en-tête), au format de TraceStore."""
+    payload = memoryview(zlib.decompress(body))
+    head_len, tail_len = PAYLOAD.unpack_from(payload)
+    pos = PAYLOAD.size
+    models = json.loads(bytes(payload[pos:pos + head_len]))
+    pos += head_len
+    extras = {i: extra for i, extra in json.loads(bytes(payload[pos:pos + tail_len]))}
+    pos += tail_len
+
+    traces = []
+    for i, (ts, code, tin, tout, energy, carbon, saved, baseline) in enumerate(RECORD.iter_unpack(payload[pos:])):
+        trace = {
+            "timestamp": EPOCH + ts * ONE_US,
+            "model": models[code],
+            "input_tokens": tin,
+            "output_tokens": tout,
+            "energy_kwh": energy,
+            "carbon_gco2eq": carbon,
+        }
+        if saved == saved:  # NaN : pas de hit du cache
+            trace["cached"] = True
+            trace["saved_carbon_gco2eq"] = saved
+        if baseline == baseline:
+            trace["routed"] = True
+            trace["baseline_carbon_gco2eq"] = baseline
+        extra = extras.get(i)
+        if extra:
+            trace.update(extra)
+        traces.append(trace)
+    return traces
+
+
+def encode_footer(rollups: TraceRollups, blocks: List[List[int]]) -> bytes:
+    body = zlib.compress(json.dumps({"rollups": rollups.to_dict(), "blocks": blocks}).encode("utf-8"))
+    return FOOTER.pack(b"ECOF", len(body)) + body + TRAILER.pack(len(body), b"ECOE")
+
+
+def read_footer(f, size: int) -> Optional[Dict[str, Any]]:
+    """Footer d'un segment scellé lu depuis la fin du fichier ; None si le segment est ouvert."""
+    if size < len(MAGIC) + FOOTER.size + TRAILER.size:
+        return None
+    f.seek(size - TRAILER.size)
+    length, tag = TRAILER.unpack(f.read(TRAILER.size))
+    start = size - TRAILER.size - length - FOOTER.size
+    if tag != b"ECOE" or start < len(MAGIC):
+        return None
+    f.seek(start)
+    head, body_len = FOOTER.unpack(f.read(FOOTER.size))
+    if head != b"ECOF" or body_len != length:
+        return None  # fin de bloc qui ressemble par hasard à un trailer
+    return json.loads(zlib.decompress(f.read(length)))
+
+
+# -----------------------------------------------------
+# Écriture
+# -----------------------------------------------------
+class SegmentTraceWriter(TraceWriter):
+    """
+    TraceWriter au format segmenté : chaque lot devient un bloc compressé de
+    `<path>-NNNNNN.trc`. Quand le segment dépasse `segment_bytes`, ou à
+    l'arrêt, son footer est écrit et le lot suivant ouvre un nouveau segment.
+
+    Le writer tient les rollups du segment courant (pour le footer) ; un
+    segment n'a qu'un seul écrivain, donc pas de flock. Un segment resté
+    ouvert (processus tué) reste lisible bloc par bloc.
+    """
+
+    def __init__(self, path: Path, segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+                 compression_level: int = 6, **kwargs):
+        super().__init__(path, **kwargs)
+        self.segment_bytes = segment_bytes
+        self.compression_level = compression_level
+        self.sealed = 0
+
+        self._seq: Optional[int] = None
+        self._segment: Optional[Path] = None
+        self._size = 0
+        self._rollups = TraceRollups()
+        self._blocks: List[List[int]] = []
+
+    @classmethod
+    def from_env(cls, path: Path) -> "SegmentTraceWriter":
+        """En plus de TraceWriter.from_env : TRACE_SEGMENT_BYTES, TRACE_COMPRESSION_LEVEL."""
+        writer = super().from_env(path)
+        writer.segment_bytes = int(os.getenv("TRACE_SEGMENT_BYTES", DEFAULT_SEGMENT_BYTES))
+        writer.compression_level = int(os.getenv("TRACE_COMPRESSION_LEVEL", 6))
+        return writer
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "segment": self._segment.name if self._segment else None,
+                "segment_bytes": self._size, "sealed_segments": self.sealed}
+
+    def _append(self, records):
+        traces = [parse_trace(r) for r in records]
+        block = encode_block(traces, self.compression_level)
+        fd = self._open()
+        write_all(fd, block)
+        _, _, _, lo, hi = BLOCK.unpack_from(block)
+        self._blocks.append([self._size, lo, hi])
+        self._size += len(block)
+        for trace in traces:
+            self._rollups.add(trace)
+        self._sync()
+        if self._size >= self.segment_bytes:
+            self._close_fd()
+
+    def _close_fd(self):
+        """Scelle le segment courant : footer, fsync, fermeture."""
+        write_all(self._fd, encode_footer(self._rollups, self._blocks))
+        super()._close_fd()
+        self.sealed += 1
+
+    def _open(self) -> int:
+        if self._fd is None:
+            self._seq = self._next_seq()
+            self._segment = self.path.with_name(f"{self.path.name}-{self._seq:06d}{SUFFIX}")
+            self._fd = os.open(self._segment, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644)
+            write_all(self._fd, MAGIC)
+            self._size = len(MAGIC)
+            self._rollups = TraceRollups()
+            self._blocks = []
+        return self._fd
+
+    def _next_seq(self) -> int:
+        if self._seq is None:
+            # Même préfixe après un redémarrage (ex. PID 1 dans un conteneur) : on continue la série
+            prefix = f"{self.path.name}-"
+            seqs = [int(p.stem[len(prefix):]) for p in self.path.parent.glob(f"{prefix}*{SUFFIX}")
+                    if p.stem[len(prefix):].isdigit()]
+            self._seq = max(seqs, default=0)
+        return self._seq + 1
+
+
+# -----------------------------------------------------
+# Lecture
+# -----------------------------------------------------
+class TraceSegment:
+    """
+    Segment .trc vu par /insights (même interface que TraceStore pour
+    SegmentedTraceStore).
+
+    Seules les métadonnées restent en mémoire : rollups et index des blocs
+    (offset, ts min, ts max). Un segment scellé est chargé depuis son footer
+    sans décoder un seul bloc ; un segment ouvert est lu bloc par bloc, au
+    fil des refresh(), jusqu'à l'apparition de son footer.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.rollups = TraceRollups()
+        self.blocks: List[Tuple[int, int, int]] = []
+        self.sealed = False
+        self.version = 0
+
+        self._offset = 0
+        self._inode: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> int:
+        """Ingère les blocs ajoutés (ou le footer) et retourne le nombre de traces ajoutées."""
+        with self._lock:
+            if self.sealed:
+                return 0
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return 0
+            if self._inode is not None and stat.st_ino != self._inode:
+                self._reset()
+            self._inode = stat.st_ino
+            if stat.st_size == self._offset:
+                return 0
+
+            with open(self.path, "rb") as f:
+                if self._offset == 0:
+                    footer = read_footer(f, stat.st_size)
+                    if footer is not None:
+                        self._load_footer(footer, stat.st_size)
+                        return self.rollups.totals.requests
+                    f.seek(0)
+                    if f.read(len(MAGIC)) != MAGIC:
+                        if stat.st_size >= len(MAGIC):
+                            logger.warning(f"{self.path.name} : pas un segment de traces, ignoré")
+                            self.sealed = True
+                        return 0
+                    self._offset = len(MAGIC)
+                f.seek(self._offset)
+                data = memoryview(f.read(stat.st_size - self._offset))
+
+            added = self._scan(data)
+            if added:
+                self.version += 1
+            return added
+
+    def _scan(self, data: memoryview) -> int:
+        """Parcourt les blocs complets ; un bloc en cours d'écriture sera repris au prochain refresh."""
+        pos = added = 0
+        while len(data) - pos >= BLOCK.size:
+            tag, length, count, lo, hi = BLOCK.unpack_from(data, pos)
+            if tag == b"ECOF":
+                self.sealed = True  # footer : les rollups déjà ingérés sont complets
+                break
+            if tag != b"ECOB":
+                logger.warning(f"{self.path.name} : bloc illisible à l'offset {self._offset + pos}")
+                self.sealed = True
+                break
+            end = pos + BLOCK.size + length
+            if end > len(data):
+                break
+            for trace in decode_block(data[pos + BLOCK.size:end]):
+                self.rollups.add(trace)
+            self.blocks.append((self._offset + pos, lo, hi))
+            added += count
+            pos = end
+        self._offset += pos
+        return added
+
+    def _load_footer(self, footer: Dict[str, Any], size: int):
+        self.rollups = TraceRollups.from_dict(footer["rollups"])
+        self.blocks = [tuple(block) for block in footer["blocks"]]
+        self.sealed = True
+        self._offset = size
+        self.version += 1
+
+    def _reset(self):
+        self.rollups = TraceRollups()
+        self.blocks = []
+        self.sealed = False
+        self._offset = 0
+        self.version += 1
+
+    def fingerprint(self) -> str:
+        with self._lock:
+            return f"{self._inode}-{self._offset}-{self.version}"
+
+    def rollups_snapshot(self) -> TraceRollups:
+        with self._lock:
+            return self.rollups.copy()
+
+    def merge_rollups_into(self, target: TraceRollups):
+        with self._lock:
+            target.merge(self.rollups)
+
+    def window_rollups(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       model: Optional[str] = None) -> TraceRollups:
+        """
+        Rollups restreints à start <= timestamp < end (et à un modèle).
+
+        Segment hors fenêtre ou sans ce modèle : ignoré. Segment entièrement
+        couvert, sans filtre de modèle : ses rollups tels quels. Sinon, seuls
+        les blocs qui chevauchent la fenêtre sont décodés.
+        """
+        start = to_naive_utc(start) if start else None
+        end = to_naive_utc(end) if end else None
+
+        with self._lock:
+            rollups, blocks = self.rollups, list(self.blocks)
+            first, last = rollups.first_ts, rollups.last_ts
+            if first is None or (model is not None and model not in rollups.per_model):
+                return TraceRollups()
+            if (start is not None and last < start) or (end is not None and first >= end):
+                return TraceRollups()
+            if model is None and (start is None or start <= first) and (end is None or last < end):
+                return rollups.copy()
+
+        lo = _micros(start) if start else None
+        hi = _micros(end) if end else None
+        window = TraceRollups()
+        with open(self.path, "rb") as f:
+            for offset, block_lo, block_hi in blocks:
+                if (lo is not None and block_hi < lo) or (hi is not None and block_lo >= hi):
+                    continue
+                f.seek(offset)
+                _, length, _, _, _ = BLOCK.unpack(f.read(BLOCK.size))
+                for trace in decode_block(f.read(length)):
+                    ts = trace["timestamp"]
+                    if (start and ts < start) or (end and ts >= end) or (model and trace["model"] != model):
+                        continue
+                    window.add(trace)
+        return window
@@ -0,0 +1,336 @@
+import json
+import os
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterable, Union
+
+from trace_rollups import EPOCH, TraceRollups, to_naive_utc
+from trace_columns import ONE_US, TraceColumns, np, require_numpy
+from trace_segments import SUFFIX as SEGMENT_SUFFIX, TraceSegment
+
+LAYOUTS = ("dicts", "columnar")
+
+_timestamp = itemgetter("timestamp")
+
+
+class TraceStore:
+    """
+    Index en mémoire des traces EcoLogits, partagé par tout le processus.
+
+    Le fichier JSONL n'est lu qu'une seule fois : on mémorise l'offset
+    (en octets) de la dernière ligne complète, l'inode et la taille du
+    fichier, puis chaque refresh() ne parse que les lignes ajoutées depuis.
+    Une troncature ou une rotation (inode différent, fichier plus court)
+    déclenche une relecture complète.
+
+    Les rollups (totaux, par modèle, par heure, par jour) sont mis à jour
+    une seule fois par trace, au moment de l'ingestion.
+
+    Deux layouts mémoire :
+    - "dicts"    : liste de dicts Python triée (`traces`)
+    - "columnar" : colonnes NumPy typées (`columns()`), rollups calculés
+                   par bincount sur chaque lot ingéré
+    """
+
+    # Empreinte du début de fichier pour détecter une réécriture "sur place"
+    _HEAD_BYTES = 256
+    # Lecture par blocs : borne le pic mémoire lors de l'ingestion initiale
+    _READ_BLOCK = 16 * 1024 * 1024
+
+    def __init__(self, path: Path, layout: str = "dicts"):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Layout de traces inconnu : {layout!r} (attendu : {', '.join(LAYOUTS)})")
+        if layout == "columnar":
+            require_numpy()
+
+        self.path = Path(path)
+        self.layout = layout
+        self.traces: List[Dict[str, Any]] = []
+        self._by_model: Dict[str, List[Dict[str, Any]]] = {}
+        self._models: List[str] = []
+        self._chunks: List[TraceColumns] = []
+        self._columns: Optional[TraceColumns] = None
+        self.rollups = TraceRollups()
+        self.version = 0
+
+        self._offset = 0
+        self._inode: Optional[int] = None
+        self._size = 0
+        self._head = b""
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------
+    # Lecture incrémentale
+    # -------------------------------------------------
+    def refresh(self) -> int:
+        """Ingère les nouvelles lignes du fichier et retourne le nombre de traces ajoutées."""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                if self._inode is not None:
+                    self._reset()
+                return 0
+
+            if self._rotated(stat):
+                self._reset()
+
+            if stat.st_size == self._offset:
+                return 0
+
+            added = 0
+            with open(self.path, "rb") as f:
+                if not self._head:
+                    self._head = f.read(self._HEAD_BYTES)
+                f.seek(self._offset)
+                pending = b""
+                while self._offset + len(pending) < stat.st_size:
+                    block = f.read(min(self._READ_BLOCK, stat.st_size - self._offset - len(pending)))
+                    if not block:
+                        break
+                    pending += block
+                    # On ne consomme que jusqu'à la dernière ligne complète :
+                    # une écriture en cours sera reprise au prochain refresh.
+                    end = pending.rfind(b"\n") + 1
+                    if end == 0:
+                        continue
+                    batch = self._parse(pending[:end])
+                    self._offset += end
+                    pending = pending[end:]
+                    if batch:
+                        self._ingest(batch)
+                        added += len(batch)
+
+            self._inode = stat.st_ino
+            self._size = stat.st_size
+            if added:
+                self.version += 1
+            return added
+
+    def fingerprint(self) -> str:
+        """Identifie l'état indexé (fichier + position + version), pour les ETag."""
+        with self._lock:
+            return f"{self._inode}-{self._offset}-{self.version}"
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Copie de la liste triée des traces (sûre face aux refresh concurrents)."""
+        with self._lock:
+            return list(self.traces)
+
+    def columns(self) -> TraceColumns:
+        """Colonnes consolidées et triées (layout "columnar" uniquement)."""
+        with self._lock:
+            return self._consolidated()
+
+    def window_rollups(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       model: Optional[str] = None) -> TraceRollups:
+        """
+        Rollups restreints à start <= timestamp < end (et à un modèle).
+
+        Les traces étant triées, la fenêtre est trouvée par dichotomie :
+        le coût dépend de la taille de la fenêtre, pas de l'historique.
+        """
+        start = to_naive_utc(start) if start else None
+        end = to_naive_utc(end) if end else None
+
+        with self._lock:
+            if self.layout == "columnar":
+                return self._window_columns(start, end, model).to_rollups()
+            window = self._window_traces(start, end, model)
+        return TraceRollups.from_traces(window)
+
+    def _window_traces(self, start, end, model) -> List[Dict[str, Any]]:
+        traces = self.traces if model is None else self._by_model.get(model, [])
+        lo = bisect_left(traces, start, key=_timestamp) if start else 0
+        hi = bisect_left(traces, end, key=_timestamp) if end else len(traces)
+        return traces[lo:hi]
+
+    def _window_columns(self, start, end, model) -> TraceColumns:
+        cols = self._consolidated()
+        lo = int(np.searchsorted(cols.timestamp, (start - EPOCH) // ONE_US)) if start else 0
+        hi = int(np.searchsorted(cols.timestamp, (end - EPOCH) // ONE_US)) if end else len(cols)
+        window = cols.take(slice(lo, hi))
+        if model is not None:
+            if model not in cols.models:
+                return TraceColumns.empty(cols.models)
+            window = window.take(window.model_code == cols.models.index(model))
+        return window
+
+    def _consolidated(self) -> TraceColumns:
+        if self._columns is None:
+            self._columns = TraceColumns.concat(self._chunks, self._models)
+            self._chunks = [self._columns]
+        return self._columns
+
+    def rollups_snapshot(self) -> TraceRollups:
+        """Copie des rollups courants (coût proportionnel au nombre de buckets)."""
+        with self._lock:
+            return self.rollups.copy()
+
+    def merge_rollups_into(self, target: TraceRollups):
+        """Fusionne les rollups courants dans `target` sans copie intermédiaire."""
+        with self._lock:
+            target.merge(self.rollups)
+
+    def _rotated(self, stat: os.stat_result) -> bool:
+        if self._inode is None:
+            return False
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            return True
+        if self._head:
+            with open(self.path, "rb") as f:
+                head = f.read(len(self._head))
+            return head != self._head
+        return False
+
+    def _reset(self):
+        self.traces = []
+        self._by_model = {}
+        self.rollups = TraceRollups()
+        self._models = []
+        self._chunks = []
+        self._columns = None
+        self._offset = 0
+        self._inode = None
+        self._size = 0
+        self._head = b""
+        self.version += 1
+
+    @staticmethod
+    def _parse(chunk: bytes) -> List[Dict[str, Any]]:
+        """Parse un bloc de lignes JSONL en filtrant les logs."""
+        traces = []
+        for raw in chunk.splitlines():
+            line = raw.strip()
+            if not line or not line.startswith(b"{"):
+                continue  # Ignore les warnings/logs
+            try:
+                data = json.loads(line)
+                if "timestamp" in data and "model" in data:
+                    data["timestamp"] = to_naive_utc(datetime.fromisoformat(data["timestamp"]))
+                    traces.append(data)
+            except (json.JSONDecodeError, UnicodeDecodeError, ValueError, TypeError):
+                continue
+        return traces
+
+    def _ingest(self, added: List[Dict[str, Any]]):
+        """Ajoute les traces en conservant l'ordre chronologique."""
+        if self.layout == "columnar":
+            batch = TraceColumns.from_traces(added, self._models)
+            self.rollups.merge(batch.to_rollups())
+            self._chunks.append(batch)
+            self._columns = None
+            return
+
+        added.sort(key=_timestamp)
+        for trace in added:
+            self.rollups.add(trace)
+
+        _append_sorted(self.traces, added)
+        by_model: Dict[str, List[Dict[str, Any]]] = {}
+        for trace in added:
+            by_model.setdefault(trace.get("model", "unknown"), []).append(trace)
+        for model, traces in by_model.items():
+            _append_sorted(self._by_model.setdefault(model, []), traces)
+
+
+def _append_sorted(traces: List[Dict[str, Any]], added: List[Dict[str, Any]]):
+    """Ajoute des traces déjà triées en conservant l'ordre chronologique."""
+    if not traces or added[0]["timestamp"] >= traces[-1]["timestamp"]:
+        traces.extend(added)
+        return
+    # Cas rare : lignes écrites dans le désordre (plusieurs workers)
+    for trace in added:
+        insort(traces, trace, key=_timestamp)
+
+
+class SegmentedTraceStore:
+    """
+    Traces réparties en segments dans TRACE_DIR : segments binaires .trc
+    (TRACE_FORMAT=segments, voir trace_segments) ou un JSONL par worker,
+    plus d'éventuels fichiers isolés (`extra`, ex. l'historique JSONL
+    d'avant le passage aux segments).
+
+    Un lecteur par segment (TraceSegment ou TraceStore), avec sa propre
+    lecture incrémentale ; les segments sont redécouverts à chaque refresh()
+    et les rollups fusionnés à la lecture. Chaque segment n'ayant qu'un seul
+    écrivain, il n'y a aucun verrou entre processus ni entre nœuds
+    (répertoire sur volume partagé).
+    """
+
+    def __init__(self, directory: Path, layout: str = "dicts", extra: Iterable[Path] = ()):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Layout de traces inconnu : {layout!r} (attendu : {', '.join(LAYOUTS)})")
+        self.directory = Path(directory)
+        self.layout = layout
+        self.extra = [Path(p) for p in extra]
+        self.segments: Dict[Path, Union[TraceStore, TraceSegment]] = {}
+        self._lock = threading.Lock()
+
+    def readers(self) -> List[Union[TraceStore, TraceSegment]]:
+        with self._lock:
+            return [self.segments[path] for path in sorted(self.segments)]
+
+    def refresh(self) -> int:
+        """Découvre les segments (nouveaux ou supprimés) puis ingère leurs nouvelles lignes."""
+        paths = (set(self.directory.glob("*.jsonl")) | set(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+                 | {p for p in self.extra if p.exists()})
+        with self._lock:
+            for path in list(self.segments):
+                if path not in paths:
+                    del self.segments[path]
+            for path in paths:
+                if path not in self.segments:
+                    self.segments[path] = (TraceSegment(path) if path.suffix == SEGMENT_SUFFIX
+                                           else TraceStore(path, self.layout))
+        return sum(store.refresh() for store in self.readers())
+
+    def fingerprint(self) -> str:
+        return "|".join(f"{store.path.name}:{store.fingerprint()}" for store in self.readers())
+
+    def rollups_snapshot(self) -> TraceRollups:
+        # merge() crée ses propres buckets : pas besoin de copier chaque segment avant
+        merged = TraceRollups()
+        for store in self.readers():
+            store.merge_rollups_into(merged)
+        return merged
+
+    def window_rollups(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       model: Optional[str] = None) -> TraceRollups:
+        merged = TraceRollups()
+        for store in self.readers():
+            merged.merge(store.window_rollups(start, end, model))
+        return merged
+
+    def stats(self) -> Dict[str, Any]:
+        stores = self.readers()
+        return {"segments": len(stores), "directory": str(self.directory),
+                "sealed": sum(1 for s in stores if getattr(s, "sealed", False))}
+
+
+# -----------------------------------------------------
+# Registre process-wide
+# -----------------------------------------------------
+_STORES: Dict[tuple, Union[TraceStore, SegmentedTraceStore]] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_trace_store(path: Path, layout: str = "dicts",
+                    segments: Optional[Path] = None) -> Union[TraceStore, SegmentedTraceStore]:
+    """
+    Retourne l'unique store associé à ce fichier et ce layout (créé au premier appel).
+    Avec `segments`, store segmenté sur ce répertoire, `path` compris s'il existe.
+    """
+    key = (Path(path).resolve(), layout, Path(segments).resolve() if segments else None)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            if segments:
+                store = SegmentedTraceStore(key[2], layout, extra=[key[0]])
+            else:
+                store = TraceStore(key[0], layout)
+            _STORES[key] = store
+    return store
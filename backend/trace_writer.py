@@ -0,0 +1,289 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, Type
+
+from metrics import REGISTRY, Gauge, TRACE_WRITE, TRACE_RECORDS
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus
+    fcntl = None
+
+logger = logging.getLogger("trace-writer")
+
+FSYNC_POLICIES = ("never", "batch", "periodic")
+# File pleine : "drop" (trace perdue et comptée, défaut) | "write" (écriture directe, bloquante)
+OVERFLOW_POLICIES = ("drop", "write")
+
+_STOP = object()
+
+
+class TraceWriter:
+    """
+    Écriture des traces carbone en arrière-plan.
+
+    Les enregistrements passent par une file bornée en mémoire ; un thread
+    dédié les écrit par lots, dès que `batch_size` lignes sont en attente
+    ou que `flush_interval` secondes se sont écoulées depuis la première.
+    Chaque lot part en un seul write() sur un descripteur O_APPEND, sous
+    verrou flock : plusieurs workers ne peuvent pas entrelacer de lignes
+    partielles.
+
+    Politiques fsync :
+    - "never"    : on laisse le noyau décider
+    - "batch"    : fsync après chaque lot
+    - "periodic" : fsync au plus toutes les `fsync_interval` secondes
+
+    File pleine : l'appelant (estimate_carbon, sur la boucle asyncio) n'attend
+    jamais. Avec overflow="drop", la trace est perdue et comptée (`dropped`) ;
+    avec overflow="write", elle est écrite directement (sans perte, mais
+    l'I/O disque se fait sur le chemin de la requête).
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_queue: int = 10_000,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        fsync: str = "batch",
+        fsync_interval: float = 5.0,
+        overflow: str = "drop",
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Politique fsync inconnue : {fsync!r} (attendu : {', '.join(FSYNC_POLICIES)})")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Politique de débordement inconnue : {overflow!r} "
+                             f"(attendu : {', '.join(OVERFLOW_POLICIES)})")
+        self.path = Path(path)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.overflow = overflow
+
+        self.written = 0
+        self.batches = 0
+        self.overflow_writes = 0
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._fd_lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._inode: Optional[int] = None
+        self._last_fsync = 0.0
+
+    @classmethod
+    def from_env(cls, path: Path) -> "TraceWriter":
+        """
+        Variables d'environnement : TRACE_QUEUE_SIZE, TRACE_BATCH_SIZE,
+        TRACE_FLUSH_INTERVAL, TRACE_FSYNC, TRACE_FSYNC_INTERVAL, TRACE_OVERFLOW.
+        """
+        return cls(
+            path,
+            max_queue=int(os.getenv("TRACE_QUEUE_SIZE", 10_000)),
+            batch_size=int(os.getenv("TRACE_BATCH_SIZE", 256)),
+            flush_interval=float(os.getenv("TRACE_FLUSH_INTERVAL", 1.0)),
+            fsync=os.getenv("TRACE_FSYNC", "batch"),
+            fsync_interval=float(os.getenv("TRACE_FSYNC_INTERVAL", 5.0)),
+            overflow=os.getenv("TRACE_OVERFLOW", "drop"),
+        )
+
+    # -------------------------------------------------
+    # API
+    # -------------------------------------------------
+    def write(self, record: Dict[str, Any]):
+        """Met un enregistrement en file, sans jamais attendre (voir `overflow` si elle est pleine)."""
+        q = self._ensure_started()
+        try:
+            q.put_nowait(record)
+        except queue.Full:
+            if self.overflow == "write":
+                self.overflow_writes += 1
+                self._write_batch([record])
+                return
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"File de traces pleine : {self.dropped} trace(s) perdue(s)")
+
+    def flush(self, timeout: float = 5.0):
+        """Bloque jusqu'à ce que tout ce qui est en file soit écrit."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """Vide la file, écrit le dernier lot et arrête le thread."""
+        with self._lock:
+            thread, q = self._thread, self._queue
+            if thread is None or self._pid != os.getpid():
+                return
+            q.put(_STOP)
+            thread.join(timeout)
+            self._thread = None
+            self._queue = None
+        with self._fd_lock:
+            if self._fd is not None:
+                self._close_fd()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "batches": self.batches,
+            "overflow_writes": self.overflow_writes,
+            "dropped": self.dropped,
+        }
+
+    # -------------------------------------------------
+    # Thread d'écriture
+    # -------------------------------------------------
+    def _ensure_started(self) -> queue.Queue:
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return self._queue
+        with self._lock:
+            # Après un fork, le thread du parent n'existe plus : on repart de zéro
+            if self._thread is None or self._pid != pid:
+                self._pid = pid
+                self._fd = None
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                name="trace-writer", daemon=True)
+                self._thread.start()
+        return self._queue
+
+    def _run(self, q: queue.Queue):
+        buffer = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if buffer else None
+            try:
+                item = q.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP or isinstance(item, threading.Event):
+                if buffer:
+                    self._safe_write(buffer)
+                    buffer = []
+                if item is _STOP:
+                    return
+                item.set()
+                continue
+
+            if item is not None:
+                if not buffer:
+                    deadline = time.monotonic() + self.flush_interval
+                buffer.append(item)
+
+            if buffer and (len(buffer) >= self.batch_size or time.monotonic() >= deadline):
+                self._safe_write(buffer)
+                buffer = []
+
+    def _safe_write(self, records):
+        try:
+            self._write_batch(records)
+        except Exception as e:  # le thread ne doit jamais mourir
+            logger.error(f"Échec d'écriture de {len(records)} traces : {e}")
+
+    def _write_batch(self, records):
+        started = time.perf_counter()
+        with self._fd_lock:
+            self._append(records)
+        self.written += len(records)
+        self.batches += 1
+        TRACE_WRITE.observe(time.perf_counter() - started)
+        TRACE_RECORDS.inc(len(records))
+
+    def _append(self, records):
+        """Écrit un lot (appelé sous `_fd_lock`) : lignes JSONL, en un seul write() sous flock."""
+        data = "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+        fd = self._open()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            write_all(fd, data)
+            self._sync()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _close_fd(self):
+        self._sync(force=True)
+        os.close(self._fd)
+        self._fd = None
+
+    def _open(self) -> int:
+        """Descripteur O_APPEND, rouvert si le fichier a été supprimé ou remplacé."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if self._fd is not None and inode != self._inode:
+            os.close(self._fd)
+            self._fd = None
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._inode = os.fstat(self._fd).st_ino
+        return self._fd
+
+    def _sync(self, force: bool = False):
+        if self.fsync == "never" and not force:
+            return
+        now = time.monotonic()
+        if force or self.fsync == "batch" or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._fd)
+            self._last_fsync = now
+
+
+def write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+# -----------------------------------------------------
+# Registre process-wide
+# -----------------------------------------------------
+_WRITERS: Dict[Path, TraceWriter] = {}
+_WRITERS_LOCK = threading.Lock()
+
+REGISTRY.register(Gauge(
+    "trace_queue_depth", "Traces en file, pas encore écrites sur disque.",
+    function=lambda: {(): sum(w.stats()["queued"] for w in list(_WRITERS.values()))},
+))
+
+
+def get_trace_writer(path: Path, factory: Type[TraceWriter] = TraceWriter) -> TraceWriter:
+    """
+    Retourne l'unique writer associé à ce chemin (configuré via l'environnement).
+    `factory` choisit le format (ex. SegmentTraceWriter) au premier appel.
+    """
+    key = Path(path).resolve()
+    with _WRITERS_LOCK:
+        writer = _WRITERS.get(key)
+        if writer is None:
+            writer = _WRITERS[key] = factory.from_env(key)
+    return writer
+
+
+def close_trace_writers():
+    """Vide et ferme tous les writers (arrêt propre de l'application)."""
+    for writer in list(_WRITERS.values()):
+        writer.close()
+
+
+atexit.register(close_trace_writers)
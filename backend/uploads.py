@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+# Taille max d'un fichier (octets) et taille des blocs copiés
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+
+@dataclass
+class SpooledUpload:
+    """Fichier reçu, écrit sur disque bloc par bloc."""
+
+    path: Path
+    filename: str
+    content_type: Optional[str]
+    size: int
+    sha256: str
+
+    @property
+    def suffix(self) -> str:
+        return Path(self.filename or "").suffix.lower()
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def spool_upload(upload: UploadFile, dest: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """
+    Copie l'upload vers `dest` par blocs de UPLOAD_CHUNK_SIZE, sans jamais
+    charger le fichier entier en mémoire. Au-delà de `max_bytes` : 413.
+    Le fichier n'apparaît à `dest` qu'une fois complet (écriture dans un .part).
+    """
+    dest = Path(dest)
+    partial = dest.with_name(dest.name + ".part")
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(partial, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Fichier '{upload.filename}' trop volumineux (max {max_bytes // (1024 * 1024)} Mo).",
+                    )
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+        os.replace(partial, dest)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return SpooledUpload(dest, upload.filename, upload.content_type, size, digest.hexdigest())
+
+
+async def spool_to_temp(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """Comme spool_upload(), vers un fichier temporaire (à supprimer via .remove())."""
+    suffix = Path(upload.filename or "").suffix.lower()
+    fd, name = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        return await spool_upload(upload, Path(name), max_bytes)
+    except BaseException:
+        os.remove(name)
+        raise
+
+
+class UploadStore:
+    """
+    Fichiers reçus rangés par contenu : `<sha256><suffixe>` dans `root`.
+
+    Deux envois du même fichier donnent le même nom (dédoublonnage), deux
+    fichiers différents jamais : plusieurs workers ou répliques peuvent
+    partager le répertoire sans verrou. Chaque écriture passe par un fichier
+    temporaire unique dans `staging`, puis un renommage atomique : un envoi
+    en cours n'apparaît jamais dans `root` (servi en statique pour /uploads).
+    `staging` est par défaut voisin de `root`, donc sur le même volume.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = MAX_UPLOAD_BYTES, staging: Optional[Path] = None):
+        self.root = Path(root)
+        self.staging = Path(staging) if staging is not None else self.root.with_name(f".{self.root.name}-staging")
+        self.max_bytes = max_bytes
+
+    async def save(self, upload: UploadFile) -> SpooledUpload:
+        suffix = Path(upload.filename or "").suffix.lower()
+        if not _SAFE_SUFFIX.fullmatch(suffix):
+            suffix = ""
+        self.staging.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(dir=self.staging, prefix="upload-", suffix=".tmp")
+        os.close(fd)
+        try:
+            spooled = await spool_upload(upload, Path(name), self.max_bytes)
+            dest = self.root / f"{spooled.sha256}{suffix}"
+            os.replace(spooled.path, dest)
+        except BaseException:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+            raise
+        spooled.path = dest
+        return spooled
+
+    def find(self, sha256: str, suffix: str = "") -> Optional[Path]:
+        """Fichier déjà stocké pour cette empreinte (None sinon)."""
+        if not _is_digest(sha256):
+            return None
+        path = self.root / f"{sha256}{suffix}"
+        return path if path.is_file() else None
+
+    def url(self, spooled: SpooledUpload) -> str:
+        return f"/uploads/{spooled.path.name}"
+
+
+_SAFE_SUFFIX = re.compile(r"\.[a-z0-9]{1,10}")
+
+
+def _is_digest(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)